@@ -0,0 +1,137 @@
+# --------------------------------
+# Name: check_geodesic.py
+# Purpose: Validates the GEODESIC near engine against the geographiclib reference implementation of the inverse
+# geodesic problem, on random points that include high latitudes and the antimeridian.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import argparse
+import numpy as np
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, "..", "Scripts"))
+import proximity_lib as pl
+try:
+    from geographiclib.geodesic import Geodesic
+except ImportError:
+    Geodesic = None  # The check requires geographiclib
+
+DISTANCE_TOLERANCE = 1e-3  # Meters, Vincenty's formulae are accurate to about 0.1 mm
+AZIMUTH_TOLERANCE = 1e-6  # Degrees, for points more than a meter apart
+
+
+# Function Definitions
+def random_lonlat(count, random_state):
+    """Returns random longitude/latitude points, half spread over the globe and half clustered around the
+    antimeridian and near the poles, where planar shortcuts fail."""
+    global_count = count // 2
+    lon = np.concatenate([random_state.uniform(-180, 180, global_count),
+                          random_state.uniform(175, 185, count - global_count)])
+    lat = np.concatenate([np.degrees(np.arcsin(random_state.uniform(-1, 1, global_count))),
+                          random_state.choice([-1, 1], count - global_count) *
+                          random_state.uniform(60, 89.5, count - global_count)])
+    return np.column_stack([(lon + 180) % 360 - 180, lat])
+
+
+def reference_nearest(in_lonlat, near_lonlat, search_radius=None):
+    """Finds the nearest near point of every input point by brute force with geographiclib.
+    :returns - tuple of (distance, azimuth, near index, second nearest distance) arrays, index -1 without a match"""
+    geodesic = Geodesic.WGS84
+    point_count = len(in_lonlat)
+    distances, azimuths = np.full(point_count, np.inf), np.zeros(point_count)
+    indices, second_distances = np.full(point_count, -1), np.full(point_count, np.inf)
+    for point_index, (lon, lat) in enumerate(in_lonlat):
+        solutions = [geodesic.Inverse(lat, lon, near_lat, near_lon) for near_lon, near_lat in near_lonlat]
+        pair_distances = np.array([solution["s12"] for solution in solutions])
+        if search_radius is not None:
+            pair_distances[pair_distances > search_radius] = np.inf
+        order = np.argsort(pair_distances)
+        if np.isfinite(pair_distances[order[0]]):
+            distances[point_index] = pair_distances[order[0]]
+            azimuths[point_index] = solutions[order[0]]["azi1"]
+            indices[point_index] = order[0]
+        if len(order) > 1:
+            second_distances[point_index] = pair_distances[order[1]]
+    return distances, azimuths, indices, second_distances
+
+
+def check_geodesic(inputs=200, near=500, search_radius=None, seed=0):
+    """Compares geodesic_chained_near_arrays and vincenty_inverse with geographiclib.
+    :param - inputs - number of random input points
+    :param - near - number of random near points
+    :param - search_radius - search radius in meters, None searches all features
+    :param - seed - random seed
+    :returns - dictionary of the largest errors and the number of mismatched nearest features"""
+    random_state = np.random.RandomState(seed)
+    in_lonlat, near_lonlat = random_lonlat(inputs, random_state), random_lonlat(near, random_state)
+    near_oids = np.arange(1, near + 1)
+    layer_results = pl.geodesic_chained_near_arrays(in_lonlat, [("near", near_oids, near_lonlat, near_lonlat)],
+                                                    search_radius)
+    results = layer_results["near"]
+    distances, azimuths, indices, second_distances = reference_nearest(in_lonlat, near_lonlat, search_radius)
+    matched = indices >= 0
+    # Nearest features closer to each other than the tolerance may be found in either order
+    with np.errstate(invalid="ignore"):
+        ambiguous = second_distances - distances <= DISTANCE_TOLERANCE
+    fid_mismatches = int(np.sum(matched & ~ambiguous & (results["FID"] != np.where(matched, near_oids[indices], -1))))
+    match_mismatches = int(np.sum(matched != (results["FID"] != pl.NEAR_NO_MATCH)))
+    distance_errors = np.abs(results["DIST"][matched] - distances[matched])
+    azimuth_check = matched & ~ambiguous & (distances > 1)
+    azimuth_errors = np.abs((results["ANGLE"][azimuth_check] - azimuths[azimuth_check] + 180) % 360 - 180)
+    pair_lon1, pair_lat1 = in_lonlat[:, 0], in_lonlat[:, 1]
+    pair_lon2, pair_lat2 = near_lonlat[:inputs, 0], near_lonlat[:inputs, 1]
+    vincenty_distances = pl.vincenty_inverse(pair_lon1, pair_lat1, pair_lon2, pair_lat2)[0]
+    reference_pairs = [Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2) for lon1, lat1, lon2, lat2 in
+                       zip(pair_lon1, pair_lat1, pair_lon2, pair_lat2)]
+    pair_errors = np.abs(vincenty_distances - np.array([pair["s12"] for pair in reference_pairs]))
+    return {"inputs": inputs, "near": near, "search_radius": search_radius, "matched": int(matched.sum()),
+            "match_mismatches": match_mismatches, "fid_mismatches": fid_mismatches,
+            "max_distance_error_m": float(distance_errors.max()) if len(distance_errors) else 0.0,
+            "max_azimuth_error_deg": float(azimuth_errors.max()) if len(azimuth_errors) else 0.0,
+            "max_pair_distance_error_m": float(pair_errors.max())}
+
+
+def check_passed(result):
+    """Returns true if a check result is within the tolerances."""
+    return result["match_mismatches"] == 0 and result["fid_mismatches"] == 0 and \
+           result["max_distance_error_m"] <= DISTANCE_TOLERANCE and \
+           result["max_azimuth_error_deg"] <= AZIMUTH_TOLERANCE and \
+           result["max_pair_distance_error_m"] <= DISTANCE_TOLERANCE
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone) or imported as a module.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate the GEODESIC near engine against geographiclib.")
+    parser.add_argument("--inputs", type=int, default=200, help="random input points")
+    parser.add_argument("--near", type=int, default=500, help="random near points")
+    parser.add_argument("--search-radius", type=float, nargs="+", default=[None, 500000.0],
+                        help="search radii in meters")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    if Geodesic is None:
+        sys.exit("The geodesic check requires the geographiclib library.")
+    all_passed = True
+    for search_radius in arguments.search_radius:
+        result = check_geodesic(arguments.inputs, arguments.near, search_radius, arguments.seed)
+        passed = check_passed(result)
+        all_passed = all_passed and passed
+        print("{0}: {1}".format("passed" if passed else "FAILED", result))
+    sys.exit(0 if all_passed else 1)
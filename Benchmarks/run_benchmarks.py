@@ -0,0 +1,276 @@
+# --------------------------------
+# Name: run_benchmarks.py
+# Purpose: Runs the proximity tools on synthetic data of increasing size with the arcpy free code paths and records
+# wall time, rows per second, and peak memory to JSON, so that results can be compared between commits.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import argparse, datetime, json, multiprocessing, platform, shutil, subprocess, tempfile, timeit
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "..", "Scripts")
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+sys.path.insert(0, SCRIPTS_DIRECTORY)
+try:
+    import resource
+except ImportError:
+    resource = None  # Peak memory is only recorded on Linux and macOS
+
+BENCHMARK_CASES = ["chained_near", "chained_near_polygons", "near_filter", "chained_scoring", "neighborhood_stats"]
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+
+
+# Function Definitions
+def peak_rss_bytes():
+    """Returns the peak resident set size of the current process in bytes, or None if it is not available."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024  # Linux reports kilobytes
+
+
+def copy_dataset_file(dataset, directory):
+    """Copies the file holding a generated dataset into a directory, so every case runs on unmodified data.
+    :returns - path of the dataset in the copy"""
+    import proximity_lib as pl
+    path, layer = pl.split_dataset_path(dataset)
+    copied_path = os.path.join(directory, os.path.basename(path))
+    if not os.path.exists(copied_path):
+        shutil.copyfile(path, copied_path)
+    return os.path.join(copied_path, layer) if layer else copied_path
+
+
+def run_case(case, datasets, options, work_directory):
+    """Runs one benchmark case on copies of the generated datasets and checks that the tool wrote its output.
+    :returns - tuple of (wall time in seconds, output check passed)"""
+    import proximity_lib as pl
+    import ChainedNearAnalysis, ChainedNearAnalysisFilter, ChainedScoring, NeighborStatistics
+    backend = pl.get_backend(backend="OPEN")
+    if case == "chained_near":
+        in_fc = copy_dataset_file(datasets["points"], work_directory)
+        near_features = [copy_dataset_file(feature, work_directory) for feature in datasets["near"]]
+        start = timeit.default_timer()
+        ChainedNearAnalysis.chained_near_analysis(in_fc, near_features, None, True, True, True, backend=backend,
+                                                  workers=options["workers"])
+        output_fc, output_field = in_fc, "DIST_" + backend.dataset_name(near_features[-1])
+    elif case == "chained_near_polygons":
+        in_fc = copy_dataset_file(datasets["polygons"], work_directory)
+        near_feature = copy_dataset_file(datasets["lines"], work_directory)
+        start = timeit.default_timer()
+        ChainedNearAnalysis.chained_near_analysis(in_fc, [near_feature], None, True, True, True, backend=backend)
+        output_fc, output_field = in_fc, "DIST_" + backend.dataset_name(near_feature)
+    elif case == "near_filter":
+        in_fc = copy_dataset_file(datasets["points"], work_directory)
+        near_feature = copy_dataset_file(datasets["categorized"], work_directory)
+        start = timeit.default_timer()
+        ChainedNearAnalysisFilter.chained_near_analysis_filter(in_fc, near_feature, "CATEGORY", None, False, False,
+                                                               True, backend=backend, workers=options["workers"])
+        output_fc, output_field = in_fc, "DIST_F_cafe"
+    elif case == "chained_scoring":
+        in_fc = copy_dataset_file(datasets["points"], work_directory)
+        start = timeit.default_timer()
+        ChainedScoring.chained_scoring_func(in_fc, ["V1", "V2", "V3"], 20, 5, 1, 0, backend=backend)
+        output_fc, output_field = in_fc, "SCORE_V3"
+    elif case == "neighborhood_stats":
+        in_fc = copy_dataset_file(datasets["polygons"], work_directory)
+        path, layer = pl.split_dataset_path(in_fc)
+        output_fc = os.path.join(path, "stats_output") if layer else os.path.join(work_directory,
+                                                                                    "stats_output.parquet")
+        start = timeit.default_timer()
+        NeighborStatistics.compute_neighborhood_stats(in_fc, ["POP", "JOBS"], datasets["swm"], output_fc,
+                                                      ["sum", "mean", "std"], True, backend=backend)
+        output_field = "w_std_JOBS"
+    else:
+        raise ValueError("Unknown benchmark case {0}, use one of {1}.".format(case, ", ".join(BENCHMARK_CASES)))
+    wall_time = timeit.default_timer() - start
+    return wall_time, backend.field_exist(output_fc, output_field)
+
+
+def case_process(case, datasets, options, result_queue):
+    """Runs a benchmark case in a fresh process, so the peak memory of every case is measured on its own. The stage
+    timings of the tool are recorded with a RunReport."""
+    work_directory = tempfile.mkdtemp(prefix="case_", dir=options["data_directory"])
+    try:
+        import proximity_lib, ChainedNearAnalysis, ChainedNearAnalysisFilter, ChainedScoring, NeighborStatistics
+        import_rss = peak_rss_bytes()
+        with proximity_lib.RunReport(name=case) as run_report:
+            wall_time, output_written = run_case(case, datasets, options, work_directory)
+        result_queue.put({"wall_seconds": wall_time, "status": "ok" if output_written else "no output",
+                          "import_rss_bytes": import_rss, "peak_rss_bytes": peak_rss_bytes(),
+                          "stages": run_report.stages})
+    except Exception as e:
+        result_queue.put({"status": "error: {0}".format(e)})
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def benchmark_datasets(rows, options):
+    """Generates the datasets of one size, or reuses them if they were generated with the same options."""
+    import synthetic_data
+    directory = os.path.join(options["data_directory"], "{0}_{1}".format(options["format"], rows))
+    manifest_path = os.path.join(directory, "manifest.json")
+    data_options = dict((key, options[key]) for key in ["near_share", "near_layers", "neighbors", "seed", "format"])
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["options"] == data_options:
+            return manifest["datasets"], 0.0
+    shutil.rmtree(directory, ignore_errors=True)
+    start = timeit.default_timer()
+    datasets = synthetic_data.generate_benchmark_data(directory, rows, options["near_share"], options["near_layers"],
+                                                      options["neighbors"], options["seed"], options["format"])
+    generation_time = timeit.default_timer() - start
+    with open(manifest_path, "w") as manifest_file:
+        json.dump({"options": data_options, "datasets": datasets}, manifest_file, indent=2)
+    return datasets, generation_time
+
+
+def git_commit():
+    """Returns the commit the benchmark ran on, or None outside of a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIRECTORY,
+                                       stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_report():
+    """Describes the machine and the library versions the benchmark ran with."""
+    import numpy, scipy, shapely, pyogrio
+    return {"commit": git_commit(), "timestamp": datetime.datetime.now().isoformat(),
+            "platform": platform.platform(), "python": platform.python_version(),
+            "cpu_count": multiprocessing.cpu_count(), "numpy": numpy.__version__, "scipy": scipy.__version__,
+            "shapely": shapely.__version__, "pyogrio": pyogrio.__version__}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=BENCHMARK_CASES, output=None, data_directory=None, data_format="gpkg",
+                   workers=1, repeat=1, near_share=0.1, near_layers=3, neighbors=8, seed=0, keep_data=False):
+    """Runs every benchmark case at every size and writes the results to a JSON file.
+    :param - sizes - input row counts
+    :param - cases - benchmark cases, see BENCHMARK_CASES
+    :param - output - JSON output path, by default results/benchmark_{commit}.json next to this script
+    :param - data_directory - directory of the generated data, by default a temporary directory
+    :param - data_format - "gpkg" or "parquet"
+    :param - workers - workers parameter of the near tools
+    :param - repeat - number of runs of every case, all runs are recorded
+    :param - near_share - near feature count as a share of the input rows
+    :param - near_layers - number of near point layers of the chained near case
+    :param - neighbors - neighbors per feature in the SWM
+    :param - seed - random seed of the generator
+    :param - keep_data - keep the generated data for later runs
+    :returns - dictionary written to the output"""
+    import proximity_lib as pl
+    options = {"data_directory": data_directory or os.path.join(tempfile.gettempdir(), "proximity_benchmarks"),
+               "format": data_format, "workers": workers, "near_share": near_share, "near_layers": near_layers,
+               "neighbors": neighbors, "seed": seed}
+    if not os.path.isdir(options["data_directory"]):
+        os.makedirs(options["data_directory"])
+    report = {"environment": environment_report(), "options": options, "results": []}
+    context = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+    for rows in sizes:
+        datasets, generation_time = benchmark_datasets(rows, options)
+        pl.arc_print("Benchmarking {0} rows (data generated in {1:.1f} seconds)...".format(rows, generation_time),
+                     True)
+        for case in cases:
+            for run in range(repeat):
+                result_queue = context.Queue()
+                process = context.Process(target=case_process, args=(case, datasets, options, result_queue))
+                process.start()
+                result = result_queue.get()
+                process.join()
+                result.update({"case": case, "rows": rows, "run": run})
+                if "wall_seconds" in result:
+                    result["rows_per_second"] = rows / result["wall_seconds"] if result["wall_seconds"] else None
+                    for key in ["import_rss_bytes", "peak_rss_bytes"]:
+                        result[key.replace("_bytes", "_mb")] = result.pop(key) / 1048576.0 \
+                            if result[key] is not None else None
+                    pl.arc_print("{case}, {rows} rows: {wall_seconds:.2f} s, {rows_per_second:,.0f} rows/s, "
+                                 "peak RSS {0} MB ({status})".format(
+                                     "{0:.0f}".format(result["peak_rss_mb"]) if result["peak_rss_mb"] else "n/a",
+                                     **result))
+                else:
+                    pl.arc_print("{case}, {rows} rows: {status}".format(**result))
+                report["results"].append(result)
+        if not keep_data:
+            shutil.rmtree(os.path.join(options["data_directory"], "{0}_{1}".format(data_format, rows)),
+                          ignore_errors=True)
+    output = output or os.path.join(BENCHMARK_DIRECTORY, "results", "benchmark_{0}.json".format(
+        report["environment"]["commit"] or "local"))
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    pl.arc_print("Wrote benchmark results to {0}.".format(output), True)
+    return report
+
+
+def compare_benchmarks(baseline_path, candidate_path):
+    """Prints the rows per second and peak memory of two benchmark result files side by side, using the fastest run
+    of every case and size.
+    :returns - list of (case, rows, baseline rows/s, candidate rows/s, speedup) tuples"""
+    def best_runs(path):
+        with open(path) as result_file:
+            results = json.load(result_file)["results"]
+        best = {}
+        for result in results:
+            key = (result["case"], result["rows"])
+            if result.get("rows_per_second") and (key not in best or result["rows_per_second"] >
+                                                  best[key]["rows_per_second"]):
+                best[key] = result
+        return best
+
+    baseline, candidate = best_runs(baseline_path), best_runs(candidate_path)
+    comparison = []
+    print("{0:<24}{1:>12}{2:>18}{3:>18}{4:>10}{5:>14}".format("case", "rows", "baseline rows/s", "candidate rows/s",
+                                                             "speedup", "peak MB"))
+    for key in sorted(set(baseline) & set(candidate)):
+        speedup = candidate[key]["rows_per_second"] / baseline[key]["rows_per_second"]
+        comparison.append(key + (baseline[key]["rows_per_second"], candidate[key]["rows_per_second"], speedup))
+        print("{0:<24}{1:>12}{2:>18,.0f}{3:>18,.0f}{4:>9.2f}x{5:>14}".format(
+            key[0], key[1], baseline[key]["rows_per_second"], candidate[key]["rows_per_second"], speedup,
+            "{0:.0f} -> {1:.0f}".format(baseline[key]["peak_rss_mb"] or 0, candidate[key]["peak_rss_mb"] or 0)))
+    return comparison
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone) or imported as a module.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the proximity tools on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="input row counts")
+    parser.add_argument("--cases", nargs="+", default=BENCHMARK_CASES, choices=BENCHMARK_CASES)
+    parser.add_argument("--output", help="JSON output path")
+    parser.add_argument("--data-directory", help="directory of the generated data")
+    parser.add_argument("--format", default="gpkg", choices=["gpkg", "parquet"])
+    parser.add_argument("--workers", type=int, default=1, help="workers of the near tools, 0 uses every cpu")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--near-share", type=float, default=0.1, help="near features per input row")
+    parser.add_argument("--near-layers", type=int, default=3)
+    parser.add_argument("--neighbors", type=int, default=8, help="neighbors per feature in the SWM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-data", action="store_true", help="keep the generated data for later runs")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="compare two result files instead of running the benchmarks")
+    arguments = parser.parse_args()
+    if arguments.compare:
+        compare_benchmarks(*arguments.compare)
+    else:
+        run_benchmarks(arguments.sizes, arguments.cases, arguments.output, arguments.data_directory,
+                       arguments.format, arguments.workers, arguments.repeat, arguments.near_share,
+                       arguments.near_layers, arguments.neighbors, arguments.seed, arguments.keep_data)
@@ -0,0 +1,176 @@
+# --------------------------------
+# Name: synthetic_data.py
+# Purpose: Deterministic synthetic datasets and spatial weights matrices for benchmarking the proximity tools.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+from collections import OrderedDict
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+import proximity_lib as pl
+
+BENCHMARK_CRS = "EPSG:3857"
+BENCHMARK_EXTENT = (-13650000.0, 4530000.0, -13600000.0, 4580000.0)  # 50 km square around San Francisco
+CATEGORY_VALUES = ["cafe", "restaurant", "school", "library", "park", "clinic", "grocery", "transit"]
+
+
+# Function Definitions
+def random_points(count, seed=0, extent=BENCHMARK_EXTENT, cluster_share=0.7, cluster_count=50):
+    """Generates points where a share of the points is drawn around clusters and the rest is uniform, which is
+    closer to real facility data than a uniform distribution.
+    :param - count - number of points
+    :param - seed - random seed, the same seed always returns the same points
+    :param - extent - (xmin, ymin, xmax, ymax) of the points
+    :param - cluster_share - share of the points drawn around the clusters
+    :param - cluster_count - number of clusters
+    :returns - count x 2 coordinate array"""
+    random_state = np.random.RandomState(seed)
+    xmin, ymin, xmax, ymax = extent
+    size = np.array([xmax - xmin, ymax - ymin])
+    clustered_count = int(count * cluster_share)
+    centers = random_state.uniform(0, 1, (cluster_count, 2)) * size
+    spreads = random_state.uniform(0.005, 0.03, cluster_count) * size.min()
+    membership = random_state.randint(0, cluster_count, clustered_count)
+    clustered = centers[membership] + random_state.normal(0, 1, (clustered_count, 2)) * spreads[membership, None]
+    uniform = random_state.uniform(0, 1, (count - clustered_count, 2)) * size
+    xy = np.vstack([clustered, uniform])[random_state.permutation(count)]
+    return np.clip(xy, 0, size) + [xmin, ymin]
+
+
+def random_lines(count, seed=0, extent=BENCHMARK_EXTENT, vertex_count=4, segment_length=200.0):
+    """Generates random walk line strings starting at clustered points.
+    :param - count - number of lines
+    :param - seed - random seed
+    :param - extent - extent of the starting points
+    :param - vertex_count - number of vertices of every line
+    :param - segment_length - standard deviation of the segment lengths in dataset units
+    :returns - numpy array of shapely line strings"""
+    random_state = np.random.RandomState(seed + 1)
+    starts = random_points(count, seed, extent)
+    steps = random_state.normal(0, segment_length, (count, vertex_count - 1, 2))
+    vertices = np.concatenate([starts[:, None, :], starts[:, None, :] + np.cumsum(steps, axis=1)], axis=1)
+    return shapely.linestrings(vertices.reshape(-1, 2), indices=np.repeat(np.arange(count), vertex_count))
+
+
+def grid_polygons(count, extent=BENCHMARK_EXTENT):
+    """Generates a grid of square polygons covering the extent, so that neighboring polygons share edges.
+    :param - count - minimum number of polygons, the grid is trimmed to exactly count polygons row by row
+    :param - extent - extent covered by the grid
+    :returns - tuple of (numpy array of shapely polygons, count x 2 array of their centroids)"""
+    xmin, ymin, xmax, ymax = extent
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(float(count) / columns))
+    width, height = (xmax - xmin) / columns, (ymax - ymin) / rows
+    cells = np.arange(count)
+    cell_xmin = xmin + (cells % columns) * width
+    cell_ymin = ymin + (cells // columns) * height
+    polygons = shapely.box(cell_xmin, cell_ymin, cell_xmin + width, cell_ymin + height)
+    return polygons, np.column_stack([cell_xmin + width / 2.0, cell_ymin + height / 2.0])
+
+
+def random_fields(count, field_names, seed=0):
+    """Generates lognormal numeric fields, skewed like densities and counts.
+    :param - count - number of rows
+    :param - field_names - names of the fields
+    :param - seed - random seed
+    :returns - ordered dictionary of float64 arrays keyed by field name"""
+    random_state = np.random.RandomState(seed + 2)
+    return OrderedDict((field_name, random_state.lognormal(2.0, 1.0, count)) for field_name in field_names)
+
+
+def write_features(dataset, geometries, fields=None, geometry_type="Point"):
+    """Writes generated geometries and fields with an integer UID field, which is the unique id of the SWMs.
+    :param - dataset - output dataset path (GeoPackage layer, shapefile, or GeoParquet file)
+    :param - geometries - numpy array of shapely geometries
+    :param - fields - ordered dictionary of field arrays
+    :param - geometry_type - OGR geometry type name
+    :returns - dataset path"""
+    all_fields = OrderedDict([("UID", np.arange(len(geometries), dtype=np.int32))])
+    all_fields.update(fields or {})
+    pl.write_open_dataset(dataset, geometries, all_fields, BENCHMARK_CRS, geometry_type)
+    return dataset
+
+
+def knn_spatial_weights(xy, neighbor_count=8, inverse_distance=True, row_standardized=True):
+    """Builds k nearest neighbor spatial weights, where the neighbor count controls the density of the matrix.
+    :param - xy - n x 2 coordinates of the features, the row number is the UID
+    :param - neighbor_count - number of neighbors of every feature
+    :param - inverse_distance - weight the neighbors by inverse distance, otherwise all weights are 1
+    :param - row_standardized - divide the weights of every row by their sum
+    :returns - SpatialWeights namedtuple"""
+    feature_count = len(xy)
+    neighbor_count = min(neighbor_count, feature_count - 1)
+    distances, indices = cKDTree(xy).query(xy, k=neighbor_count + 1)
+    distances, indices = distances[:, 1:], indices[:, 1:]
+    weights = 1.0 / np.maximum(distances, 1e-9) if inverse_distance else np.ones_like(distances)
+    if row_standardized:
+        weights = weights / weights.sum(axis=1, keepdims=True)
+    header = {"SPATIALREFNAME": "WGS_1984_Web_Mercator_Auxiliary_Sphere", "WTYPE": "2",
+              "DISTANCEMETHOD": "EUCLIDEAN", "NUMNEIGHS": str(neighbor_count)}
+    return pl.SpatialWeights("UID", np.arange(feature_count, dtype=np.int64),
+                             np.arange(0, feature_count * neighbor_count + 1, neighbor_count, dtype=np.int64),
+                             indices.ravel().astype(np.int64), weights.ravel(), row_standardized, header)
+
+
+def generate_benchmark_data(directory, rows, near_share=0.1, near_layer_count=3, neighbor_count=8, seed=0,
+                            data_format="gpkg"):
+    """Generates the datasets of one benchmark size.
+    :param - directory - output directory
+    :param - rows - number of input features
+    :param - near_share - near feature count as a share of the input rows
+    :param - near_layer_count - number of near point layers
+    :param - neighbor_count - neighbors per feature in the SWM
+    :param - seed - random seed
+    :param - data_format - "gpkg" writes one GeoPackage with a layer per dataset, "parquet" writes GeoParquet files
+    :returns - dictionary of dataset paths keyed by role"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    near_rows = max(int(rows * near_share), 1)
+    if data_format == "gpkg":
+        def dataset_path(name):
+            return os.path.join(directory, "benchmark_{0}.gpkg".format(rows), name)
+    else:
+        def dataset_path(name):
+            return os.path.join(directory, "{0}_{1}.parquet".format(name, rows))
+    datasets = {}
+    pl.arc_print("Generating {0} input points...".format(rows), True)
+    datasets["points"] = write_features(dataset_path("points"), shapely.points(random_points(rows, seed)),
+                                        random_fields(rows, ["V1", "V2", "V3"], seed))
+    datasets["near"] = []
+    for layer_index in range(near_layer_count):
+        near_seed = seed + 100 * (layer_index + 1)
+        datasets["near"].append(write_features(dataset_path("near_{0}".format(layer_index)),
+                                               shapely.points(random_points(near_rows, near_seed))))
+    random_state = np.random.RandomState(seed + 3)
+    categories = np.array(CATEGORY_VALUES, dtype=object)[random_state.randint(0, len(CATEGORY_VALUES), near_rows)]
+    datasets["categorized"] = write_features(dataset_path("categorized"),
+                                             shapely.points(random_points(near_rows, seed + 7)),
+                                             OrderedDict([("CATEGORY", categories)]))
+    pl.arc_print("Generating {0} polygons and lines...".format(rows), True)
+    polygons, centroids = grid_polygons(rows)
+    datasets["polygons"] = write_features(dataset_path("polygons"), polygons,
+                                          random_fields(rows, ["POP", "JOBS"], seed), "Polygon")
+    datasets["lines"] = write_features(dataset_path("lines"), random_lines(near_rows, seed + 11), None, "LineString")
+    datasets["swm"] = os.path.join(directory, "knn_{0}_{1}.swm".format(neighbor_count, rows))
+    pl.write_swm(datasets["swm"], knn_spatial_weights(centroids, neighbor_count))
+    return datasets
@@ -0,0 +1,128 @@
+# --------------------------------
+# Name: AccessibilityMetrics.py
+# Purpose: This tool will add accessibility fields (counts, attribute sums, gravity and kernel weighted sums of the
+# near features within a search radius) for every Near Feature input into the Input Features dataset.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# ArcGIS Version:   10.4.1
+# ArcGIS Pro Version: 2.7
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import numpy as np
+import proximity_lib as pl
+pd = pl.pd  # Imported on first use
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
+
+METRIC_FIELD_PREFIXES = {"COUNT": "COUNT_", "SUM": "SUM_", "GRAVITY": "GRAV_", "GAUSSIAN": "GAUSS_",
+                         "EPANECHNIKOV": "EPAN_"}
+
+
+# Function Definitions
+def read_near_values(near_features, near_layers, weight_field, backend):
+    """Reads the weight field of every near feature class, ordered like the object ids of its near layer. Null
+    values weigh 0."""
+    near_values = {}
+    for feature, (layer_name, near_oids, near_xy) in zip(near_features, near_layers):
+        value_oids, value_block = backend.read_numeric_block(feature.strip("'"), [weight_field])
+        values = value_block[pd.Index(value_oids).get_indexer(near_oids), 0]
+        near_values[layer_name] = np.nan_to_num(values)
+    return near_values
+
+
+def accessibility_metrics(in_fc, near_features, search_radius, metrics=("COUNT",), weight_field=None,
+                          distance_decay=1.0, bandwidth=None, minimum_distance=1.0, backend=None, workers=1,
+                          index_cache=None, sidecar_table=None):
+    """This tool will add accessibility fields for every Near Feature input into the Input Features dataset, such as
+    the number of grocery stores within a mile or a gravity sum of jobs. For every near feature class and metric a
+    field is added (COUNT_, SUM_, GRAV_, GAUSS_, or EPAN_ + feature class name). COUNT counts the near features
+    within the search radius, SUM sums their weight field, GRAVITY sums weight / distance ^ distance_decay, and
+    GAUSSIAN and EPANECHNIKOV sum the weights with a kernel of the bandwidth (the search radius by default), see
+    proximity_lib.accessibility_weights. Without a weight field every near feature weighs 1. Distances below
+    minimum_distance count as minimum_distance in the GRAVITY metric. Distances are planar, and the search radius,
+    bandwidth, and minimum distance are in the units of the input features unless they carry a unit. The near
+    features are found with batched KD-tree ball queries (features are read as points or centroids), the workers
+    parameter fans the queries out over a process pool (0 uses every cpu), and index_cache keeps the near feature
+    KD-trees on disk between runs like in chained_near_analysis. With a sidecar_table the fields are written to that
+    table keyed by IN_FID (see proximity_lib.SidecarBackend) and the input features are left unchanged."""
+    try:
+        backend = pl.get_backend(in_fc, backend)
+        if sidecar_table:
+            backend = pl.SidecarBackend(backend, sidecar_table)
+        near_features = [feature.strip("'") for feature in near_features]
+        metrics = [str(metric).upper() for metric in metrics]
+        if "SUM" in metrics and not weight_field:
+            raise ValueError("The SUM metric requires a weight field.")
+        spatial_reference = backend.spatial_reference(in_fc)
+        radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+        if radius is None:
+            raise ValueError("Accessibility metrics require a search radius.")
+        if bandwidth is not None:
+            bandwidth = pl.linear_unit_to_dataset_units(bandwidth, spatial_reference)
+        minimum_distance = pl.linear_unit_to_dataset_units(minimum_distance, spatial_reference)
+        pl.arc_print("Reading input feature coordinates...", True)
+        with pl.stage_timer("read input") as stage:
+            in_oids, in_xy = backend.read_points(in_fc)
+            stage.rows = len(in_oids)
+        near_layers, near_trees = pl.read_near_layers(near_features, spatial_reference, index_cache=index_cache,
+                                                      backend=backend)
+        near_values = None
+        if weight_field:
+            pl.arc_print("Reading near feature weights from {0}...".format(weight_field), True)
+            with pl.stage_timer("read weights"):
+                near_values = read_near_values(near_features, near_layers, weight_field, backend)
+        pl.arc_print("Computing accessibility metrics within {0}...".format(search_radius), True)
+        with pl.stage_timer("query", len(in_oids)):
+            layer_results = pl.accessibility_arrays(in_xy, near_layers, radius, metrics, near_values, distance_decay,
+                                                    bandwidth, minimum_distance, workers, near_trees=near_trees)
+        with pl.stage_timer("add fields"), pl.SchemaManager(in_fc, backend) as schema:
+            new_columns = []
+            for layer_name, near_oids, near_xy in near_layers:
+                pl.arc_print("Adding accessibility fields for {0}.".format(layer_name))
+                for metric in metrics:
+                    new_field_name = METRIC_FIELD_PREFIXES[metric] + layer_name
+                    valid_field_name = schema.validate_field_name(new_field_name)
+                    schema.add_field(valid_field_name, "DOUBLE", field_alias=new_field_name)
+                    new_columns.append((valid_field_name, layer_results[layer_name][metric]))
+        pl.arc_print("Writing accessibility fields...", True)
+        with pl.stage_timer("write", len(in_oids)):
+            backend.write_columns(in_fc, in_oids, new_columns, [0] * len(new_columns))
+        pl.arc_print("Script Completed Successfully.", True)
+    except Exception as e:
+        pl.arc_print(str(e.args[0]))
+        print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone), in a Python IDE,
+# as a geoprocessing script tool, or as a module imported in
+# another script
+if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
+    input_features = arcpy.GetParameterAsText(0)
+    near_features = str(arcpy.GetParameterAsText(1)).split(";")
+    search_radius = arcpy.GetParameter(2)
+    metrics = str(arcpy.GetParameterAsText(3)).split(";")
+    weight_field = arcpy.GetParameterAsText(4)
+    distance_decay = arcpy.GetParameter(5) or 1.0
+    bandwidth = arcpy.GetParameter(6)
+    accessibility_metrics(input_features, near_features, search_radius, metrics, weight_field, distance_decay,
+                          bandwidth)
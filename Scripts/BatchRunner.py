@@ -0,0 +1,169 @@
+# --------------------------------
+# Name: BatchRunner.py
+# Purpose: This script will run a job file of proximity tool calls in one long lived process or worker pool, so the
+# interpreter start up, library imports, and near feature spatial indexes are shared by every job.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# ArcGIS Version:   10.4.1
+# ArcGIS Pro Version: 2.7
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import argparse, importlib, json, timeit
+import proximity_lib as pl
+try:
+    import yaml
+except ImportError:
+    yaml = None  # Job files must be JSON
+
+# Tools a job can run, by name, with the module and function implementing them. Modules are imported by the first
+# job that uses them.
+TOOL_FUNCTIONS = {"chained_near_analysis": ("ChainedNearAnalysis", "chained_near_analysis"),
+                  "chained_near_analysis_filter": ("ChainedNearAnalysisFilter", "chained_near_analysis_filter"),
+                  "chained_scoring_func": ("ChainedScoring", "chained_scoring_func"),
+                  "compute_neighborhood_stats": ("NeighborStatistics", "compute_neighborhood_stats"),
+                  "chained_near_scoring": ("ChainedNearScoring", "chained_near_scoring"),
+                  "accessibility_metrics": ("AccessibilityMetrics", "accessibility_metrics"),
+                  "generate_spatial_weights": ("GenerateSpatialWeights", "generate_spatial_weights")}
+WORKER_INDEX_CACHE = None  # Spatial index cache of a batch pool worker, shared by the jobs the worker runs
+
+
+# Function Definitions
+def read_jobs(job_file):
+    """Reads a job file, a JSON or YAML list of jobs (or a mapping with a jobs list). Every job is a mapping with the
+    tool name, and optionally a list of positional args and a mapping of keyword parameters, for example
+    {"tool": "chained_near_analysis", "args": ["data.gpkg/homes", ["data.gpkg/parks"]],
+    "parameters": {"search_radius": 800, "backend": "OPEN"}}."""
+    with open(job_file) as job_stream:
+        if os.path.splitext(job_file)[1].lower() in [".yml", ".yaml"]:
+            if yaml is None:
+                raise ValueError("Reading YAML job files requires the PyYAML library.")
+            jobs = yaml.safe_load(job_stream)
+        else:
+            jobs = json.load(job_stream)
+    if isinstance(jobs, dict):
+        jobs = jobs["jobs"]
+    for job_number, job in enumerate(jobs):
+        if job.get("tool") not in TOOL_FUNCTIONS:
+            raise ValueError("Job {0} runs the unknown tool {1}. The batch runner runs {2}.".format(
+                job_number + 1, job.get("tool"), ", ".join(sorted(TOOL_FUNCTIONS))))
+    return jobs
+
+
+def tool_function(tool_name):
+    """Returns the function of a tool, importing its module on first use."""
+    module_name, function_name = TOOL_FUNCTIONS[tool_name]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def batch_index_cache(index_cache=True, memory_entries=32):
+    """Returns the spatial index cache shared by the jobs of a batch. It keeps up to memory_entries loaded near
+    layers and KD-trees in memory, so later jobs of the same process reuse them without loading them again.
+    :param - index_cache - NearIndexCache, cache directory, True for the default directory, or None/False to disable
+    :param - memory_entries - number of loaded cache entries kept in memory
+    :returns - NearIndexCache or None"""
+    if isinstance(index_cache, pl.NearIndexCache) or not index_cache:
+        return index_cache or None
+    return pl.NearIndexCache(None if index_cache is True else str(index_cache), memory_entries=memory_entries)
+
+
+def run_job(job, index_cache=None):
+    """Runs one job. The shared index cache is passed to tools that accept one unless the job sets its own. A job
+    that raises an error is recorded as failed, so the other jobs of the batch still run.
+    :param - job - job mapping, see read_jobs
+    :param - index_cache - NearIndexCache shared by the jobs, or None
+    :returns - tuple of (job name, seconds, tool return value, error message or None)"""
+    function = tool_function(job["tool"])
+    args = list(job.get("args", []))
+    parameters = dict(job.get("parameters", {}))
+    argument_names = function.__code__.co_varnames[:function.__code__.co_argcount]
+    if index_cache is not None and "index_cache" in argument_names and "index_cache" not in parameters and \
+            argument_names.index("index_cache") >= len(args):
+        parameters["index_cache"] = index_cache
+    job_name = job.get("name", job["tool"])
+    pl.arc_print("Running job {0}...".format(job_name), True)
+    start_time = timeit.default_timer()
+    try:
+        result = function(*args, **parameters)
+    except Exception as e:
+        return job_name, timeit.default_timer() - start_time, None, "{0}: {1}".format(type(e).__name__, e)
+    return job_name, timeit.default_timer() - start_time, result, None
+
+
+def initialize_batch_worker(index_cache, memory_entries):
+    """Pool initializer giving every worker its own long lived spatial index cache."""
+    global WORKER_INDEX_CACHE
+    WORKER_INDEX_CACHE = batch_index_cache(index_cache, memory_entries)
+
+
+def batch_worker(job):
+    """Pool worker of run_batch."""
+    return run_job(job, WORKER_INDEX_CACHE)
+
+
+def run_batch(jobs, workers=1, index_cache=True, memory_entries=32):
+    """Runs a list of jobs in this process, or in a pool of worker processes that stay alive for the whole batch, so
+    the interpreter start up and library imports are paid once per process instead of once per tool call, and near
+    feature spatial indexes are loaded once and shared by the jobs of a process through the index cache. With one
+    worker the jobs run in order. With more workers they run concurrently, so jobs that read the outputs of other
+    jobs, or write to the same dataset, belong in separate batches.
+    :param - jobs - list of job mappings, see read_jobs
+    :param - workers - number of processes, 1 runs the jobs in this process and 0 uses every cpu
+    :param - index_cache - cache directory, True for the default directory, or None/False to disable the cache
+    :param - memory_entries - number of loaded cache entries every process keeps in memory
+    :returns - list of (job name, seconds, tool return value, error message or None) tuples in job order"""
+    workers = min(pl.near_worker_count(workers), max(len(jobs), 1))
+    start_time = timeit.default_timer()
+    if workers > 1:
+        pool = pl.process_pool(workers, initialize_batch_worker, (index_cache, memory_entries))
+        try:
+            job_results = pool.map(batch_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        shared_cache = batch_index_cache(index_cache, memory_entries)
+        job_results = [run_job(job, shared_cache) for job in jobs]
+    for job_name, job_seconds, result, error in job_results:
+        if error is None:
+            pl.arc_print("Job {0} finished in {1:.2f} seconds.".format(job_name, job_seconds))
+        else:
+            pl.arc_print("Job {0} failed after {1:.2f} seconds: {2}".format(job_name, job_seconds, error))
+    failed_jobs = sum(1 for job_result in job_results if job_result[3] is not None)
+    pl.arc_print("Ran {0} jobs in {1:.2f} seconds, {2} failed.".format(len(job_results),
+                                                                       timeit.default_timer() - start_time,
+                                                                       failed_jobs), True)
+    return job_results
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone), in a Python IDE,
+# as a geoprocessing script tool, or as a module imported in
+# another script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a job file of proximity tool calls in one process.")
+    parser.add_argument("job_file", help="JSON or YAML list of jobs")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, 0 uses every cpu")
+    parser.add_argument("--index-cache", default=True, help="spatial index cache directory")
+    parser.add_argument("--no-index-cache", action="store_true", help="do not cache near feature indexes")
+    parser.add_argument("--memory-entries", type=int, default=32, help="cache entries kept in memory per process")
+    arguments = parser.parse_args()
+    batch_results = run_batch(read_jobs(arguments.job_file), arguments.workers,
+                              None if arguments.no_index_cache else arguments.index_cache, arguments.memory_entries)
+    sys.exit(1 if any(error is not None for job_name, job_seconds, result, error in batch_results) else 0)
@@ -24,29 +24,377 @@
 # limitations under the License.
 # --------------------------------
 # Import Modules
-import os, sys, arcpy
+import os, sys
+import numpy as np
 import proximity_lib as pl
+from collections import OrderedDict
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
+
+
+# Function Definitions
+def chained_near_kdtree(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                        backend=None, workers=1, method="PLANAR", index_cache=None):
+    """Computes the chained near fields with the in process KD-tree engine. The input and every near feature class
+    are read once, all near layers are queried in one sweep, and the new fields are written in one pass. The
+    GEODESIC method indexes the features on the unit sphere and refines the candidates with ellipsoidal distances
+    in a single process. Near layers and their KD-trees are loaded from index_cache when it holds them."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    geodesic = str(method or "PLANAR").upper() == "GEODESIC"
+    geographic_reference = None
+    if geodesic:
+        geographic_reference, ellipsoid = backend.geographic_coordinate_system(spatial_reference)
+    pl.arc_print("Reading input feature coordinates...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_xy = backend.read_points(in_fc, spatial_reference=geographic_reference)
+        stage.rows = len(in_oids)
+    near_layers, near_trees = pl.read_near_layers(near_features, spatial_reference, geographic_reference,
+                                                  index_cache, backend)
+    pl.arc_print("Querying spatial indexes of all near features...", True)
+    with pl.stage_timer("query", len(in_oids)):
+        if geodesic:
+            layer_results = pl.geodesic_chained_near_arrays(in_xy, near_layers,
+                                                            pl.linear_unit_to_meters(search_radius,
+                                                                                     spatial_reference),
+                                                            ellipsoid, near_trees=near_trees)
+            pl.meters_to_dataset_units(layer_results, spatial_reference)
+        else:
+            radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+            layer_results = pl.chained_near_arrays(in_xy, near_layers, radius, workers=workers,
+                                                   near_trees=near_trees)
+    with pl.stage_timer("add fields"):
+        new_columns, no_match_values = pl.add_near_result_fields(in_fc, layer_results,
+                                                                 [layer[0] for layer in near_layers], location, angle,
+                                                                 fid, backend)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, new_columns, no_match_values)
+
+
+def chained_near_knn(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                     backend=None, k=1, radius_all=False, near_table=None, index_cache=None, max_pairs=1000000):
+    """Computes the k nearest features of every near layer, or every near feature within the search radius, from one
+    KD-tree query per layer. Without a near table, the ranked results are written as numbered fields (DIST1_,
+    DIST2_, ...). With a near table, the (input, near feature) pairs are written as a long format table (IN_FID,
+    NEAR_LAYER, NEAR_RANK, NEAR_FID, NEAR_DIST) in chunks of at most about max_pairs rows instead, and the input
+    features are not changed. Returns the number of near table rows written, or None."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    pl.arc_print("Reading input feature coordinates...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_xy = backend.read_points(in_fc)
+        stage.rows = len(in_oids)
+    near_layers, near_trees = pl.read_near_layers(near_features, spatial_reference, index_cache=index_cache,
+                                                  backend=backend)
+    near_layers = [layer[:3] for layer in near_layers]
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    if near_table:
+        pl.arc_print("Querying spatial indexes and writing near table {0}...".format(near_table), True)
+        with pl.stage_timer("query and write") as stage:
+            chunks = pl.near_table_chunks(in_oids, in_xy, near_layers, k, radius, radius_all, location, angle,
+                                          near_trees, max_pairs)
+            table_rows = pl.write_near_table(near_table, chunks, backend)
+            stage.rows = table_rows
+        return table_rows
+    pl.arc_print("Querying spatial indexes of all near features...", True)
+    with pl.stage_timer("query", len(in_oids)):
+        layer_results = pl.chained_near_arrays_k(in_xy, near_layers, k, radius, near_trees=near_trees)
+    with pl.stage_timer("add fields"):
+        near_fields, no_match_values = pl.add_near_fields(in_fc, [layer[0] for layer in near_layers], location, angle,
+                                                          fid, backend, k)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, pl.near_result_columns(near_fields, layer_results), no_match_values)
+
+
+def chained_near_network(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                         backend=None, network_features=None, snap_tolerance=None, node_tolerance=0.0):
+    """Computes the chained near fields with network distances along a line feature class. The network graph is
+    built once (or passed in as a proximity_lib.NetworkGraph) and reused for every near layer, the input features are
+    snapped to it once, and every near layer is answered with one multi-source Dijkstra run bounded by the search
+    radius, see proximity_lib.network_near_query. Features are read as points (or centroids)."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    if isinstance(network_features, pl.NetworkGraph):
+        network = network_features
+    else:
+        pl.arc_print("Building network graph from {0}...".format(network_features), True)
+        with pl.stage_timer("build network") as stage:
+            line_oids, line_geometries = backend.read_geometries(network_features, spatial_reference=spatial_reference)
+            network = pl.build_network_graph(line_geometries,
+                                             pl.linear_unit_to_dataset_units(node_tolerance, spatial_reference))
+            stage.rows = len(network.segments)
+    pl.arc_print("Reading input feature coordinates...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_xy = backend.read_points(in_fc)
+        stage.rows = len(in_oids)
+    near_layers = []
+    with pl.stage_timer("read near"):
+        for feature in near_features:
+            feature = feature.strip("'")
+            feature_name = backend.dataset_name(feature)
+            pl.arc_print("Reading near feature coordinates for {0}.".format(feature_name))
+            near_oids, near_xy = backend.read_points(feature, spatial_reference=spatial_reference)
+            near_layers.append((feature_name, near_oids, near_xy))
+    pl.arc_print("Computing network distances to all near features...", True)
+    with pl.stage_timer("query", len(in_oids)):
+        layer_results = pl.network_chained_near_arrays(
+            in_xy, near_layers, network, pl.linear_unit_to_dataset_units(search_radius, spatial_reference),
+            pl.linear_unit_to_dataset_units(snap_tolerance, spatial_reference))
+    with pl.stage_timer("add fields"):
+        new_columns, no_match_values = pl.add_near_result_fields(in_fc, layer_results,
+                                                                 [layer[0] for layer in near_layers], location, angle,
+                                                                 fid, backend)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, new_columns, no_match_values)
+
+
+def chained_near_strtree(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                         backend=None):
+    """Computes the chained near fields of line, polygon, and multipoint features with the STRtree engine. Every
+    dataset is read once as an array of geometries and each near layer is queried in bulk."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    pl.arc_print("Reading input feature geometries...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_geometries = backend.read_geometries(in_fc)
+        stage.rows = len(in_oids)
+    near_layers = []
+    for feature in near_features:
+        feature = feature.strip("'")
+        feature_name = backend.dataset_name(feature)
+        pl.arc_print("Reading near feature geometries for {0}.".format(feature_name))
+        with pl.stage_timer("read near") as stage:
+            near_layers.append((feature_name,) + backend.read_geometries(feature,
+                                                                         spatial_reference=spatial_reference))
+            stage.rows = len(near_layers[-1][1])
+    pl.arc_print("Querying STRtrees of all near features...", True)
+    with pl.stage_timer("query", len(in_oids)):
+        layer_results = pl.strtree_chained_near_arrays(in_geometries, near_layers, radius)
+    with pl.stage_timer("add fields"):
+        new_columns, no_match_values = pl.add_near_result_fields(in_fc, layer_results,
+                                                                 [layer[0] for layer in near_layers], location, angle,
+                                                                 fid, backend)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, new_columns, no_match_values)
+
+
+def chained_near_tiled(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                       backend=None, workers=1, tile_features=1000000):
+    """Computes the chained near fields out of core. The input features are processed in tiles of about
+    tile_features features, and only the near features within the search radius of a tile (or within a halo grown
+    until the results are exact when there is no search radius) are loaded for it. Every tile is written as soon as
+    it is computed."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    near_datasets = []
+    near_extents = []
+    feature_spacings = []
+    for feature in near_features:
+        feature = feature.strip("'")
+        feature_name = backend.dataset_name(feature)
+        near_datasets.append((feature_name, feature))
+        feature_count = backend.feature_count(feature)
+        if feature_count:
+            near_extents.append(backend.extent(feature, spatial_reference))
+            feature_spacings.append(pl.feature_spacing(near_extents[-1], feature_count))
+    layer_names = [feature_name for feature_name, feature in near_datasets]
+
+    def load_near_layers(bbox, load_layer_names):
+        return [(feature_name,) + backend.read_points(feature, spatial_reference=spatial_reference, bbox=bbox)
+                for feature_name, feature in near_datasets if feature_name in load_layer_names]
+
+    with pl.stage_timer("add fields"):
+        near_fields, no_match_values = pl.add_near_fields(in_fc, layer_names, location, angle, fid, backend)
+    near_tiles = pl.tiled_chained_near(in_fc, load_near_layers, layer_names, radius, pl.union_bbox(near_extents),
+                                       2 * max(feature_spacings or [0]), tile_features, backend, workers)
+    pl.arc_print("Writing near fields tile by tile...", True)
+    pl.write_near_tiles(in_fc, near_tiles, near_fields, no_match_values, backend)
+
+
+def chained_near_incremental(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
+                            backend=None, workers=1, index_cache=None, incremental_state=True):
+    """Computes the chained near fields of the rows that changed since the last incremental run. The state of the
+    last run holds the input coordinates, a fingerprint and coordinate snapshot of every near layer, and the current
+    results. Rows that were inserted or moved are recomputed against every near layer. Near layers whose fingerprint
+    changed are compared with their snapshot, and only rows whose nearest feature was deleted or moved, or that an
+    inserted feature is closer to, are recomputed. The first run, or a run with other near features, search radius,
+    or requested fields, computes every row. Returns the number of rows recomputed."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    near_features = [feature.strip("'") for feature in near_features]
+    layer_names = [backend.dataset_name(feature) for feature in near_features]
+    # The requested fields are part of the key, so a run adding fields fills them on every row
+    state_path = pl.near_state_directory(incremental_state, str(in_fc), near_features, radius, bool(location),
+                                         bool(angle), bool(fid))
+    pl.arc_print("Reading input feature coordinates...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_xy = backend.read_points(in_fc)
+        stage.rows = len(in_oids)
+    with pl.stage_timer("add fields"):
+        near_fields, no_match_values = pl.add_near_fields(in_fc, layer_names, location, angle, fid, backend)
+    with pl.stage_timer("read state"):
+        state = pl.read_near_state(state_path)
+    if state is None or list(state["layers"].keys()) != layer_names:
+        pl.arc_print("No incremental state found, computing every row...", True)
+        near_layers, near_trees = pl.read_near_layers(near_features, spatial_reference, None, index_cache, backend)
+        with pl.stage_timer("query", len(in_oids)):
+            layer_results = pl.chained_near_arrays(in_xy, near_layers, radius, workers=workers,
+                                                   near_trees=near_trees)
+        with pl.stage_timer("write", len(in_oids)):
+            backend.write_columns(in_fc, in_oids, pl.near_result_columns(near_fields, layer_results),
+                                  no_match_values)
+        layer_states = OrderedDict()
+        for feature, (layer_name, near_oids, near_xy) in zip(near_features, near_layers):
+            layer_states[layer_name] = (backend.dataset_fingerprint(feature), near_oids, near_xy,
+                                        layer_results[layer_name])
+        with pl.stage_timer("write state"):
+            pl.write_near_state(state_path, in_oids, in_xy, layer_states)
+        pl.arc_print("Recomputed {0} of {0} rows.".format(len(in_oids)), True)
+        return len(in_oids)
+    old_positions, changed_rows, deleted_oids = pl.point_changes(state["oids"], state["xy"], in_oids, in_xy)
+    pl.arc_print("{0} input rows were inserted or moved.".format(int(changed_rows.sum())), True)
+    recompute_rows = np.zeros(len(in_oids), dtype=bool)
+    layer_results = {}
+    layer_states = OrderedDict()
+    for feature, layer_name in zip(near_features, layer_names):
+        fingerprint, old_near_oids, old_near_xy, old_results = state["layers"][layer_name]
+        results = pl.carry_near_results(old_results, old_positions)
+        current_fingerprint = backend.dataset_fingerprint(feature)
+        if current_fingerprint is not None and current_fingerprint == fingerprint:
+            near_oids, near_xy = old_near_oids, old_near_xy
+            layer_rows = changed_rows
+            near_trees = {}
+        else:
+            pl.arc_print("Comparing {0} with its last snapshot...".format(layer_name))
+            near_layers, near_trees = pl.read_near_layers([feature], spatial_reference, None, index_cache, backend)
+            near_oids, near_xy = near_layers[0][1], near_layers[0][2]
+            near_positions, inserted, removed_oids = pl.point_changes(old_near_oids, old_near_xy, near_oids, near_xy)
+            layer_rows = changed_rows | pl.rows_affected_by_near_changes(in_xy, results, removed_oids,
+                                                                          near_oids[inserted], near_xy[inserted],
+                                                                          radius)
+            pl.arc_print("{0} rows are affected by changes to {1}.".format(int(layer_rows.sum()), layer_name))
+        if layer_rows.any():
+            with pl.stage_timer("query", int(layer_rows.sum())):
+                row_results = pl.chained_near_arrays(in_xy[layer_rows], [(layer_name, near_oids, near_xy)], radius,
+                                                     workers=workers, near_trees=near_trees)[layer_name]
+            for key, values in row_results.items():
+                results[key][layer_rows] = values
+        recompute_rows |= layer_rows
+        layer_results[layer_name] = results
+        layer_states[layer_name] = (current_fingerprint, near_oids, near_xy, results)
+    pl.arc_print("Writing near fields of {0} recomputed rows...".format(int(recompute_rows.sum())), True)
+    recomputed_results = dict((layer_name, dict((key, values[recompute_rows]) for key, values in results.items()))
+                              for layer_name, results in layer_results.items())
+    with pl.stage_timer("write", int(recompute_rows.sum())):
+        backend.write_columns(in_fc, in_oids[recompute_rows], pl.near_result_columns(near_fields,
+                                                                                      recomputed_results))
+    with pl.stage_timer("write state"):
+        pl.write_near_state(state_path, in_oids, in_xy, layer_states)
+    pl.arc_print("Recomputed {0} of {1} rows.".format(int(recompute_rows.sum()), len(in_oids)), True)
+    return int(recompute_rows.sum())
 
 
 # Main Function
 def chained_near_analysis(in_fc, near_features, search_radius=None, location=False, angle=False, fid=False,
-                          method="PLANAR"):
+                          method="PLANAR", engine="AUTO", backend=None, workers=1, tile_features=None,
+                          index_cache=None, incremental_state=None, knn_options=None, network_options=None,
+                          sidecar_table=None):
     """This tool will conduct a near analysis that will add a new field for every Near Feature input into the
-    Input Features dataset. Unlike Near, this tool will create a column wise set of Near fields for every
-    Near Feature rather than using the closest of all the near features input into the tool. This results in
-     many more fields, so use this only if you have a specific need to know proximity for every feature within
-     the Input Feature class. Consider a Near Table if you want more detailed proximity information and are comfortable
-      with a higher number of records"""
+    Input Features dataset, rather than only using the closest of all the near features like Near does.
+    :param - in_fc - input feature class
+    :param - near_features - list of near feature classes
+    :param - search_radius - linear unit or distance limiting the search, None searches every feature
+    :param - location, angle, fid - add the X_/Y_, ANGLE_, and FID_ fields
+    :param - method - "PLANAR", "GEODESIC", or "NETWORK"
+    :param - engine - "NEAR", "KDTREE" (points), "STRTREE" (any geometry), or "AUTO", see
+    proximity_lib.select_near_engine
+    :param - backend - "ARCPY", "OPEN", or a backend object, see proximity_lib.get_backend
+    :param - workers - KD-tree engine processes, 1 runs in process and 0 uses every cpu
+    :param - tile_features - run the KD-tree engine out of core on tiles of about this many input features
+    :param - index_cache - NearIndexCache, cache directory, or True to keep near KD-trees on disk between runs
+    :param - incremental_state - state directory, or True, to only recompute rows affected by edits since the last run
+    :param - knn_options - dictionary of k, radius_all, near_table, and max_pairs, see chained_near_knn
+    :param - network_options - dictionary of network_features, snap_tolerance, and node_tolerance of the NETWORK
+    method, see chained_near_network
+    :param - sidecar_table - table the fields are written to keyed by IN_FID, see proximity_lib.SidecarBackend
+    :returns - number of incrementally recomputed rows or near table rows written, or None"""
     try:
+        backend = pl.get_backend(in_fc, backend)
+        if sidecar_table:
+            backend = pl.SidecarBackend(backend, sidecar_table)
+        near_features_list = near_features
+        if str(method or "PLANAR").upper() == "NETWORK":
+            network_options = pl.engine_options(network_options, OrderedDict(
+                [("network_features", None), ("snap_tolerance", None), ("node_tolerance", 0.0)]), "network_options")
+            if network_options["network_features"] is None:
+                raise ValueError("The NETWORK method requires network features.")
+            chained_near_network(in_fc, near_features_list, search_radius, location, angle, fid, backend,
+                                 **network_options)
+            pl.arc_print("Script Completed Successfully.", True)
+            return
+        if sidecar_table and incremental_state:
+            raise ValueError("Incremental runs update the input features in place and do not support a sidecar "
+                             "table.")
+        near_engine = pl.select_near_engine(in_fc, [i.strip("'") for i in near_features_list], method, engine, backend)
+        if near_engine == "STRTREE":
+            chained_near_strtree(in_fc, near_features_list, search_radius, location, angle, fid, backend)
+            pl.arc_print("Script Completed Successfully.", True)
+            return
+        knn_options = pl.engine_options(knn_options, OrderedDict([("k", 1), ("radius_all", False),
+                                                                  ("near_table", None), ("max_pairs", 1000000)]),
+                                        "knn_options")
+        if knn_options["k"] > 1 or knn_options["radius_all"] or knn_options["near_table"]:
+            if near_engine != "KDTREE" or str(method or "PLANAR").upper() != "PLANAR":
+                raise ValueError("K nearest, radius all, and near table outputs require point features and the "
+                                 "PLANAR KD-tree engine.")
+            if knn_options["radius_all"] and (search_radius is None or not knn_options["near_table"]):
+                raise ValueError("Finding all near features within the search radius requires a search radius and "
+                                 "a near table.")
+            table_rows = chained_near_knn(in_fc, near_features_list, search_radius, location, angle, fid, backend,
+                                          index_cache=index_cache, **knn_options)
+            pl.arc_print("Script Completed Successfully.", True)
+            return table_rows
+        if near_engine == "KDTREE":
+            if str(method or "PLANAR").upper() == "GEODESIC":
+                pl.warn_geodesic_options(tile_features, workers, incremental_state)
+            if incremental_state and str(method or "PLANAR").upper() == "PLANAR":
+                recomputed_rows = chained_near_incremental(in_fc, near_features_list, search_radius, location, angle,
+                                                           fid, backend, workers, index_cache, incremental_state)
+                pl.arc_print("Script Completed Successfully.", True)
+                return recomputed_rows
+            if tile_features and str(method or "PLANAR").upper() == "PLANAR":
+                chained_near_tiled(in_fc, near_features_list, search_radius, location, angle, fid, backend, workers,
+                                   tile_features)
+            else:
+                chained_near_kdtree(in_fc, near_features_list, search_radius, location, angle, fid, backend,
+                                    workers, method, index_cache)
+            pl.arc_print("Script Completed Successfully.", True)
+            return
+        if backend.name != "ARCPY":
+            raise ValueError("Near Analysis requires the ARCPY backend. The {0} backend supports the KD-tree and "
+                             "STRtree engines.".format(backend.name))
+        if sidecar_table:
+            raise ValueError("Near Analysis adds and deletes NEAR_ fields on the input features and does not support "
+                             "a sidecar table. Use the KD-tree or STRtree engine.")
         arcpy.env.overwriteOutput = True
         workspace = os.path.dirname(in_fc)
-        near_features_list = near_features
         input_fc_name = os.path.split(in_fc)[1]
         NEARFID = "NEAR_FID"
         NEARDISTField = "NEAR_DIST"
         NEARXField = "NEAR_X"
         NEARYField = "NEAR_Y"
         NEARAngleField = "NEAR_ANGLE"
+        near_field_prefixes = [(NEARDISTField, "DIST_"), (NEARXField, "X_"), (NEARYField, "Y_"),
+                               (NEARAngleField, "ANGLE_"), (NEARFID, "FID_")]
+        new_columns = []
+        in_oids = None
+        schema = pl.SchemaManager(in_fc, backend)
         for feature in near_features_list:
             desc = arcpy.Describe(feature.strip("'"))
             feature_name = str(desc.name)
@@ -54,32 +402,20 @@ def chained_near_analysis(in_fc, near_features, search_radius=None, location=Fal
                 "Conducting NEAR Analysis with input feature class ({0}) and near feature ({1}).".format(input_fc_name,
                                                                                                          feature_name))
             arcpy.Near_analysis(in_fc, feature, search_radius, location, angle, method)
-            new_dist_field_name = "DIST_" + feature_name
-            new_angle_field_name = "ANGLE_" + feature_name
-            new_fid_field_name = "FID_" + feature_name
-            new_x_field_name = "X_" + feature_name
-            new_y_field_name = "Y_" + feature_name
-            pl.arc_print("Calculating Near Feature specific fields for {0}.".format(feature_name))
-            if pl.field_exist(in_fc, NEARDISTField):
-                valid_dist_field_name = arcpy.ValidateFieldName(new_dist_field_name, workspace)
-                pl.add_new_field(in_fc, valid_dist_field_name, "DOUBLE", field_alias=new_dist_field_name)
-                arcpy.CalculateField_management(in_fc, valid_dist_field_name, "!NEAR_DIST!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARXField):
-                valid_x_field_name = arcpy.ValidateFieldName(new_x_field_name, workspace)
-                pl.add_new_field(in_fc, valid_x_field_name, "DOUBLE", field_alias=new_x_field_name)
-                arcpy.CalculateField_management(in_fc, valid_x_field_name, "!NEAR_X!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARYField):
-                valid_y_field_name = arcpy.ValidateFieldName(new_y_field_name, workspace)
-                pl.add_new_field(in_fc, valid_y_field_name, "DOUBLE", field_alias=new_y_field_name)
-                arcpy.CalculateField_management(in_fc, valid_y_field_name, "!NEAR_Y!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARAngleField):
-                valid_angle_field_name = arcpy.ValidateFieldName(new_angle_field_name, workspace)
-                pl.add_new_field(in_fc, valid_angle_field_name, "DOUBLE", field_alias=new_angle_field_name)
-                arcpy.CalculateField_management(in_fc, valid_angle_field_name, "!NEAR_ANGLE!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARFID) and fid:
-                valid_fid_field_name = arcpy.ValidateFieldName(new_fid_field_name, workspace)
-                pl.add_new_field(in_fc, valid_fid_field_name, "DOUBLE", field_alias=new_fid_field_name)
-                arcpy.CalculateField_management(in_fc, valid_fid_field_name, "!NEAR_FID!", "PYTHON_9.3")
+            pl.arc_print("Collecting Near Feature specific values for {0}.".format(feature_name))
+            # Near adds NEAR_X and NEAR_Y with location and NEAR_ANGLE with angle, so the schema is not listed
+            near_fields = [NEARDISTField] + ([NEARXField, NEARYField] if location else []) + \
+                          ([NEARAngleField] if angle else []) + ([NEARFID] if fid else [])
+            in_oids, near_values = pl.read_table_columns(in_fc, near_fields)
+            for near_field, prefix in near_field_prefixes:
+                if near_field in near_fields:
+                    new_field_name = prefix + feature_name
+                    valid_field_name = arcpy.ValidateFieldName(new_field_name, workspace)
+                    schema.add_field(valid_field_name, "DOUBLE", field_alias=new_field_name)
+                    new_columns.append((valid_field_name, near_values[near_field].astype(np.float64)))
+        schema.commit()
+        pl.arc_print("Writing Near Feature specific fields...", True)
+        backend.write_columns(in_fc, in_oids, new_columns)
         pl.arc_print("Deleting NEAR Fields from last feature.")
         try:
             arcpy.DeleteField_management(in_fc, NEARDISTField)
@@ -93,6 +429,8 @@ def chained_near_analysis(in_fc, near_features, search_radius=None, location=Fal
     except Exception as e:
         pl.arc_print(str(e.args[0]))
         print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
 
 
 # This test allows the script to be used from the operating
@@ -100,6 +438,7 @@ def chained_near_analysis(in_fc, near_features, search_radius=None, location=Fal
 # as a geoprocessing script tool, or as a module imported in
 # another script
 if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
     input_features = arcpy.GetParameterAsText(0)
     near_features = str(arcpy.GetParameterAsText(1)).split(";")
     search_radius = arcpy.GetParameter(2)
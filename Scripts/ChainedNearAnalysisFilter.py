@@ -24,21 +24,160 @@
 # limitations under the License.
 # --------------------------------
 # Import Modules
-import os, sys, arcpy
+import os, sys
+import numpy as np
 import proximity_lib as pl
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
 
 
 # Function Definitions
+def chained_near_filter_kdtree(in_fc, near_feature, near_filter_field, search_radius=None, location=False,
+                               angle=False, fid=False, backend=None, workers=1, method="PLANAR", index_cache=None):
+    """Computes the chained near filter fields with the in process KD-tree engine. The near feature class is read
+    once and partitioned by the filter field into one spatial index per unique value, then every category is
+    queried in a single pass over the input features. The GEODESIC method indexes the features on the unit sphere
+    and refines the candidates with ellipsoidal distances in a single process. The partitioned near layers and their
+    KD-trees are loaded from index_cache when it holds them."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    geodesic = str(method or "PLANAR").upper() == "GEODESIC"
+    geographic_reference = None
+    if geodesic:
+        geographic_reference, ellipsoid = backend.geographic_coordinate_system(spatial_reference)
+    pl.arc_print("Reading input feature coordinates...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_xy = backend.read_points(in_fc, spatial_reference=geographic_reference)
+        stage.rows = len(in_oids)
+    pl.arc_print("Reading and partitioning near features by {0}...".format(near_filter_field), True)
+    near_layers, near_trees = pl.read_near_category_layers(near_feature, near_filter_field, spatial_reference,
+                                                           geographic_reference, index_cache, backend)
+    pl.arc_print("Querying spatial indexes of {0} near feature categories...".format(len(near_layers)), True)
+    with pl.stage_timer("query", len(in_oids)):
+        if geodesic:
+            layer_results = pl.geodesic_chained_near_arrays(in_xy, near_layers,
+                                                            pl.linear_unit_to_meters(search_radius,
+                                                                                     spatial_reference),
+                                                            ellipsoid, near_trees=near_trees)
+            pl.meters_to_dataset_units(layer_results, spatial_reference)
+        else:
+            radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+            layer_results = pl.chained_near_arrays(in_xy, near_layers, radius, workers=workers,
+                                                   near_trees=near_trees)
+    with pl.stage_timer("add fields"):
+        new_columns, no_match_values = pl.add_near_result_fields(in_fc, layer_results,
+                                                                 [layer[0] for layer in near_layers], location, angle,
+                                                                 fid, backend)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, new_columns, no_match_values)
+
+
+def chained_near_filter_strtree(in_fc, near_feature, near_filter_field, search_radius=None, location=False,
+                                angle=False, fid=False, backend=None):
+    """Computes the chained near filter fields of line, polygon, and multipoint features with the STRtree engine.
+    The near feature class is read once and partitioned by the filter field into one STRtree per unique value."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    pl.arc_print("Reading input feature geometries...", True)
+    with pl.stage_timer("read input") as stage:
+        in_oids, in_geometries = backend.read_geometries(in_fc)
+        stage.rows = len(in_oids)
+    pl.arc_print("Reading and partitioning near features by {0}...".format(near_filter_field), True)
+    with pl.stage_timer("read near") as stage:
+        near_oids, near_geometries, near_categories = backend.read_geometry_categories(
+            near_feature, near_filter_field, spatial_reference=spatial_reference)
+        near_layers = [("F_" + str(value), oids, geometries) for value, oids, geometries in
+                       pl.partition_near_layers(near_oids, near_geometries, near_categories)]
+        stage.rows = len(near_oids)
+    pl.arc_print("Querying STRtrees of {0} near feature categories...".format(len(near_layers)), True)
+    with pl.stage_timer("query", len(in_oids)):
+        layer_results = pl.strtree_chained_near_arrays(in_geometries, near_layers, radius)
+    with pl.stage_timer("add fields"):
+        new_columns, no_match_values = pl.add_near_result_fields(in_fc, layer_results,
+                                                                 [layer[0] for layer in near_layers], location, angle,
+                                                                 fid, backend)
+    pl.arc_print("Writing near fields...", True)
+    with pl.stage_timer("write", len(in_oids)):
+        backend.write_columns(in_fc, in_oids, new_columns, no_match_values)
+
+
+def chained_near_filter_tiled(in_fc, near_feature, near_filter_field, search_radius=None, location=False,
+                              angle=False, fid=False, backend=None, workers=1, tile_features=1000000):
+    """Computes the chained near filter fields out of core. The input features are processed in tiles of about
+    tile_features features, and only the near features around a tile are read and partitioned by the filter field
+    for it. Every tile is written as soon as it is computed."""
+    backend = pl.get_backend(in_fc, backend)
+    spatial_reference = backend.spatial_reference(in_fc)
+    radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+    pl.arc_print("Reading unique values of {0}...".format(near_filter_field), True)
+    layer_names = ["F_" + str(value) for value in backend.unique_values(near_feature, near_filter_field, True)]
+    feature_count = backend.feature_count(near_feature)
+    near_extent = backend.extent(near_feature, spatial_reference) if feature_count else None
+    initial_halo = 2 * pl.feature_spacing(near_extent, feature_count) if feature_count else None
+
+    def load_near_layers(bbox, load_layer_names):
+        near_oids, near_xy, near_categories = backend.read_point_categories(
+            near_feature, near_filter_field, spatial_reference=spatial_reference, bbox=bbox)
+        return [("F_" + str(value), oids, xy) for value, oids, xy in
+                pl.partition_near_layers(near_oids, near_xy, near_categories)
+                if "F_" + str(value) in load_layer_names]
+
+    with pl.stage_timer("add fields"):
+        near_fields, no_match_values = pl.add_near_fields(in_fc, layer_names, location, angle, fid, backend)
+    near_tiles = pl.tiled_chained_near(in_fc, load_near_layers, layer_names, radius, near_extent, initial_halo,
+                                       tile_features, backend, workers)
+    pl.arc_print("Writing near fields tile by tile...", True)
+    pl.write_near_tiles(in_fc, near_tiles, near_fields, no_match_values, backend)
 
 
 # Main Function
 def chained_near_analysis_filter(in_fc, near_feature, near_filter_field, search_radius=None, location=False,
-                                 angle=False, fid=False, method="PLANAR"):
+                                 angle=False, fid=False, method="PLANAR", engine="AUTO", backend=None, workers=1,
+                                 tile_features=None, index_cache=None, sidecar_table=None):
     """This tool will conduct a near analysis that will add a new field for every feature layer generated as the result
     of a make feature layer querying every unique value of a chosen field in the near feature class.
-    Consider a Near Table if you want more detailed proximity information and are comfortable
-      with a higher number of records"""
+    :param - in_fc - input feature class
+    :param - near_feature - near feature class partitioned by near_filter_field
+    :param - near_filter_field - field whose unique values each get a set of near fields
+    :param - search_radius - linear unit or distance limiting the search, None searches every feature
+    :param - location, angle, fid - add the X_/Y_, ANGLE_, and FID_ fields
+    :param - method - "PLANAR" or "GEODESIC"
+    :param - engine - "NEAR", "KDTREE" (points), "STRTREE" (any geometry), or "AUTO", see
+    proximity_lib.select_near_engine
+    :param - backend - "ARCPY", "OPEN", or a backend object, see proximity_lib.get_backend
+    :param - workers - KD-tree engine processes, 1 runs in process and 0 uses every cpu
+    :param - tile_features - run the KD-tree engine out of core on tiles of about this many input features
+    :param - index_cache - NearIndexCache, cache directory, or True to keep the partitioned near layers on disk
+    between runs
+    :param - sidecar_table - table the fields are written to keyed by IN_FID, see proximity_lib.SidecarBackend"""
     try:
+        backend = pl.get_backend(in_fc, backend)
+        if sidecar_table:
+            backend = pl.SidecarBackend(backend, sidecar_table)
+        near_engine = pl.select_near_engine(in_fc, [near_feature], method, engine, backend)
+        if near_engine == "STRTREE":
+            chained_near_filter_strtree(in_fc, near_feature, near_filter_field, search_radius, location, angle, fid,
+                                        backend)
+            pl.arc_print("Script Completed Successfully.", True)
+            return
+        if near_engine == "KDTREE":
+            if str(method or "PLANAR").upper() == "GEODESIC":
+                pl.warn_geodesic_options(tile_features, workers)
+            if tile_features and str(method or "PLANAR").upper() == "PLANAR":
+                chained_near_filter_tiled(in_fc, near_feature, near_filter_field, search_radius, location, angle,
+                                          fid, backend, workers, tile_features)
+            else:
+                chained_near_filter_kdtree(in_fc, near_feature, near_filter_field, search_radius, location, angle,
+                                           fid, backend, workers, method, index_cache)
+            pl.arc_print("Script Completed Successfully.", True)
+            return
+        if backend.name != "ARCPY":
+            raise ValueError("Near Analysis requires the ARCPY backend. The {0} backend supports the KD-tree and "
+                             "STRtree engines.".format(backend.name))
+        if sidecar_table:
+            raise ValueError("Near Analysis adds and deletes NEAR_ fields on the input features and does not support "
+                             "a sidecar table. Use the KD-tree or STRtree engine.")
         arcpy.env.overwriteOutput = True
         workspace = os.path.dirname(in_fc)
         near_feature_value_list = pl.arc_unique_values(near_feature, near_filter_field, True)
@@ -50,6 +189,11 @@ def chained_near_analysis_filter(in_fc, near_feature, near_filter_field, search_
         NEARXField = "NEAR_X"
         NEARYField = "NEAR_Y"
         NEARAngleField = "NEAR_ANGLE"
+        near_field_prefixes = [(NEARDISTField, "DIST_"), (NEARXField, "X_"), (NEARYField, "Y_"),
+                               (NEARAngleField, "ANGLE_"), (NEARFID, "FID_")]
+        new_columns = []
+        in_oids = None
+        schema = pl.SchemaManager(in_fc, backend)
         for feature_value in near_feature_value_list:
             query = pl.constructSQLEqualityQuery(near_filter_field, feature_value, input_near_ws)
             layer_name = "F_" + str(feature_value)
@@ -58,32 +202,20 @@ def chained_near_analysis_filter(in_fc, near_feature, near_filter_field, search_
             pl.arc_print("Conducting NEAR Analysis with input feature class ({0}) and near feature layer ({1}).".format(
                 input_fc_name, feature_name))
             arcpy.Near_analysis(in_fc, feature_name, search_radius, location, angle, method)
-            new_dist_field_name = "DIST_" + feature_name
-            new_angle_field_name = "ANGLE_" + feature_name
-            new_fid_field_name = "FID_" + feature_name
-            new_x_field_name = "X_" + feature_name
-            new_y_field_name = "Y_" + feature_name
-            pl.arc_print("Calculating Near Feature specific fields for {0}.".format(feature_name))
-            if pl.field_exist(in_fc, NEARDISTField):
-                valid_dist_field_name = arcpy.ValidateFieldName(new_dist_field_name, workspace)
-                pl.add_new_field(in_fc, valid_dist_field_name, "DOUBLE", field_alias=new_dist_field_name)
-                arcpy.CalculateField_management(in_fc, valid_dist_field_name, "!NEAR_DIST!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARXField):
-                valid_x_field_name = arcpy.ValidateFieldName(new_x_field_name, workspace)
-                pl.add_new_field(in_fc, valid_x_field_name, "DOUBLE", field_alias=new_x_field_name)
-                arcpy.CalculateField_management(in_fc, valid_x_field_name, "!NEAR_X!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARYField):
-                valid_y_field_name = arcpy.ValidateFieldName(new_y_field_name, workspace)
-                pl.add_new_field(in_fc, valid_y_field_name, "DOUBLE", field_alias=new_y_field_name)
-                arcpy.CalculateField_management(in_fc, valid_y_field_name, "!NEAR_Y!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARAngleField):
-                valid_angle_field_name = arcpy.ValidateFieldName(new_angle_field_name, workspace)
-                pl.add_new_field(in_fc, valid_angle_field_name, "DOUBLE", field_alias=new_angle_field_name)
-                arcpy.CalculateField_management(in_fc, valid_angle_field_name, "!NEAR_ANGLE!", "PYTHON_9.3")
-            if pl.field_exist(in_fc, NEARFID) and fid:
-                valid_fid_field_name = arcpy.ValidateFieldName(new_fid_field_name, workspace)
-                pl.add_new_field(in_fc, valid_fid_field_name, "DOUBLE", field_alias=new_fid_field_name)
-                arcpy.CalculateField_management(in_fc, valid_fid_field_name, "!NEAR_FID!", "PYTHON_9.3")
+            pl.arc_print("Collecting Near Feature specific values for {0}.".format(feature_name))
+            # Near adds NEAR_X and NEAR_Y with location and NEAR_ANGLE with angle, so the schema is not listed
+            near_fields = [NEARDISTField] + ([NEARXField, NEARYField] if location else []) + \
+                          ([NEARAngleField] if angle else []) + ([NEARFID] if fid else [])
+            in_oids, near_values = pl.read_table_columns(in_fc, near_fields)
+            for near_field, prefix in near_field_prefixes:
+                if near_field in near_fields:
+                    new_field_name = prefix + feature_name
+                    valid_field_name = arcpy.ValidateFieldName(new_field_name, workspace)
+                    schema.add_field(valid_field_name, "DOUBLE", field_alias=new_field_name)
+                    new_columns.append((valid_field_name, near_values[near_field].astype(np.float64)))
+        schema.commit()
+        pl.arc_print("Writing Near Feature specific fields...", True)
+        backend.write_columns(in_fc, in_oids, new_columns)
         pl.arc_print("Deleting NEAR Fields from last feature.")
         try:
             arcpy.DeleteField_management(in_fc, NEARDISTField)
@@ -97,6 +229,8 @@ def chained_near_analysis_filter(in_fc, near_feature, near_filter_field, search_
     except Exception as e:
         pl.arc_print(str(e.args[0]))
         print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
 
 
 # This test allows the script to be used from the operating
@@ -104,6 +238,7 @@ def chained_near_analysis_filter(in_fc, near_feature, near_filter_field, search_
 # as a geoprocessing script tool, or as a module imported in
 # another script
 if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
     input_features = arcpy.GetParameterAsText(0)
     near_feature = str(arcpy.GetParameterAsText(1))
     near_filter_field = arcpy.GetParameterAsText(2)
@@ -0,0 +1,121 @@
+# --------------------------------
+# Name: ChainedNearScoring.py
+# Purpose: This tool will compute the distance to every Near Feature input and score it against a threshold in one
+# pass, adding only the score fields (and optionally the distance fields) to the Input Features dataset.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# ArcGIS Version:   10.4.1
+# ArcGIS Pro Version: 2.7
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import proximity_lib as pl
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
+
+
+# Main Function
+def chained_near_scoring(in_fc, near_features, search_radius=None, threshold_upper=0, threshold_lower=0,
+                         if_less_score=1, if_more_score=0, score_bands=None, keep_distances=False, backend=None,
+                         workers=1, index_cache=None, chunk_size=1000000, sidecar_table=None):
+    """This tool runs Chained Near Analysis and Chained Scoring as one pipeline. The distance to every near feature
+    class is computed and scored in memory chunk by chunk, and only a SCORE_ field per near feature class (plus its
+    DIST_ field if keep_distances is true) is written, in one pass, so the distance fields are not written and read
+    back just to be scored. The scores equal running Chained Near Analysis and then Chained Scoring on its DIST_
+    fields: a distance within threshold_lower and threshold_upper scores if_less_score and any other distance,
+    including inputs without a near feature in the search radius, scores if_more_score. Score bands replace the
+    thresholds with a piecewise score table, see proximity_lib.score_array. Every scoring parameter may be a single
+    value, a list aligned with the near features, or a dictionary keyed by near feature class name, so one run can
+    produce a scorecard with different thresholds per near feature class. Input and near features must be points
+    (the PLANAR KD-tree engine). The workers and index_cache parameters work like in chained_near_analysis,
+    chunk_size is the number of input features queried and scored at a time, and with a sidecar_table the fields are
+    written to that table keyed by IN_FID, see proximity_lib.SidecarBackend."""
+    try:
+        backend = pl.get_backend(in_fc, backend)
+        if sidecar_table:
+            backend = pl.SidecarBackend(backend, sidecar_table)
+        near_features = [feature.strip("'") for feature in near_features]
+        if pl.select_near_engine(in_fc, near_features, "PLANAR", "KDTREE", backend) != "KDTREE":
+            raise ValueError("Chained near scoring requires point features and the KD-tree engine. Run Chained Near "
+                             "Analysis and Chained Scoring instead.")
+        spatial_reference = backend.spatial_reference(in_fc)
+        radius = pl.linear_unit_to_dataset_units(search_radius, spatial_reference)
+        pl.arc_print("Reading input feature coordinates...", True)
+        with pl.stage_timer("read input") as stage:
+            in_oids, in_xy = backend.read_points(in_fc)
+            stage.rows = len(in_oids)
+        near_layers, near_trees = pl.read_near_layers(near_features, spatial_reference, index_cache=index_cache,
+                                                      backend=backend)
+        layer_names = [layer[0] for layer in near_layers]
+        parameter_keys = [backend.dataset_name(feature) for feature in near_features]
+        if score_bands is None:
+            band_lists = [[(lower, upper, score)] for upper, lower, score in
+                          zip(pl.expand_field_parameter(threshold_upper, parameter_keys),
+                              pl.expand_field_parameter(threshold_lower, parameter_keys),
+                              pl.expand_field_parameter(if_less_score, parameter_keys))]
+        elif isinstance(score_bands, dict):
+            band_lists = pl.expand_field_parameter(score_bands, parameter_keys)
+        else:
+            band_lists = [score_bands] * len(parameter_keys)
+        layer_bands = dict(zip(layer_names, band_lists))
+        if_outside_scores = dict(zip(layer_names, pl.expand_field_parameter(if_more_score, parameter_keys)))
+        pl.arc_print("Querying and scoring the distances to all near features...", True)
+        with pl.stage_timer("query and score", len(in_oids)):
+            layer_scores = pl.near_score_arrays(in_xy, near_layers, layer_bands, if_outside_scores, radius,
+                                                keep_distances, chunk_size, workers, near_trees)
+        new_columns, fill_values = [], []
+        with pl.stage_timer("add fields"), pl.SchemaManager(in_fc, backend) as schema:
+            for layer_name in layer_names:
+                pl.arc_print("Adding score fields for {0} with score bands (lower, upper, score) {1}, and {2} "
+                             "otherwise.".format(layer_name, layer_bands[layer_name], if_outside_scores[layer_name]))
+                for prefix, key in [("SCORE_", "SCORE")] + ([("DIST_", "DIST")] if keep_distances else []):
+                    new_field_name = prefix + layer_name
+                    valid_field_name = schema.validate_field_name(new_field_name)
+                    schema.add_field(valid_field_name, "DOUBLE", field_alias=new_field_name)
+                    new_columns.append((valid_field_name, layer_scores[layer_name][key]))
+                    # Rows without a geometry score like a distance without a match
+                    fill_values.append(pl.score_array([pl.NEAR_NO_MATCH], layer_bands[layer_name],
+                                                      if_outside_scores[layer_name])[0] if key == "SCORE" else
+                                       pl.NEAR_NO_MATCH)
+        pl.arc_print("Writing score fields...", True)
+        with pl.stage_timer("write", len(in_oids)):
+            backend.write_columns(in_fc, in_oids, new_columns, fill_values)
+        pl.arc_print("Script Completed Successfully.", True)
+    except Exception as e:
+        pl.arc_print(str(e.args[0]))
+        print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone), in a Python IDE,
+# as a geoprocessing script tool, or as a module imported in
+# another script
+if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
+    input_features = arcpy.GetParameterAsText(0)
+    near_features = str(arcpy.GetParameterAsText(1)).split(";")
+    search_radius = arcpy.GetParameter(2)
+    threshold_upper = arcpy.GetParameter(3)
+    threshold_lower = arcpy.GetParameter(4)
+    if_within_score = arcpy.GetParameter(5)
+    if_outside_score = arcpy.GetParameter(6)
+    keep_distances = arcpy.GetParameter(7)
+    chained_near_scoring(input_features, near_features, search_radius, threshold_upper, threshold_lower,
+                         if_within_score, if_outside_score, keep_distances=keep_distances)
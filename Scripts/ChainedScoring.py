@@ -23,14 +23,18 @@
 # limitations under the License.
 # --------------------------------
 # Import Modules
-import os, sys, arcpy
+import os, sys
+import numpy as np
 import proximity_lib as pl
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
 
 
-@pl.arc_tool_report
-def score_value(value, threshold_upper, threshold_lower=0, if_within_score=1, if_outside_score=0):
+def score_value(value, threshold_upper, threshold_lower=0, if_within_score=1, if_outside_score=0, null_score=None):
     """This function is intended to take a value (proximity for example), and check if it is <= a threshold,
-    and return a score for if it is less than or more than based on the passed parameters. Defaults to binary (0,1)"""
+    and return a score for if it is less than or more than based on the passed parameters. Defaults to binary (0,1).
+    Null values return the null score."""
+    if value is None:
+        return null_score
     if value >= threshold_lower and value <= threshold_upper:
         return if_within_score
     else:
@@ -38,37 +42,61 @@ def score_value(value, threshold_upper, threshold_lower=0, if_within_score=1, if
 
 
 # Main Function
-def chained_scoring_func(in_fc, scoring_fields, threshold_upper, threshold_lower=0, if_less_score=1, if_more_score=0):
+def chained_scoring_func(in_fc, scoring_fields, threshold_upper, threshold_lower=0, if_less_score=1, if_more_score=0,
+                         score_bands=None, null_score=None, backend=None):
     """This tool will score fields based a  upper and lower bound threhsold, and return values to those fields based on if it is less than
-    or more than the threshold. All fields treated the same. """
+    or more than the threshold. All fields are read in one pass, scored with vectorized comparisons, and written back in
+    one update. Thresholds may be a single value for all fields, a list aligned with the fields, or a dictionary keyed
+    by field. Score bands, a list of (lower, upper, score) tuples or a dictionary of them keyed by field, replace the
+    thresholds with a piecewise score table where the first matching band wins. Null values get the null score, and
+    stay null if it is None. The backend parameter chooses how the dataset is read and written ("ARCPY", "OPEN", or a
+    backend object, see proximity_lib.get_backend)."""
     try:
-        arcpy.env.overwriteOutput = True
-        desc_in_fc = arcpy.Describe(in_fc)
-        workspace = desc_in_fc.catalogPath
+        backend = pl.get_backend(in_fc, backend)
         fields_list = scoring_fields
         new_score_fields = [
-            arcpy.ValidateFieldName("SCORE_{0}".format(str(i).replace("DIST_", "", 1).replace("ANGLE_", "", 1)),
-                                    workspace) for i in fields_list]
+            backend.validate_field_name("SCORE_{0}".format(str(i).replace("DIST_", "", 1).replace("ANGLE_", "", 1)),
+                                        in_fc) for i in fields_list]
+        if score_bands is None:
+            field_bands = [[(lower, upper, if_less_score)] for upper, lower in
+                           zip(pl.expand_field_parameter(threshold_upper, fields_list),
+                               pl.expand_field_parameter(threshold_lower, fields_list))]
+        elif isinstance(score_bands, dict):
+            field_bands = pl.expand_field_parameter(score_bands, fields_list)
+        else:
+            field_bands = [score_bands] * len(fields_list)
+        missing_fields = [field for field in fields_list if not backend.field_exist(in_fc, field)]
+        for field in missing_fields:
+            pl.arc_print("Could not find field {0} to score. Skipping it.".format(field))
+        field_bands = [bands for field, bands in zip(fields_list, field_bands) if field not in missing_fields]
+        new_score_fields = [score for field, score in zip(fields_list, new_score_fields) if field not in missing_fields]
+        fields_list = [field for field in fields_list if field not in missing_fields]
+        pl.arc_print("Reading fields to score...", True)
+        with pl.stage_timer("read") as stage:
+            in_oids, value_block = backend.read_numeric_block(in_fc, fields_list)
+            stage.rows = len(in_oids)
         pl.arc_print("Adding and Computing Score Fields.", True)
-        for new_score_pair in zip(fields_list, new_score_fields):
-            field_to_score = new_score_pair[0]
-            new_score = new_score_pair[1]
-            pl.add_new_field(in_fc, new_score, "DOUBLE", field_alias=new_score)
-            pl.arc_print(
-                "Computing score for field {0}. Returning {1} if value <= {2} and >= {3}, and {4} otherwise.".format(
-                    str(new_score), str(if_less_score), str(threshold_upper), str(threshold_lower), str(if_more_score)),
-                True)
-            try:
-                with arcpy.da.UpdateCursor(in_fc, [field_to_score, new_score]) as cursor:
-                    for row in cursor:
-                        row[1] = score_value(row[0], threshold_upper, threshold_lower, if_less_score, if_more_score)
-                        cursor.updateRow(row)
-            except:
-                pl.arc_print("Could not process field {0}".format(new_score))
+        with pl.stage_timer("add fields"), pl.SchemaManager(in_fc, backend) as schema:
+            for new_score in new_score_fields:
+                schema.add_field(new_score, "DOUBLE", field_alias=new_score)
+        score_columns = []
+        for column_index, (new_score, bands) in enumerate(zip(new_score_fields, field_bands)):
+            pl.arc_print("Computing score for field {0} with score bands (lower, upper, score) {1}, and {2} "
+                         "otherwise.".format(str(new_score), str(bands), str(if_more_score)), True)
+            with pl.stage_timer("score", len(in_oids)):
+                scores = pl.score_array(value_block[:, column_index], bands, if_more_score, null_score)
+                score_column = scores.astype(object)
+                score_column[np.isnan(scores)] = None  # Written as null
+            score_columns.append((new_score, score_column))
+        pl.arc_print("Writing score fields...", True)
+        with pl.stage_timer("write", len(in_oids)):
+            backend.write_columns(in_fc, in_oids, score_columns)
 
     except Exception as e:
         pl.arc_print(str(e.args[0]))
         print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
 
 
 # This test allows the script to be used from the operating
@@ -76,6 +104,7 @@ def chained_scoring_func(in_fc, scoring_fields, threshold_upper, threshold_lower
 # as a geoprocessing script tool, or as a module imported in
 # another script
 if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
     input_features = arcpy.GetParameterAsText(0)
     score_fields = str(arcpy.GetParameterAsText(1)).split(";")
     threshold_upper = arcpy.GetParameter(2)
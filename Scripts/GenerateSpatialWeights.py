@@ -0,0 +1,70 @@
+# --------------------------------
+# Name: GenerateSpatialWeights.py
+# Purpose: This tool will build distance band, inverse distance, k nearest neighbor, or contiguity spatial weights for
+# a feature class and write them to a spatial weights matrix (.swm) file.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# ArcGIS Version:   10.4.1
+# ArcGIS Pro Version: 2.7
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+import proximity_lib as pl
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
+
+
+# Function Definitions
+def generate_spatial_weights(in_fc, unique_id_field, output_swm, conceptualization="CONTIGUITY_EDGES_CORNERS",
+                             distance_threshold=None, number_of_neighbors=None, exponent=1.0,
+                             row_standardization=True, backend=None):
+    """This tool will build spatial weights for a feature class and write them to a .swm file that Compute
+    Neighborhood Statistics and the ArcGIS spatial statistics tools read. The conceptualizations follow Generate
+    Spatial Weights Matrix: FIXED_DISTANCE, INVERSE_DISTANCE, K_NEAREST_NEIGHBORS, CONTIGUITY_EDGES_ONLY (rook), and
+    CONTIGUITY_EDGES_CORNERS (queen), see proximity_lib.build_spatial_weights. The number of neighbors is the minimum
+    number of neighbors of the distance conceptualizations."""
+    try:
+        spatial_weights = pl.build_spatial_weights(in_fc, unique_id_field, conceptualization, distance_threshold,
+                                                   number_of_neighbors, exponent, row_standardization,
+                                                   backend=backend)
+        pl.arc_print("Writing spatial weights matrix {0}...".format(output_swm), True)
+        pl.write_swm(output_swm, spatial_weights)
+        pl.arc_print("Script Completed Successfully.", True)
+    except Exception as e:
+        pl.arc_print(str(e.args[0]))
+        print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
+
+
+# This test allows the script to be used from the operating
+# system command prompt (stand-alone), in a Python IDE,
+# as a geoprocessing script tool, or as a module imported in
+# another script
+if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
+    input_features = arcpy.GetParameterAsText(0)
+    unique_id_field = arcpy.GetParameterAsText(1)
+    output_swm = arcpy.GetParameterAsText(2)
+    conceptualization = arcpy.GetParameterAsText(3)
+    distance_threshold = arcpy.GetParameter(4)
+    number_of_neighbors = arcpy.GetParameter(5)
+    exponent = arcpy.GetParameter(6) or 1.0
+    row_standardization = arcpy.GetParameter(7)
+    generate_spatial_weights(input_features, unique_id_field, output_swm, conceptualization, distance_threshold,
+                             number_of_neighbors, exponent, row_standardization)
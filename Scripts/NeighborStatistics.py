@@ -24,10 +24,12 @@
 # limitations under the License.
 # --------------------------------
 # Import Modules
-import os, sys, arcpy
-import pandas as pd
+import os, sys
+from collections import OrderedDict
 import proximity_lib as pl
+pd = pl.pd  # Imported on first use
 import numpy as np
+arcpy = pl.arcpy  # Imported on first use, None if arcpy is not installed
 
 
 def weighted_standard_deviation(series, weights):
@@ -39,107 +41,194 @@ def weighted_standard_deviation(series, weights):
     return np.sqrt(w_var)
 
 
+def pandas_neighborhood_stats(spatial_weights, fc_df, neighbor_fields, statistics_to_compute, use_weights):
+    """Computes first order neighborhood statistics by merging the SWM edge list with the field values and
+    aggregating with a groupby. Supports the "sum", "mean", and "std" statistics."""
+    swm_df_join_field = str(spatial_weights.unique_id_field).upper()
+    pl.arc_print("Converting spatial weights to dataframe...")
+    swm_df = pl.swm_to_dataframe(spatial_weights)
+    swm_df_nid = "NID"
+    swm_df_weight = "WEIGHT"
+    swm_df = swm_df.set_index(swm_df_nid)
+    pl.arc_print("Combining spatial weights matrix & feature class fields...")
+    swm_df_w_data = pd.merge(swm_df, fc_df, how="left", left_index=True, right_index=True)
+    valid_statistics = ["sum", "mean", "std"]
+    statistics_to_compute = [i for i in statistics_to_compute if i in valid_statistics]
+    if not use_weights:
+        pl.arc_print("Computing non-weighted neighborhood statistics...")
+        swm_df_grps = swm_df_w_data.groupby(swm_df_join_field)
+        swm_df_stats = swm_df_grps[neighbor_fields].agg(statistics_to_compute)
+        swm_df_stats.columns = ["_".join(x) for x in swm_df_stats.columns.ravel()]
+        return swm_df_stats
+    pl.arc_print("Computing weighted neighborhood statistics...")
+    value_fields = list(neighbor_fields) + [swm_df_weight]
+    weights = swm_df_w_data[swm_df_weight]
+    weighted_values = swm_df_w_data[value_fields].multiply(weights, axis="index")
+    aggregate_df = pd.concat([weighted_values.add_prefix("wx_"),
+                              (weighted_values * swm_df_w_data[value_fields]).add_prefix("wxx_")], axis=1)
+    aggregate_df["w"] = weights
+    aggregate_df[swm_df_join_field] = swm_df_w_data[swm_df_join_field]
+    pl.arc_print("Aggregating weights, weighted values, and weighted squared values...")
+    swm_df_aggs = aggregate_df.groupby(swm_df_join_field).agg("sum")
+    weights_sum = swm_df_aggs["w"]
+    weighted_sums = swm_df_aggs[["wx_" + str(i) for i in value_fields]]
+    weighted_sums.columns = value_fields
+    weighted_means = weighted_sums.divide(weights_sum, axis="index")
+    stat_dfs = []
+    if "sum" in statistics_to_compute:
+        pl.arc_print("Computing weighted sum...")
+        stat_dfs.append(weighted_sums.add_prefix("w_sum_"))
+    if "mean" in statistics_to_compute:
+        pl.arc_print("Computing weighted mean...")
+        stat_dfs.append(weighted_means.add_prefix("w_mean_"))
+    if "std" in statistics_to_compute:
+        pl.arc_print("Computing weighted standard deviation...")
+        weighted_squares = swm_df_aggs[["wxx_" + str(i) for i in value_fields]]
+        weighted_squares.columns = value_fields
+        weighted_variance = weighted_squares.divide(weights_sum, axis="index") - weighted_means ** 2
+        stat_dfs.append(np.sqrt(weighted_variance.clip(lower=0)).add_prefix("w_std_"))
+    return pd.concat(stat_dfs, axis=1) if stat_dfs else None
+
+
+def load_spatial_weights(in_fc, spatial_weights_matrix, backend, unique_id_field=None, conceptualization=None,
+                         distance_threshold=None, number_of_neighbors=None, row_standardization=True):
+    """Returns a list of (label, SpatialWeights) tuples for one or more SWM files (a list or a semicolon separated
+    string) or built spatial weights, or for weights built on the fly when no SWM is given. SWM files are labeled
+    with their file name and other weights with their position (W1, W2, ...)."""
+    if isinstance(spatial_weights_matrix, pl.SpatialWeights):
+        spatial_weights_matrix = [spatial_weights_matrix]
+    elif isinstance(spatial_weights_matrix, str):
+        spatial_weights_matrix = [i.strip("'") for i in spatial_weights_matrix.split(";") if i]
+    spatial_weights_list = []
+    if not spatial_weights_matrix and conceptualization:
+        pl.arc_print("Building {0} spatial weights...".format(conceptualization))
+        with pl.stage_timer("build weights") as stage:
+            spatial_weights = pl.build_spatial_weights(in_fc, unique_id_field, conceptualization, distance_threshold,
+                                                       number_of_neighbors, row_standardization=row_standardization,
+                                                       backend=backend)
+            stage.rows = len(spatial_weights.indices)
+        return [("W1", spatial_weights)]
+    for index, weights in enumerate(spatial_weights_matrix or []):
+        if isinstance(weights, pl.SpatialWeights):
+            spatial_weights_list.append(("W{0}".format(index + 1), weights))
+            continue
+        pl.arc_print("Reading SWM file {0}...".format(weights))
+        with pl.stage_timer("read swm") as stage:
+            spatial_weights = pl.read_swm(weights)
+            stage.rows = len(spatial_weights.indices)
+        spatial_weights_list.append((os.path.splitext(os.path.basename(str(weights)))[0], spatial_weights))
+    if not spatial_weights_list:
+        raise ValueError("Neighborhood statistics require a spatial weights matrix or a conceptualization.")
+    return spatial_weights_list
+
+
 # Main Function
 def compute_neighborhood_stats(in_fc, neighbor_fields, spatial_weights_matrix, output_feature_class,
-                               statistics_to_compute=["sum", "mean", "std"], use_weights=True
-                               ):
+                               statistics_to_compute=["sum", "mean", "std"], use_weights=True, engine="AUTO",
+                               backend=None, unique_id_field=None, conceptualization=None, distance_threshold=None,
+                               number_of_neighbors=None, row_standardization=True, lag_order=1):
     """Given an input feature class and a corresponding spatial weights matrix, this tool will compute
     neighborhood level stats based on the spatial relationships defined in the SWM file.
     @param - in_fc - feature class with fields to focalize on the neighborhood level
     @param - neighbor_fields - fields to summarize. Depending on stats chosen, the words "SUM","AVG", or "STD"
     will be prepended to the new name
-    @param - spatial_weights_matrix - swm file that denotes spatial relationships
+    @param - spatial_weights_matrix - swm file that denotes spatial relationships, or spatial weights built by
+    proximity_lib.build_spatial_weights, or a list (or semicolon separated string) of them. If it is empty and a
+    conceptualization is given, the weights are built from in_fc on the fly without an intermediate file
     @param - output feature class - output feature class chosen for the computed copy with new fields added
     @param - statistics_to_compute- statistics chosen to compute based on the spatial relationships - options are
-    denoted by a list with lower case choices between "sum","mean","std"
+    denoted by a list with lower case choices between "sum","mean","std", and with the sparse engine "count","min",
+    "max", and "lag" (spatial lag with row standardized weights)
     @use_weights - boolean indicating if weights are used in SWM
+    @param - engine - "SPARSE" computes the statistics as sparse matrix products of the SWM with the field values,
+    "PANDAS" merges the SWM edge list with the field values and uses a groupby, "AUTO" uses SPARSE if scipy is available
+    @param - backend - how datasets are read and written, "ARCPY", "OPEN", or a backend object (see
+    proximity_lib.get_backend)
+    @param - unique_id_field, conceptualization, distance_threshold, number_of_neighbors, row_standardization -
+    parameters of the spatial weights built on the fly, see proximity_lib.build_spatial_weights
+    @param - lag_order - statistics are computed for neighborhood orders 1 through lag_order with the sparse engine,
+    where order 2 uses the second order lag W^2 (see proximity_lib.sparse_neighborhood_stats)
+    With several weights or orders the feature class is copied and read once, every (weights, order, statistic)
+    combination is computed from the same field values, and the new fields are written in one pass. Their names are
+    prefixed with the weights label (the SWM file name, or W1, W2, ...) and the order, such as SLD_IDW_L2_w_mean_X.
     """
     try:
-        arcpy.env.overwriteOutput = True
-        workspace = os.path.dirname(in_fc)
-        ws = "in_memory"
-        pl.arc_print("Converting SWM file to in_memory table...")
-        swm_table = os.path.join(ws, "swm_table")
-        arcpy.ConvertSpatialWeightsMatrixtoTable_stats(spatial_weights_matrix, swm_table)
-        pl.arc_print("Converting table to dataframe...")
-        swm_df = pl.arcgis_table_to_df(swm_table)
-        swm_df_cols = swm_df.columns
-        swm_df_join_field = str(swm_df_cols[0]).upper()  # First Column should be join field
-        swm_df_nid = "NID"
-        swm_df_weight = "WEIGHT"
-        swm_df = swm_df.set_index(swm_df_nid)
+        backend = pl.get_backend(in_fc, backend)
+        if arcpy:
+            arcpy.env.overwriteOutput = True
+        lag_order = int(lag_order or 1)
+        spatial_weights_list = load_spatial_weights(in_fc, spatial_weights_matrix, backend, unique_id_field,
+                                                    conceptualization, distance_threshold, number_of_neighbors,
+                                                    row_standardization)
+        prefix_columns = len(spatial_weights_list) > 1 or lag_order > 1
         pl.arc_print("Copying output feature classes...")
-        input_feature_fields = [str(i.name) for i in arcpy.ListFields(in_fc)]
+        input_feature_fields = backend.list_fields(in_fc)
         upper_case_fields = [i.upper() for i in input_feature_fields]
-        feature_class_join_field = input_feature_fields[upper_case_fields.index(swm_df_join_field)]
-        fc_fields = [feature_class_join_field]
+        join_fields = []
+        for label, spatial_weights in spatial_weights_list:
+            swm_df_join_field = str(spatial_weights.unique_id_field).upper()  # Unique ID field stored in the SWM
+            join_fields.append(input_feature_fields[upper_case_fields.index(swm_df_join_field)])
+        fc_fields = list(OrderedDict.fromkeys(join_fields))
         fc_fields.extend(neighbor_fields)
-        arcpy.CopyFeatures_management(in_fc, output_feature_class)
-        pl.arc_print("Combining spatial weights matrix & feature class fields...")
-        fc_df = pl.arcgis_table_to_df(output_feature_class, fc_fields)
-        fc_df = fc_df.set_index(feature_class_join_field)
-        swm_df_w_data = pd.merge(swm_df, fc_df, how="left", left_index=True, right_index=True)
-        valid_statistics = ["sum", "mean", "std"]
-        statistics_to_compute = [i for i in statistics_to_compute if i in valid_statistics]
-        if not use_weights:
-            pl.arc_print("Computing non-weighted neighborhood statistics...")
-            swm_df_grps = swm_df_w_data.groupby(swm_df_join_field)
-            swm_df_stats = swm_df_grps[neighbor_fields].agg(statistics_to_compute)
-            swm_df_stats.columns = ["_".join(x) for x in swm_df_stats.columns.ravel()]
-        else:  # Use weights
-            pl.arc_print("Computing weighted neighborhood statistics...")
-            neighbor_fields.append(swm_df_weight)
-            product_fields = []
-            sum_stats, mean_stats, std_stats = None, None, None
-            for field in neighbor_fields:
-                product_field = "temp_prod_" + str(field)
-                swm_df_w_data[product_field] = swm_df_w_data[field] * swm_df_w_data[swm_df_weight]
-                product_fields.append(product_field)  # create weighted products
-            swm_df_grps = swm_df_w_data.groupby(swm_df_join_field)
-            if "sum" in statistics_to_compute:
-                pl.arc_print("Computing weighted sum...")
-                swm_df_stats = swm_df_grps[product_fields].agg("sum")
-                sum_stats = swm_df_stats.copy()
-                sum_stats.columns = ["w_sum_" + i for i in neighbor_fields]
-            if "mean" in statistics_to_compute:
-                pl.arc_print("Computing weighted mean...")
-                swm_df_stats = swm_df_grps[product_fields].agg("sum")
-                mean_stats = swm_df_stats.copy()
-                weights_sum = swm_df_grps[swm_df_weight].agg("sum")
-                mean_stats = mean_stats.divide(weights_sum, axis="index")
-                mean_stats.columns = ["w_mean_" + i for i in neighbor_fields]
-            if "std" in statistics_to_compute:
-                pl.arc_print("Computing weighted standard deviation...")
-                std_stats = None
-                for field in neighbor_fields:
-                    new_std_col = "w_std_" + str(field)
-                    series = swm_df_grps[[field, swm_df_weight]].apply(
-                        lambda x: weighted_standard_deviation(x[field], x[swm_df_weight]))
-                    if std_stats is None:
-                        std_stats = pd.DataFrame({new_std_col: series})
-                    else:
-                        std_stats[new_std_col] = series
-            swm_df_stats = None
-            for potential_statistic_df in [sum_stats, mean_stats, std_stats]:
-                if potential_statistic_df is None:
-                    pass
-                elif swm_df_stats is None:
-                    swm_df_stats = potential_statistic_df
-                else:
-                    swm_df_stats = pd.concat([swm_df_stats, potential_statistic_df], axis=1)
-        df_join_index_field = "DFJNIndex"
-        swm_df_stats[df_join_index_field] = swm_df_stats.index
-        pl.arc_print("Exporting new percentile dataframe to structured numpy array.", True)
-        finalStandardArray = swm_df_stats.to_records()
+        with pl.stage_timer("copy"):
+            backend.copy_dataset(in_fc, output_feature_class)
+        pl.arc_print("Reading feature class fields...")
+        with pl.stage_timer("read") as stage:
+            fc_table = backend.read_table(output_feature_class, fc_fields)
+            stage.rows = len(fc_table)
+        use_sparse_engine = str(engine).upper() == "SPARSE" or (str(engine).upper() == "AUTO" and
+                                                                pl.sparse is not None)
+        if lag_order > 1 and not use_sparse_engine:
+            raise ValueError("Higher order neighborhood statistics require the SPARSE engine.")
+        value_block = fc_table[neighbor_fields].to_numpy(dtype=np.float64)
+        stat_frames = []
+        for (label, spatial_weights), feature_class_join_field in zip(spatial_weights_list, join_fields):
+            swm_df_join_field = str(spatial_weights.unique_id_field).upper()
+            join_values = fc_table[feature_class_join_field].values
+            if use_sparse_engine:
+                valid_statistics = ["sum", "mean", "std", "count", "min", "max", "lag"]
+                pl.arc_print("Computing order 1 to {0} neighborhood statistics of {1} with sparse spatial weights "
+                             "matrix products...".format(lag_order, label))
+                with pl.stage_timer("statistics", len(fc_table)):
+                    order_stats = pl.sparse_neighborhood_stats(
+                        spatial_weights, join_values, value_block, neighbor_fields,
+                        [i for i in statistics_to_compute if i in valid_statistics], use_weights, lag_order=lag_order)
+                for swm_df_stats in order_stats:
+                    swm_df_stats.index.name = swm_df_join_field
+            else:
+                order_stats = [pandas_neighborhood_stats(spatial_weights, fc_table.set_index(feature_class_join_field),
+                                                         neighbor_fields, statistics_to_compute, use_weights)]
+            for order, swm_df_stats in enumerate(order_stats, 1):
+                if swm_df_stats is None:
+                    continue
+                join_value_oids = pd.Series(fc_table.index.values, index=join_values)
+                join_value_oids = join_value_oids[~join_value_oids.index.duplicated()]
+                stat_oids = join_value_oids.reindex(swm_df_stats.index)
+                swm_df_stats = swm_df_stats[stat_oids.notnull().values]
+                swm_df_stats.index = pd.Index(stat_oids.dropna().astype(np.int64).values, name="OID")
+                if prefix_columns:
+                    swm_df_stats = swm_df_stats.add_prefix("{0}_L{1}_".format(label, order))
+                stat_frames.append(swm_df_stats)
+        pl.arc_print("Matching neighborhood statistics to feature object IDs...", True)
+        swm_df_stats = pd.concat(stat_frames, axis=1) if stat_frames else pd.DataFrame()
+        stat_oids = swm_df_stats.index.values
+        new_columns = []
+        with pl.stage_timer("add fields"), pl.SchemaManager(output_feature_class, backend) as schema:
+            for stat_column in swm_df_stats.columns:
+                valid_field_name = schema.validate_field_name(str(stat_column))
+                schema.add_field(valid_field_name, "DOUBLE", field_alias=str(stat_column))
+                new_columns.append((valid_field_name, swm_df_stats[stat_column].to_numpy(dtype=np.float64)))
         pl.arc_print(
             "Joining new fields to feature class. The new fields are {0}".format(str(swm_df_stats.columns))
             , True)
-        arcpy.da.ExtendTable(output_feature_class, feature_class_join_field, finalStandardArray, df_join_index_field,
-                             append_only=False)
+        with pl.stage_timer("write", len(stat_oids)):
+            backend.write_columns(output_feature_class, stat_oids, new_columns)
         pl.arc_print("Script Completed Successfully.", True)
     except Exception as e:
         pl.arc_print(str(e.args[0]))
         print(e.args[0])
+        if not pl.SCRIPT_TOOL_RUN:
+            raise
 
 
 # This test allows the script to be used from the operating
@@ -147,9 +236,10 @@ def compute_neighborhood_stats(in_fc, neighbor_fields, spatial_weights_matrix, o
 # as a geoprocessing script tool, or as a module imported in
 # another script
 if __name__ == '__main__':
+    pl.SCRIPT_TOOL_RUN = True
     input_features = arcpy.GetParameterAsText(0)
     neighbor_fields = arcpy.GetParameterAsText(1).split(";")
-    spatial_weights_matrix = arcpy.GetParameterAsText(2)
+    spatial_weights_matrix = arcpy.GetParameterAsText(2)  # One or more SWM files separated by semicolons
     output_feature_class = arcpy.GetParameterAsText(3)
     use_weights = bool(arcpy.GetParameterAsText(4))
     use_sum = "sum" if bool(arcpy.GetParameterAsText(5)) else None
@@ -23,11 +23,125 @@
 # limitations under the License.
 # --------------------------------
 # Import Modules
-import os, sys, arcpy
+import os, sys
+import datetime, getpass, hashlib, importlib, itertools, json, mmap, multiprocessing, pickle, re, shutil, \
+    sqlite3, stat, struct, tempfile, time, timeit
+from collections import namedtuple, OrderedDict
+
+
+class LazyImport(object):
+    """Stands in for a module, or an attribute of a module, that is imported the first time it is used, so a tool
+    only pays the import time of the heavy libraries it actually uses."""
+
+    def __init__(self, module_name, attribute_name=None):
+        self._module_name = module_name
+        self._attribute_name = attribute_name
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._module_name)
+            self._target = getattr(target, self._attribute_name) if self._attribute_name else target
+        return self._target
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        return "<lazy import of {0}>".format(".".join(filter(None, [self._module_name, self._attribute_name])))
+
+
+def lazy_import(module_name, attribute_name=None):
+    """Returns a LazyImport of a module or module attribute, or None if the module is not installed. Whether the
+    module is installed is looked up without importing it, so a None check still tells which engines are available.
+    :param - module_name - dotted name of the module
+    :param - attribute_name - optional name of the module attribute, such as a class
+    :returns - LazyImport or None"""
+    try:
+        from importlib.util import find_spec
+    except ImportError:  # Python 2 imports the module right away
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            return None
+        return getattr(module, attribute_name) if attribute_name else module
+    if find_spec(module_name.split(".")[0]) is None:
+        return None
+    return LazyImport(module_name, attribute_name)
+
+
+arcpy = lazy_import("arcpy")  # Tools run headless with the open source backend when it is None
 try:
-    import pandas as pd
+    import numpy as np
 except:
-    arcpy.AddError("Library requires that the pandas library is installed.")
+    (arcpy.AddError if arcpy else print)("Library requires that the numpy library is installed.")
+pd = lazy_import("pandas")
+if pd is None:
+    (arcpy.AddError if arcpy else print)("Library requires that the pandas library is installed.")
+cKDTree = lazy_import("scipy.spatial", "cKDTree")  # In process near engines fall back to arcpy.Near_analysis
+sparse = lazy_import("scipy.sparse")  # Neighborhood statistics fall back to the pandas engine
+csgraph = lazy_import("scipy.sparse.csgraph")  # Network distances are unavailable
+shapely = lazy_import("shapely")  # STRtree near engine and open source backend are unavailable
+pyogrio = lazy_import("pyogrio")  # Open source backend is unavailable
+pyarrow = lazy_import("pyarrow")  # GeoParquet datasets are unavailable
+pq = lazy_import("pyarrow.parquet")
+pyproj = lazy_import("pyproj")  # Open source backend can not convert linear units or project coordinates
+try:
+    import resource
+except ImportError:
+    resource = None  # Run reports do not record peak memory on Windows
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Run reports can not trace memory allocations on Python 2
+process_time = getattr(time, "process_time", None) or time.clock  # time.clock is the cpu timer of Python 2
+
+# Near Analysis Constants
+NEAR_NO_MATCH = -1  # Value Near_analysis writes when no feature is found within the search radius
+LINEAR_UNIT_METERS = {"METERS": 1.0, "KILOMETERS": 1000.0, "DECIMETERS": 0.1, "CENTIMETERS": 0.01,
+                      "MILLIMETERS": 0.001, "FEET": 0.3048, "INTERNATIONALFEET": 0.3048, "FEETUS": 1200.0 / 3937.0,
+                      "USSURVEYFEET": 1200.0 / 3937.0, "INCHES": 0.0254, "YARDS": 0.9144, "MILES": 1609.344,
+                      "NAUTICALMILES": 1852.0}
+WGS84_ELLIPSOID = (6378137.0, 1 / 298.257223563)  # Semi-major axis in meters and flattening
+# Field Type Constants
+FLOAT_FIELD_TYPES = ["Double", "Single"]
+INTEGER_FIELD_TYPES = ["OID", "Integer", "SmallInteger", "BigInteger"]
+COLUMNAR_FIELD_TYPES = FLOAT_FIELD_TYPES + INTEGER_FIELD_TYPES + ["String", "Date", "GUID", "GlobalID"]
+
+# Open Source Backend Constants
+OGR_DATASET_DRIVERS = {".gpkg": "GPKG", ".shp": "ESRI Shapefile", ".gdb": "OpenFileGDB"}
+PARQUET_EXTENSIONS = [".parquet", ".geoparquet"]
+SQLITE_FIELD_TYPES = {"DOUBLE": "REAL", "FLOAT": "REAL", "LONG": "INTEGER", "SHORT": "INTEGER", "INTEGER": "INTEGER",
+                      "BIGINTEGER": "INTEGER", "TEXT": "TEXT", "DATE": "DATETIME"}
+NUMPY_FIELD_TYPES = {"DOUBLE": np.float64, "FLOAT": np.float32, "LONG": np.int32, "SHORT": np.int16,
+                     "INTEGER": np.int32, "BIGINTEGER": np.int64, "TEXT": object, "DATE": object}
+
+GEOMETRY_TYPE_NAMES = ["Point", "LineString", "LinearRing", "Polygon", "MultiPoint", "MultiLineString", "MultiPolygon"]
+
+DatasetSpatialReference = namedtuple("DatasetSpatialReference", ["name", "crs", "metersPerUnit", "type"])
+# Parallel Near Engine Constants
+NEAR_RESULT_DTYPES = [("DIST", np.float64, NEAR_NO_MATCH), ("X", np.float64, NEAR_NO_MATCH),
+                      ("Y", np.float64, NEAR_NO_MATCH), ("ANGLE", np.float64, 0), ("FID", np.int64, NEAR_NO_MATCH)]
+ACTIVE_RUN_REPORT = None  # RunReport recording stage timings, stages are not timed while it is None
+SCRIPT_TOOL_RUN = False  # Set by the tools' __main__ blocks, tool errors are only reported in script tools
+CURSOR_SPATIAL_FILTER = None  # If arcpy.da cursors accept a spatial filter, detected on first use
+WORKER_NEAR_INDEX = {}  # KD-tree of the near layer a pool worker last queried, keyed by the layer's directory
+ACCESSIBILITY_METRICS = ["COUNT", "SUM", "GRAVITY", "GAUSSIAN", "EPANECHNIKOV"]
+
+SWM_HEADER_KEYS = ["VERSION", "UNIQUEID", "SPATIALREFNAME", "INPUTFC", "WTYPE", "DISTANCEMETHOD", "EXPONENT",
+                   "THRESHOLD", "NUMNEIGHS", "INPUTTABLE", "TIMEFIELD", "TIMETYPE", "TIMEVALUE", "INPUTNET",
+                   "IMPEDANCEFIELD", "BARRIERFC", "UTURNPOLICY", "RESTRICTIONS", "USEHIERARCHY", "SEARCHTOLERANCE",
+                   "ADDCONCEPT", "FIXEDWEIGHTS", "HASZ"]
+NetworkGraph = namedtuple("NetworkGraph", ["node_xy", "segment_nodes", "segment_lengths", "segments",
+                                           "segment_tree"])
+SWM_WEIGHT_TYPES = {"INVERSE_DISTANCE": 0, "FIXED_DISTANCE": 1, "K_NEAREST_NEIGHBORS": 2,
+                    "CONTIGUITY_EDGES_ONLY": 4, "CONTIGUITY_EDGES_CORNERS": 5}  # WTYPE codes of the swm header
+TileGrid = namedtuple("TileGrid", ["extent", "columns", "rows", "width", "height"])
+SpatialWeights = namedtuple("SpatialWeights", ["unique_id_field", "ids", "indptr", "indices", "weights",
+                                               "row_standardized", "header"])
 
 # Function Definitions
 
@@ -70,19 +184,20 @@ def arc_tool_report(function=None, arcToolMessageBool=False, arcProgressorBool=F
         def func_wrapper(*args, **kwargs):
             try:
                 func_result = function(*args, **kwargs)
-                if arcToolMessageBool:
+                if arcToolMessageBool and arcpy:
                     arcpy.AddMessage("Function:{0}".format(str(function.__name__)))
                     arcpy.AddMessage("     Input(s):{0}".format(str(args)))
                     arcpy.AddMessage("     Output(s):{0}".format(str(func_result)))
-                if arcProgressorBool:
+                if arcProgressorBool and arcpy:
                     arcpy.SetProgressorLabel("Function:{0}".format(str(function.__name__)))
                     arcpy.SetProgressorLabel("     Input(s):{0}".format(str(args)))
                     arcpy.SetProgressorLabel("     Output(s):{0}".format(str(func_result)))
                 return func_result
             except Exception as e:
-                arcpy.AddMessage(
-                    "{0} - function failed -|- Function arguments were:{1}.".format(str(function.__name__),
-                                                                                    str(args)))
+                if arcpy:
+                    arcpy.AddMessage(
+                        "{0} - function failed -|- Function arguments were:{1}.".format(str(function.__name__),
+                                                                                        str(args)))
                 print(
                     "{0} - function failed -|- Function arguments were:{1}.".format(str(function.__name__), str(args)))
                 print(e.args[0])
@@ -98,12 +213,13 @@ def arc_tool_report(function=None, arcToolMessageBool=False, arcProgressorBool=F
         return arc_tool_report_decorator(function)
 
 
-@arc_tool_report
 def arc_print(string, progressor_Bool=False):
     """ This function is used to simplify using arcpy reporting for tool creation,if progressor bool is true it will
     create a tool label."""
     casted_string = str(string)
-    if progressor_Bool:
+    if arcpy is None or "arcpy" not in sys.modules:  # Headless runs do not import arcpy just to print
+        print(casted_string)
+    elif progressor_Bool:
         arcpy.SetProgressorLabel(casted_string)
         arcpy.AddMessage(casted_string)
         print(casted_string)
@@ -112,7 +228,146 @@ def arc_print(string, progressor_Bool=False):
         print(casted_string)
 
 
-@arc_tool_report
+def arc_warning(string):
+    """Reports a warning, with arcpy.AddWarning inside ArcGIS and printed otherwise."""
+    casted_string = str(string)
+    if arcpy is not None and "arcpy" in sys.modules:
+        arcpy.AddWarning(casted_string)
+    print("WARNING: " + casted_string)
+
+
+class RunReport(object):
+    """Collects the wall time, cpu time, row counts, and peak memory of the stages of a tool run, timed with
+    stage_timer, and writes them to a JSON run report. Use it as a context manager around a tool call:
+
+        with RunReport("chained_near_report.json", profile=True) as report:
+            chained_near_analysis(...)
+
+    Stages are only recorded while a report is active, otherwise the timers do nothing. With profile, the run is
+    also profiled with cProfile, and the slowest functions are added to the report (and the raw profile is written
+    next to the output as a .prof file). With trace_memory, tracemalloc records the peak Python heap of every stage,
+    which slows the run down. Tools called from Python raise their errors after reporting them, so a failed
+    run is recorded as failed."""
+
+    def __init__(self, output=None, name=None, profile=False, trace_memory=False, profile_functions=30):
+        self.output = output
+        self.name = name
+        self.profile = profile
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.profile_functions = profile_functions
+        self.stages = []
+        self.stage_stack = []
+        self.report = None
+
+    def __enter__(self):
+        global ACTIVE_RUN_REPORT
+        self.previous_report = ACTIVE_RUN_REPORT
+        ACTIVE_RUN_REPORT = self
+        self.started = datetime.datetime.now().isoformat()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.profiler = None
+        if self.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_wall, self.start_cpu = timeit.default_timer(), process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global ACTIVE_RUN_REPORT
+        wall_seconds, cpu_seconds = timeit.default_timer() - self.start_wall, process_time() - self.start_cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+        ACTIVE_RUN_REPORT = self.previous_report
+        self.report = OrderedDict([("name", self.name), ("started", self.started), ("wall_seconds", wall_seconds),
+                                   ("cpu_seconds", cpu_seconds), ("peak_rss_mb", peak_rss_mb()),
+                                   ("failed", exc_type is not None), ("stages", self.stages)])
+        if self.trace_memory:
+            self.report["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1048576.0
+            tracemalloc.stop()
+        if self.profiler is not None:
+            self.report["profile"] = self.profile_summary()
+            if self.output:
+                self.profiler.dump_stats(os.path.splitext(self.output)[0] + ".prof")
+        if self.output:
+            with open(self.output, "w") as report_file:
+                json.dump(self.report, report_file, indent=2)
+        return False
+
+    def profile_summary(self):
+        """Returns the functions with the highest cumulative time in the cProfile statistics."""
+        import pstats
+        statistics = pstats.Stats(self.profiler).stats
+        functions = sorted(statistics.items(), key=lambda item: item[1][3], reverse=True)[:self.profile_functions]
+        return [OrderedDict([("function", "{0}:{1}({2})".format(*function)), ("calls", calls),
+                             ("total_seconds", total_time), ("cumulative_seconds", cumulative_time)])
+                for function, (primitive_calls, calls, total_time, cumulative_time, callers) in functions]
+
+
+class StageTimer(object):
+    """Times one stage of a run for the active RunReport. The row count can be passed in, or set on the timer
+    inside the with block once it is known."""
+
+    def __init__(self, report, name, rows=None):
+        self.report = report
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.parent = self.report.stage_stack[-1].name if self.report.stage_stack else None
+        self.report.stage_stack.append(self)
+        if self.report.trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.start_wall, self.start_cpu = timeit.default_timer(), process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds, cpu_seconds = timeit.default_timer() - self.start_wall, process_time() - self.start_cpu
+        self.report.stage_stack.pop()
+        stage = OrderedDict([("name", self.name), ("parent", self.parent), ("wall_seconds", wall_seconds),
+                             ("cpu_seconds", cpu_seconds), ("rows", self.rows),
+                             ("rows_per_second", self.rows / wall_seconds if self.rows and wall_seconds else None),
+                             ("peak_rss_mb", peak_rss_mb()), ("failed", exc_type is not None)])
+        if self.report.trace_memory:
+            stage["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1048576.0
+        self.report.stages.append(stage)
+        return False
+
+
+class NullStageTimer(object):
+    """Stage timer returned when no RunReport is active, so disabled instrumentation costs one global lookup."""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE_TIMER = NullStageTimer()
+
+
+def stage_timer(name, rows=None):
+    """Returns a context manager timing a stage of the active RunReport, or a timer doing nothing if no report is
+    active.
+    :param - name - stage name, such as "read", "index", "query", "score", or "write"
+    :param - rows - number of rows the stage processes, can also be set on the returned timer
+    :returns - StageTimer or NullStageTimer"""
+    if ACTIVE_RUN_REPORT is None:
+        return NULL_STAGE_TIMER
+    return StageTimer(ACTIVE_RUN_REPORT, name, rows)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process in megabytes, or None where resource is unavailable."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1048576.0 if sys.platform == "darwin" else peak_rss / 1024.0  # Linux reports kilobytes
+
+
 def field_exist(feature_class, field_name):
     """ArcFunction
      Check if a field in a feature class field exists and return true it does, false if not.
@@ -126,7 +381,6 @@ def field_exist(feature_class, field_name):
         return False
 
 
-@arc_tool_report
 def add_new_field(in_table, field_name, field_type, field_precision="#", field_scale="#", field_length="#",
                   field_alias="#", field_is_nullable="#", field_is_required="#", field_domain="#"):
     """ArcFunction
@@ -143,6 +397,21 @@ def add_new_field(in_table, field_name, field_type, field_precision="#", field_s
                                   field_is_nullable, field_is_required, field_domain)
 
 
+def add_new_fields(in_table, field_descriptions):
+    """ArcFunction
+    Adds a set of new fields with one AddFields call, or with one AddField call per field before ArcGIS Pro 2.5.
+    @param - in_table - table or feature class receiving the fields
+    @param - field_descriptions - list of (field name, field type, field alias) tuples of fields that do not exist"""
+    if not field_descriptions:
+        return
+    if hasattr(arcpy.management, "AddFields"):
+        arcpy.management.AddFields(in_table, [[field_name, field_type, field_alias]
+                                              for field_name, field_type, field_alias in field_descriptions])
+    else:
+        for field_name, field_type, field_alias in field_descriptions:
+            arcpy.AddField_management(in_table, field_name, field_type, field_alias=field_alias)
+
+
 @arc_tool_report
 def constructSQLEqualityQuery(fieldName, value, dataSource, equalityOperator="=", noneEqualityOperator="is"):
     """Creates a workspace sensitive equality query to be used in arcpy/SQL statements. If the value is a string,
@@ -170,7 +439,6 @@ def constructSQLEqualityQuery(fieldName, value, dataSource, equalityOperator="="
                                         str(value))
 
 
-@arc_tool_report
 def arc_unique_values(table, field, filter_falsy=False):
     """This function will return a list of unique values from a passed field. If the optional bool is true,
     this function will scrub out null/falsy values. """
@@ -181,20 +449,3216 @@ def arc_unique_values(table, field, filter_falsy=False):
             return sorted({row[0] for row in cursor})
 
 
-@arc_tool_report
-def arcgis_table_to_df(in_fc, input_fields=None, query=""):
+def field_types(in_table, fields=None):
+    """Returns a dictionary of the arcpy field type of every field in a table, keyed by field name.
+    :param - in_table - input table or feature class
+    :param - fields - optional list of field names to limit the dictionary to
+    :returns - dictionary of field name to field type strings such as "Double" or "String" """
+    types = dict((field.name, field.type) for field in arcpy.ListFields(in_table))
+    if fields is None:
+        return types
+    return dict((field, types.get(field, "Unknown")) for field in fields)
+
+
+def cursor_values_to_column(values, field_type, null_value=None, downcast=False):
+    """Converts the values of one field returned by a cursor into a typed numpy column. Nulls become NaN in float
+    columns and in integer columns that contain nulls, unless a null fill value is passed.
+    :param - values - sequence of field values
+    :param - field_type - arcpy field type of the values
+    :param - null_value - optional value that replaces nulls
+    :param - downcast - if true, float columns become float32 and integer columns that fit become int32
+    :returns - numpy array"""
+    if null_value is not None:
+        values = [null_value if value is None else value for value in values]
+    if field_type in FLOAT_FIELD_TYPES:
+        column = np.array(values, dtype=np.float64)
+    elif field_type in INTEGER_FIELD_TYPES:
+        column = np.array(values, dtype=np.float64 if None in values else np.int64)
+    else:
+        column = np.empty(len(values), dtype=object)
+        column[:] = list(values)
+    return downcast_column(column) if downcast else column
+
+
+def downcast_column(column):
+    """Downcasts a float64 column to float32 and an int64 column to int32 if its values fit in 32 bits.
+    :param - column - numpy array
+    :returns - numpy array"""
+    if column.dtype == np.float64:
+        return column.astype(np.float32)
+    if column.dtype == np.int64 and (not len(column) or (column.min() >= np.iinfo(np.int32).min and
+                                                         column.max() <= np.iinfo(np.int32).max)):
+        return column.astype(np.int32)
+    return column
+
+
+def arcgis_table_to_df_chunks(in_fc, input_fields=None, query="", chunk_size=100000, downcast=False,
+                              null_values=None):
+    """Generator that reads an arcgis table into pandas dataframes of at most chunk_size rows, with an object ID
+    index and typed columns built directly from each chunk of cursor rows. Use this for streaming consumers that
+    should not hold the whole table in memory.
+    :param - in_fc - input feature class or table to convert
+    :param - input_fields - fields to input to a da search cursor for retrieval
+    :param - query - sql query to grab appropriate values
+    :param - chunk_size - maximum number of rows per dataframe
+    :param - downcast - if true, use float32 and int32 columns where possible
+    :param - null_values - optional dictionary of values replacing nulls, keyed by field name
+    :returns - generator of pandas.DataFrame"""
+    OIDFieldName = arcpy.Describe(in_fc).OIDFieldName
+    if input_fields:
+        final_fields = [OIDFieldName] + list(input_fields)
+    else:
+        final_fields = [field.name for field in arcpy.ListFields(in_fc)]
+    types = field_types(in_fc, final_fields)
+    null_values = null_values or {}
+    with arcpy.da.SearchCursor(in_fc, final_fields, where_clause=query) as cursor:
+        while True:
+            rows = list(itertools.islice(cursor, chunk_size))
+            if not rows:
+                break
+            columns = OrderedDict((field, cursor_values_to_column(values, types[field], null_values.get(field),
+                                                                  downcast and field != OIDFieldName))
+                                  for field, values in zip(final_fields, zip(*rows)))
+            yield pd.DataFrame(columns, columns=final_fields).set_index(OIDFieldName, drop=True)
+
+
+def arcgis_table_to_df(in_fc, input_fields=None, query="", downcast=False, null_values=None):
     """Function will convert an arcgis table into a pandas dataframe with an object ID index, and the selected
-    input fields using an arcpy.da.SearchCursor.
+    input fields. Typed columns are built directly with arcpy.da.TableToNumPyArray (nulls in float fields become NaN),
+    falling back to a chunked arcpy.da.SearchCursor for geometry fields or nulls without a fill value.
     :param - in_fc - input feature class or table to convert
     :param - input_fields - fields to input to a da search cursor for retrieval
     :param - query - sql query to grab appropriate values
+    :param - downcast - if true, use float32 and int32 columns where possible
+    :param - null_values - optional dictionary of values replacing nulls, keyed by field name
     :returns - pandas.DataFrame"""
     OIDFieldName = arcpy.Describe(in_fc).OIDFieldName
     if input_fields:
-        final_fields = [OIDFieldName] + input_fields
+        final_fields = [OIDFieldName] + list(input_fields)
     else:
         final_fields = [field.name for field in arcpy.ListFields(in_fc)]
-    data = [row for row in arcpy.da.SearchCursor(in_fc,final_fields,where_clause=query)]
-    fc_dataframe = pd.DataFrame(data,columns=final_fields)
-    fc_dataframe = fc_dataframe.set_index(OIDFieldName,drop=True)
-    return fc_dataframe
\ No newline at end of file
+    types = field_types(in_fc, final_fields)
+    if all(types[field] in COLUMNAR_FIELD_TYPES for field in final_fields):
+        fill_values = dict((field, np.nan) for field in final_fields if types[field] in FLOAT_FIELD_TYPES)
+        fill_values.update(null_values or {})
+        try:
+            table_array = arcpy.da.TableToNumPyArray(in_fc, final_fields, query, skip_nulls=False,
+                                                     null_value=fill_values)
+            columns = OrderedDict((field, downcast_column(table_array[field]) if downcast and field != OIDFieldName
+                                   else table_array[field]) for field in final_fields)
+            fc_dataframe = pd.DataFrame(columns, columns=final_fields)
+            return fc_dataframe.set_index(OIDFieldName, drop=True)
+        except (RuntimeError, TypeError, ValueError):
+            pass  # Nulls in integer, text, or date fields without a fill value
+    chunks = list(arcgis_table_to_df_chunks(in_fc, input_fields, query, downcast=downcast, null_values=null_values))
+    if not chunks:
+        return pd.DataFrame(columns=final_fields).set_index(OIDFieldName, drop=True)
+    return pd.concat(chunks)
+
+
+def linear_unit_to_dataset_units(search_radius, spatial_reference=None):
+    """Converts a search radius passed to a near tool into the linear units of a spatial reference. Mirrors the
+    Near_analysis semantics: an empty radius means all features are searched, and a unitless number is assumed to be
+    in the units of the input features.
+    :param - search_radius - None, a number, or a linear unit such as "1000 Meters" or an arcpy LinearUnit
+    :param - spatial_reference - spatial reference of the input features
+    :returns - float radius in dataset units or None if there is no search radius"""
+    if search_radius is None:
+        return None
+    radius_parts = str(search_radius).strip().split()
+    if not radius_parts or radius_parts[0] in ["#", "None"]:
+        return None
+    radius = float(radius_parts[0])
+    if len(radius_parts) == 1:
+        return radius
+    unit_name = "".join(radius_parts[1:]).upper().replace("_", "")
+    meters_per_dataset_unit = getattr(spatial_reference, "metersPerUnit", None)
+    if unit_name not in LINEAR_UNIT_METERS or not meters_per_dataset_unit:
+        return radius
+    return radius * LINEAR_UNIT_METERS[unit_name] / float(meters_per_dataset_unit)
+
+
+def cursor_spatial_filter_supported():
+    """Returns true if arcpy.da cursors accept the spatial_filter argument, which was added in ArcGIS Pro 3.2."""
+    global CURSOR_SPATIAL_FILTER
+    if CURSOR_SPATIAL_FILTER is None:
+        install_info = arcpy.GetInstallInfo()
+        version = tuple(int(part) for part in re.findall(r"\d+", str(install_info.get("Version", "")))[:2])
+        CURSOR_SPATIAL_FILTER = install_info.get("ProductName") == "ArcGISPro" and version >= (3, 2)
+    return CURSOR_SPATIAL_FILTER
+
+
+def extent_spatial_filter(in_fc, bbox, spatial_reference=None):
+    """Returns the arguments of an arcpy.da cursor that limit it to the features intersecting a bounding box. Before
+    ArcGIS Pro 3.2 cursors have no spatial filter and no arguments are returned, so callers still have to check the
+    coordinates they read, see bbox_mask.
+    :param - in_fc - feature class the cursor reads
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple in the units of spatial_reference
+    :param - spatial_reference - spatial reference of the bounding box, None uses the one of in_fc
+    :returns - dictionary of cursor keyword arguments"""
+    if not cursor_spatial_filter_supported():
+        return {}
+    if spatial_reference is None:
+        spatial_reference = arcpy.Describe(in_fc).spatialReference
+    xmin, ymin, xmax, ymax = bbox
+    return {"spatial_filter": arcpy.Extent(xmin, ymin, xmax, ymax, spatial_reference=spatial_reference).polygon,
+            "spatial_relationship": "INTERSECTS"}
+
+
+def bbox_mask(xy, bbox):
+    """Returns a boolean mask of the coordinates inside a bounding box, boundary included.
+    :param - xy - n x 2 coordinate array
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple or None, which selects every coordinate
+    :returns - boolean numpy array"""
+    if bbox is None:
+        return np.ones(len(xy), dtype=bool)
+    return (xy[:, 0] >= bbox[0]) & (xy[:, 1] >= bbox[1]) & (xy[:, 0] <= bbox[2]) & (xy[:, 1] <= bbox[3])
+
+
+def read_point_coordinates(in_fc, query="", spatial_reference=None, bbox=None):
+    """Reads the object IDs and x/y coordinates of a point feature class into numpy arrays with one
+    arcpy.da.FeatureClassToNumPyArray call. Features with null geometries are skipped.
+    :param - in_fc - input point feature class or layer
+    :param - query - sql query to filter the features read
+    :param - spatial_reference - optional spatial reference to project the coordinates into
+    :param - bbox - optional (xmin, ymin, xmax, ymax) tuple in the output spatial reference, only the features inside
+    it are read with a spatially filtered cursor
+    :returns - tuple of (object id array, n x 2 coordinate array)"""
+    if bbox is not None:
+        rows = [row for row in arcpy.da.SearchCursor(in_fc, ["OID@", "SHAPE@X", "SHAPE@Y"], query, spatial_reference,
+                                                     **extent_spatial_filter(in_fc, bbox, spatial_reference))
+                if row[1] is not None]
+        oids = np.array([row[0] for row in rows], dtype=np.int64)
+        xy = np.array([(row[1], row[2]) for row in rows], dtype=np.float64).reshape(-1, 2)
+        inside = bbox_mask(xy, bbox)
+        return oids[inside], xy[inside]
+    point_array = arcpy.da.FeatureClassToNumPyArray(in_fc, ["OID@", "SHAPE@X", "SHAPE@Y"], query, spatial_reference,
+                                                    skip_nulls=True)
+    oids = point_array["OID@"].astype(np.int64)
+    xy = np.column_stack([point_array["SHAPE@X"], point_array["SHAPE@Y"]]).astype(np.float64)
+    return oids, xy
+
+
+def near_kdtree_query(near_tree, near_oids, near_xy, in_xy, search_radius=None):
+    """Queries a KD-tree of near features with an array of input points and returns the same values
+    Near_analysis (PLANAR) would compute for each point. Points without a near feature within the search radius
+    receive -1 for every value except the angle, which is 0.
+    :param - near_tree - scipy.spatial.cKDTree built on near_xy, or None if there are no near features
+    :param - near_oids - object ids of the near features
+    :param - near_xy - n x 2 coordinates of the near features
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - search_radius - search radius in dataset units, None searches all features
+    :returns - dictionary of numpy arrays keyed by "DIST", "X", "Y", "ANGLE", "FID" """
+    point_count = len(in_xy)
+    results = {"DIST": np.full(point_count, NEAR_NO_MATCH, dtype=np.float64),
+               "X": np.full(point_count, NEAR_NO_MATCH, dtype=np.float64),
+               "Y": np.full(point_count, NEAR_NO_MATCH, dtype=np.float64),
+               "ANGLE": np.zeros(point_count, dtype=np.float64),
+               "FID": np.full(point_count, NEAR_NO_MATCH, dtype=np.int64)}
+    if near_tree is None or point_count == 0:
+        return results
+    upper_bound = np.inf if search_radius is None else np.nextafter(search_radius, np.inf)  # Radius is inclusive
+    distances, indices = near_tree.query(in_xy, k=1, distance_upper_bound=upper_bound)
+    found = np.isfinite(distances)
+    near_index = indices[found]
+    delta = near_xy[near_index] - in_xy[found]
+    results["DIST"][found] = distances[found]
+    results["X"][found] = near_xy[near_index, 0]
+    results["Y"][found] = near_xy[near_index, 1]
+    results["ANGLE"][found] = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+    results["FID"][found] = near_oids[near_index]
+    return results
+
+
+def chained_near_arrays(in_xy, near_layers, search_radius=None, batch_size=250000, workers=1, near_trees=None):
+    """In process engine for chained near analysis. A KD-tree is built once for every near layer and all input
+    points are queried against every index in vectorized batches, so each dataset is only read once.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - batch_size - number of input points queried against the indexes at a time
+    :param - workers - number of processes, 1 queries in process, otherwise see parallel_chained_near_arrays
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name, see NearIndexCache
+    :returns - dictionary keyed by layer name of the result dictionaries returned by near_kdtree_query"""
+    near_trees = near_trees or {}
+    if near_worker_count(workers) > 1 and len(in_xy) and near_layers:
+        return parallel_chained_near_arrays(in_xy, near_layers, search_radius, workers, batch_size, near_trees)
+    point_count = len(in_xy)
+    near_indexes = []
+    layer_results = {}
+    for layer_name, near_oids, near_xy in near_layers:
+        near_tree = near_trees[layer_name] if layer_name in near_trees else cKDTree(near_xy) if len(near_xy) else None
+        near_indexes.append((layer_name, near_tree, near_oids, near_xy))
+        layer_results[layer_name] = near_kdtree_query(None, near_oids, near_xy, np.empty((point_count, 2)))
+    for start in range(0, point_count, batch_size):
+        batch_xy = in_xy[start:start + batch_size]
+        for layer_name, near_tree, near_oids, near_xy in near_indexes:
+            batch_results = near_kdtree_query(near_tree, near_oids, near_xy, batch_xy, search_radius)
+            for key, values in batch_results.items():
+                layer_results[layer_name][key][start:start + batch_size] = values
+    return layer_results
+
+
+def near_worker_count(workers=1):
+    """Returns the number of processes a parallel near engine should use.
+    :param - workers - requested worker count, None or 1 runs in process, 0 or less uses every cpu
+    :returns - integer worker count"""
+    if workers is None:
+        return 1
+    workers = int(workers)
+    if workers <= 0:
+        return multiprocessing.cpu_count()
+    return workers
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    """Creates a multiprocessing pool. Inside ArcGIS Pro and ArcMap sys.executable is the application rather than
+    python, so the pool is pointed at the python executable of the running environment first.
+    :param - workers - number of worker processes
+    :param - initializer - optional function every worker process calls with initargs when it starts
+    :returns - multiprocessing.Pool"""
+    if sys.platform.startswith("win"):
+        python_executable = os.path.join(sys.exec_prefix, "python.exe")
+        if os.path.exists(python_executable):
+            multiprocessing.set_executable(python_executable)
+    return multiprocessing.Pool(workers, initializer, initargs)
+
+
+def kdtree_near_worker(task):
+    """Pool worker of parallel_chained_near_arrays. Queries one chunk of input points against one near layer and
+    writes the results into the memory mapped result files of the layer. Input and near arrays are memory mapped
+    from disk, so they are shared through the page cache instead of being pickled to every worker.
+    :param - task - tuple of (input coordinate file, layer directory, chunk start, chunk stop, search radius)
+    :returns - number of input points queried"""
+    in_xy_path, layer_directory, start, stop, search_radius = task
+    if layer_directory not in WORKER_NEAR_INDEX:
+        near_oids = np.load(os.path.join(layer_directory, "oids.npy"), mmap_mode="r")
+        near_xy = np.load(os.path.join(layer_directory, "xy.npy"), mmap_mode="r")
+        tree_path = os.path.join(layer_directory, "tree.pickle")
+        if os.path.exists(tree_path):
+            with open(tree_path, "rb") as tree_file:
+                near_tree = pickle.load(tree_file)
+        else:
+            near_tree = cKDTree(near_xy) if len(near_xy) else None
+        WORKER_NEAR_INDEX.clear()  # Tasks are ordered by layer, so only the current layer's index is kept
+        WORKER_NEAR_INDEX[layer_directory] = (near_tree, near_oids, near_xy)
+    near_tree, near_oids, near_xy = WORKER_NEAR_INDEX[layer_directory]
+    batch_xy = np.load(in_xy_path, mmap_mode="r")[start:stop]
+    batch_results = near_kdtree_query(near_tree, near_oids, near_xy, batch_xy, search_radius)
+    for key, values in batch_results.items():
+        result_array = np.load(os.path.join(layer_directory, key + ".npy"), mmap_mode="r+")
+        result_array[start:stop] = values
+        result_array.flush()
+        del result_array
+    return stop - start
+
+
+def parallel_chained_near_arrays(in_xy, near_layers, search_radius=None, workers=0, batch_size=250000,
+                                 near_trees=None):
+    """Parallel version of chained_near_arrays. The work is split into one task per near layer and chunk of input
+    points and fanned out over a process pool. Input coordinates, near layers, and results are exchanged through
+    memory mapped .npy files in a temporary directory, so memory is bounded by the chunks being queried plus one
+    KD-tree per worker, and the merged results are returned once every task is done.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - workers - number of worker processes, 0 or less uses every cpu
+    :param - batch_size - maximum number of input points in a task
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name, pickled for the workers
+    :returns - dictionary keyed by layer name of the result dictionaries returned by near_kdtree_query"""
+    near_trees = near_trees or {}
+    workers = near_worker_count(workers)
+    point_count = len(in_xy)
+    chunk_size = max(1, min(batch_size, int(np.ceil(point_count / float(workers)))))
+    temp_directory = tempfile.mkdtemp(prefix="chained_near_")
+    try:
+        in_xy_path = os.path.join(temp_directory, "in_xy.npy")
+        np.save(in_xy_path, np.ascontiguousarray(in_xy, dtype=np.float64))
+        tasks = []
+        layer_directories = []
+        for layer_index, (layer_name, near_oids, near_xy) in enumerate(near_layers):
+            layer_directory = os.path.join(temp_directory, "layer_{0}".format(layer_index))
+            os.mkdir(layer_directory)
+            np.save(os.path.join(layer_directory, "oids.npy"), np.asarray(near_oids, dtype=np.int64))
+            np.save(os.path.join(layer_directory, "xy.npy"), np.asarray(near_xy, dtype=np.float64).reshape(-1, 2))
+            if near_trees.get(layer_name) is not None:
+                with open(os.path.join(layer_directory, "tree.pickle"), "wb") as tree_file:
+                    pickle.dump(near_trees[layer_name], tree_file, pickle.HIGHEST_PROTOCOL)
+            for key, dtype, no_match_value in NEAR_RESULT_DTYPES:
+                result_array = np.lib.format.open_memmap(os.path.join(layer_directory, key + ".npy"), mode="w+",
+                                                         dtype=dtype, shape=(point_count,))
+                result_array[:] = no_match_value
+                result_array.flush()
+                del result_array
+            layer_directories.append((layer_name, layer_directory))
+            tasks.extend((in_xy_path, layer_directory, start, min(start + chunk_size, point_count), search_radius)
+                         for start in range(0, point_count, chunk_size))
+        arc_print("Querying {0} near tasks with {1} worker processes...".format(len(tasks), workers))
+        pool = process_pool(workers)
+        try:
+            for _ in pool.imap_unordered(kdtree_near_worker, tasks):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        layer_results = {}
+        for layer_name, layer_directory in layer_directories:
+            layer_results[layer_name] = dict((key, np.array(np.load(os.path.join(layer_directory, key + ".npy"))))
+                                             for key, dtype, no_match_value in NEAR_RESULT_DTYPES)
+        return layer_results
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+def near_kdtree_query_k(near_tree, near_oids, near_xy, in_xy, k=1, search_radius=None):
+    """Queries a KD-tree of near features for the k nearest features of every input point. Ranks without a near
+    feature within the search radius receive the no match values of near_kdtree_query.
+    :param - near_tree - scipy.spatial.cKDTree built on near_xy, or None if there are no near features
+    :param - near_oids - object ids of the near features
+    :param - near_xy - n x 2 coordinates of the near features
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - k - number of nearest features
+    :param - search_radius - search radius in dataset units, None searches all features
+    :returns - dictionary of m x k numpy arrays keyed by "DIST", "X", "Y", "ANGLE", "FID", ordered by distance"""
+    point_count = len(in_xy)
+    results = dict((key, np.full((point_count, k), no_match, dtype=dtype)) for key, dtype, no_match in
+                   NEAR_RESULT_DTYPES)
+    if near_tree is None or point_count == 0:
+        return results
+    upper_bound = np.inf if search_radius is None else np.nextafter(search_radius, np.inf)  # Radius is inclusive
+    distances, indices = near_tree.query(in_xy, k=k, distance_upper_bound=upper_bound)
+    distances, indices = distances.reshape(point_count, k), indices.reshape(point_count, k)
+    found = np.isfinite(distances)
+    rows = np.nonzero(found)[0]
+    near_index = indices[found]
+    delta = near_xy[near_index] - in_xy[rows]
+    results["DIST"][found] = distances[found]
+    results["X"][found] = near_xy[near_index, 0]
+    results["Y"][found] = near_xy[near_index, 1]
+    results["ANGLE"][found] = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+    results["FID"][found] = near_oids[near_index]
+    return results
+
+
+def chained_near_arrays_k(in_xy, near_layers, k=1, search_radius=None, batch_size=250000, near_trees=None):
+    """Queries every near layer for the k nearest features of the input points, in batches of input points.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - k - number of nearest features
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - batch_size - number of input points queried at a time
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name
+    :returns - dictionary keyed by (layer name, rank) of near result dictionaries, ranks starting at 1"""
+    near_trees = near_trees or {}
+    layer_results = {}
+    for layer_name, near_oids, near_xy in near_layers:
+        near_tree = near_trees[layer_name] if layer_name in near_trees else cKDTree(near_xy) if len(near_xy) else None
+        ranked_results = near_kdtree_query_k(None, near_oids, near_xy, np.empty((len(in_xy), 2)), k)
+        for start in range(0, len(in_xy), batch_size):
+            batch_results = near_kdtree_query_k(near_tree, near_oids, near_xy, in_xy[start:start + batch_size], k,
+                                                search_radius)
+            for key, values in batch_results.items():
+                ranked_results[key][start:start + batch_size] = values
+        for rank in range(k):
+            layer_results[(layer_name, rank + 1)] = dict((key, values[:, rank]) for key, values in
+                                                         ranked_results.items())
+    return layer_results
+
+
+def near_table_chunk(in_oids, layer_name, ranks, near_oids, distances, near_xy=None, angles=None):
+    """Builds a chunk of a long format near table as an ordered dictionary of columns. The X, Y, and angle columns
+    are only included when their values are given."""
+    chunk = OrderedDict([("IN_FID", np.asarray(in_oids, dtype=np.int64)),
+                         ("NEAR_LAYER", np.full(len(in_oids), str(layer_name), dtype=object)),
+                         ("NEAR_RANK", np.asarray(ranks, dtype=np.int32)),
+                         ("NEAR_FID", np.asarray(near_oids, dtype=np.int64)),
+                         ("NEAR_DIST", np.asarray(distances, dtype=np.float64))])
+    if near_xy is not None:
+        chunk["NEAR_X"] = np.asarray(near_xy[:, 0], dtype=np.float64)
+        chunk["NEAR_Y"] = np.asarray(near_xy[:, 1], dtype=np.float64)
+    if angles is not None:
+        chunk["NEAR_ANGLE"] = np.asarray(angles, dtype=np.float64)
+    return chunk
+
+
+def radius_pair_chunks(near_tree, in_xy, search_radius, max_pairs=1000000, start=0, stop=None):
+    """Finds every (input point, near feature) pair within the search radius with batched KD-tree ball queries.
+    Pairs are counted first, so the input points are split into chunks of at most about max_pairs pairs and memory
+    stays bounded however dense the near features are.
+    :param - near_tree - scipy.spatial.cKDTree of the near features
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - search_radius - search radius in dataset units
+    :param - max_pairs - maximum number of pairs in a chunk, a chunk always holds at least one input point
+    :param - start - first input point queried
+    :param - stop - input point the queries stop at, None queries every input point
+    :returns - generator of (input row array, near feature index array, pair count per input point of the chunk)
+    tuples, where the pairs are grouped by input row"""
+    stop = len(in_xy) if stop is None else stop
+    pair_counts = near_tree.query_ball_point(in_xy[start:stop], search_radius, return_length=True)
+    pair_ends = np.cumsum(pair_counts)
+    chunk_starts = [0]
+    while chunk_starts[-1] < len(pair_counts):
+        chunk_pairs = pair_ends[chunk_starts[-1] - 1] if chunk_starts[-1] else 0
+        chunk_starts.append(max(int(np.searchsorted(pair_ends, chunk_pairs + max_pairs, "right")),
+                                chunk_starts[-1] + 1))
+    for chunk_start, chunk_end in zip(chunk_starts[:-1], chunk_starts[1:]):
+        counts = pair_counts[chunk_start:chunk_end]
+        rows = np.repeat(np.arange(start + chunk_start, start + chunk_end), counts)
+        near_index = np.concatenate([np.asarray(neighbors, dtype=np.int64) for neighbors in
+                                     near_tree.query_ball_point(in_xy[start + chunk_start:start + chunk_end],
+                                                                search_radius)] + [np.empty(0, dtype=np.int64)])
+        yield rows, near_index, counts
+
+
+def near_table_chunks(in_oids, in_xy, near_layers, k=1, search_radius=None, radius_all=False, location=False,
+                      angle=False, near_trees=None, max_pairs=1000000):
+    """Queries every near layer for the k nearest features, or for all features within the search radius, of the
+    input points and yields the (input, near feature) pairs as long format near table chunks of at most about
+    max_pairs rows, ordered by input point and rank. Memory stays bounded by max_pairs whatever k or the density of
+    the near features is.
+    :param - in_oids - object ids of the input points
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - k - number of nearest features, ignored with radius_all
+    :param - search_radius - search radius in dataset units, required with radius_all
+    :param - radius_all - return every near feature within the search radius instead of the k nearest
+    :param - location - include the NEAR_X and NEAR_Y columns
+    :param - angle - include the NEAR_ANGLE column
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name
+    :param - max_pairs - maximum number of pairs queried at a time
+    :returns - generator of ordered dictionaries of columns (IN_FID, NEAR_LAYER, NEAR_RANK, NEAR_FID, NEAR_DIST,
+    NEAR_X, NEAR_Y, NEAR_ANGLE)"""
+    if radius_all and search_radius is None:
+        raise ValueError("Finding all near features within the search radius requires a search radius.")
+    near_trees = near_trees or {}
+    in_oids = np.asarray(in_oids)
+    for layer_name, near_oids, near_xy in near_layers:
+        near_tree = near_trees[layer_name] if layer_name in near_trees else cKDTree(near_xy) if len(near_xy) else None
+        if near_tree is None or not len(in_xy):
+            continue
+        if radius_all:
+            for rows, near_index, counts in radius_pair_chunks(near_tree, in_xy, search_radius, max_pairs):
+                delta = near_xy[near_index] - in_xy[rows]
+                distances = np.hypot(delta[:, 0], delta[:, 1])
+                order = np.lexsort((distances, rows))
+                rows, near_index, delta, distances = rows[order], near_index[order], delta[order], distances[order]
+                ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+                yield near_table_chunk(in_oids[rows], layer_name, ranks, near_oids[near_index], distances,
+                                       near_xy[near_index] if location else None,
+                                       np.degrees(np.arctan2(delta[:, 1], delta[:, 0])) if angle else None)
+        else:
+            batch_size = max(1, int(max_pairs // k))
+            for start in range(0, len(in_xy), batch_size):
+                results = near_kdtree_query_k(near_tree, near_oids, near_xy, in_xy[start:start + batch_size], k,
+                                              search_radius)
+                found = results["FID"] != NEAR_NO_MATCH
+                rows, ranks = np.nonzero(found)
+                yield near_table_chunk(in_oids[start + rows], layer_name, ranks + 1, results["FID"][found],
+                                       results["DIST"][found],
+                                       np.column_stack([results["X"][found], results["Y"][found]]) if location
+                                       else None, results["ANGLE"][found] if angle else None)
+
+
+def write_near_table(near_table, chunks, backend=None):
+    """Writes long format near table chunks to a table as they are produced, replacing the table. GeoParquet/Parquet
+    files are written a row group per chunk, CSV files are appended to, GeoPackage tables and other OGR formats are
+    appended to with pyogrio, and ArcGIS tables are appended to through an in memory table per chunk.
+    :param - near_table - output table path, such as near.parquet, near.csv, data.gpkg/near_table, or a
+    geodatabase table
+    :param - chunks - iterable of ordered dictionaries of columns, see near_table_chunks
+    :param - backend - I/O backend, ArcGIS tables are written with the ARCPY backend
+    :returns - number of rows written"""
+    near_table = str(near_table)
+    backend = get_backend(near_table, backend)
+    path, layer = split_dataset_path(near_table)
+    extension = os.path.splitext(path)[1].lower()
+    output_format = dataset_format(near_table)
+    if backend.name == "ARCPY" and output_format not in ["Parquet", "GPKG"] and extension != ".csv":
+        output_format = None  # Geodatabase and other ArcGIS tables
+    elif output_format is None and extension != ".csv":
+        raise ValueError("Can not write near table {0}, use a Parquet, CSV, or GeoPackage table.".format(near_table))
+    rows_written = 0
+    parquet_writer = None
+    chunks = iter(chunks)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:  # No near features, write an empty table
+        first_chunk = near_table_chunk([], "", [], [], [])
+    for chunk_number, chunk in enumerate(itertools.chain([first_chunk], chunks)):
+        if output_format == "Parquet":
+            table = pyarrow.Table.from_arrays([pyarrow.array(values) for values in chunk.values()],
+                                              names=list(chunk.keys()))
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(path, table.schema)
+            parquet_writer.write_table(table)
+        elif extension == ".csv":
+            pd.DataFrame(chunk).to_csv(path, mode="a" if chunk_number else "w", header=not chunk_number, index=False)
+        elif output_format is not None:
+            pyogrio.raw.write(path, None, list(chunk.values()), list(chunk.keys()), layer=layer,
+                              driver=output_format, append=chunk_number > 0)
+        else:
+            array = np.empty(len(chunk["IN_FID"]), dtype=[(field, values.dtype if values.dtype != object else "U256")
+                                                          for field, values in chunk.items()])
+            for field, values in chunk.items():
+                array[field] = values
+            if chunk_number == 0:
+                if arcpy.Exists(near_table):
+                    arcpy.Delete_management(near_table)
+                arcpy.da.NumPyArrayToTable(array, near_table)
+            else:
+                chunk_table = arcpy.CreateUniqueName("near_table_chunk", "in_memory")
+                arcpy.da.NumPyArrayToTable(array, chunk_table)
+                arcpy.Append_management(chunk_table, near_table, "NO_TEST")
+                arcpy.Delete_management(chunk_table)
+        rows_written += len(chunk["IN_FID"])
+    if parquet_writer is not None:
+        parquet_writer.close()
+    return rows_written
+
+
+def accessibility_weights(distances, metric, search_radius, distance_decay=1.0, bandwidth=None, minimum_distance=1.0):
+    """Returns the weight of every (input point, near feature) pair of an accessibility metric. COUNT and SUM weigh
+    every pair within the search radius by 1, GRAVITY by 1 / distance ^ distance_decay with distances below
+    minimum_distance raised to it, GAUSSIAN by exp(-0.5 * (distance / bandwidth) ^ 2), and EPANECHNIKOV by
+    1 - (distance / bandwidth) ^ 2 within the bandwidth. The kernels are 1 at distance 0.
+    :param - distances - pair distances in dataset units
+    :param - metric - one of ACCESSIBILITY_METRICS
+    :param - search_radius - search radius in dataset units, the default bandwidth of the kernels
+    :param - distance_decay - exponent of the GRAVITY metric
+    :param - bandwidth - bandwidth of the kernels in dataset units, None uses the search radius
+    :param - minimum_distance - smallest distance of the GRAVITY metric, so coincident features stay finite
+    :returns - numpy array of pair weights"""
+    metric = str(metric).upper()
+    bandwidth = search_radius if bandwidth is None else bandwidth
+    if metric in ["COUNT", "SUM"]:
+        return np.ones(len(distances))
+    if metric == "GRAVITY":
+        return np.maximum(distances, minimum_distance) ** -float(distance_decay)
+    if metric == "GAUSSIAN":
+        return np.exp(-0.5 * (distances / float(bandwidth)) ** 2)
+    if metric == "EPANECHNIKOV":
+        return np.maximum(1.0 - (distances / float(bandwidth)) ** 2, 0.0)
+    raise ValueError("Unknown accessibility metric {0}, use one of {1}.".format(metric,
+                                                                               ", ".join(ACCESSIBILITY_METRICS)))
+
+
+def accessibility_query(near_tree, near_xy, near_values, in_xy, search_radius, metrics, distance_decay=1.0,
+                        bandwidth=None, minimum_distance=1.0, max_pairs=1000000, start=0, stop=None):
+    """Computes accessibility metrics of input points against one near layer with batched KD-tree ball queries. The
+    pair weights of every metric are summed per input point, multiplied by the near feature values for every metric
+    but COUNT when values are given.
+    :param - near_tree - scipy.spatial.cKDTree of the near features, or None if there are no near features
+    :param - near_xy - n x 2 coordinates of the near features
+    :param - near_values - n attribute values of the near features (such as square footage or jobs), or None
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - search_radius - search radius in dataset units
+    :param - metrics - list of ACCESSIBILITY_METRICS
+    :param - distance_decay - exponent of the GRAVITY metric, see accessibility_weights
+    :param - bandwidth - bandwidth of the kernels in dataset units, None uses the search radius
+    :param - minimum_distance - smallest distance of the GRAVITY metric
+    :param - max_pairs - maximum number of pairs held at a time, see radius_pair_chunks
+    :param - start - first input point queried
+    :param - stop - input point the queries stop at, None queries every input point
+    :returns - dictionary of float64 arrays of length stop - start keyed by metric"""
+    stop = len(in_xy) if stop is None else stop
+    results = dict((metric, np.zeros(stop - start)) for metric in metrics)
+    if near_tree is None:
+        return results
+    for rows, near_index, counts in radius_pair_chunks(near_tree, in_xy, search_radius, max_pairs, start, stop):
+        delta = near_xy[near_index] - in_xy[rows]
+        distances = np.hypot(delta[:, 0], delta[:, 1])
+        for metric in metrics:
+            weights = accessibility_weights(distances, metric, search_radius, distance_decay, bandwidth,
+                                            minimum_distance)
+            if near_values is not None and metric != "COUNT":
+                weights = weights * near_values[near_index]
+            results[metric] += np.bincount(rows - start, weights, stop - start)
+    return results
+
+
+def accessibility_worker(task):
+    """Pool worker of accessibility_arrays. Computes the metrics of one chunk of input points against one near
+    layer and writes them into the memory mapped result files of the layer.
+    :param - task - tuple of (input coordinate file, layer directory, chunk start, chunk stop, accessibility_query
+    keyword dictionary)
+    :returns - number of input points queried"""
+    in_xy_path, layer_directory, start, stop, query_parameters = task
+    if layer_directory not in WORKER_NEAR_INDEX:
+        near_xy = np.load(os.path.join(layer_directory, "xy.npy"), mmap_mode="r")
+        values_path = os.path.join(layer_directory, "values.npy")
+        near_values = np.load(values_path, mmap_mode="r") if os.path.exists(values_path) else None
+        with open(os.path.join(layer_directory, "tree.pickle"), "rb") as tree_file:
+            near_tree = pickle.load(tree_file)
+        WORKER_NEAR_INDEX.clear()
+        WORKER_NEAR_INDEX[layer_directory] = (near_tree, near_xy, near_values)
+    near_tree, near_xy, near_values = WORKER_NEAR_INDEX[layer_directory]
+    in_xy = np.load(in_xy_path, mmap_mode="r")
+    batch_results = accessibility_query(near_tree, near_xy, near_values, in_xy, start=start, stop=stop,
+                                        **query_parameters)
+    for metric, values in batch_results.items():
+        result_array = np.load(os.path.join(layer_directory, metric + ".npy"), mmap_mode="r+")
+        result_array[start:stop] = values
+        result_array.flush()
+        del result_array
+    return stop - start
+
+
+def accessibility_arrays(in_xy, near_layers, search_radius, metrics=("COUNT",), near_values=None,
+                         distance_decay=1.0, bandwidth=None, minimum_distance=1.0, workers=1, batch_size=250000,
+                         max_pairs=1000000, near_trees=None):
+    """Computes accessibility metrics (counts, attribute sums, gravity and kernel weighted sums within the search
+    radius) of the input points against every near layer. With more than one worker the work is split into one task
+    per near layer and chunk of input points and fanned out over a process pool, exchanging arrays through memory
+    mapped .npy files like parallel_chained_near_arrays.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - search_radius - search radius in dataset units
+    :param - metrics - list of ACCESSIBILITY_METRICS
+    :param - near_values - optional dictionary of near feature value arrays keyed by layer name
+    :param - distance_decay - exponent of the GRAVITY metric, see accessibility_weights
+    :param - bandwidth - bandwidth of the kernels in dataset units, None uses the search radius
+    :param - minimum_distance - smallest distance of the GRAVITY metric
+    :param - workers - number of worker processes, None or 1 runs in process, 0 or less uses every cpu
+    :param - batch_size - maximum number of input points in a task
+    :param - max_pairs - maximum number of pairs a task holds at a time
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name
+    :returns - dictionary keyed by layer name of dictionaries of float64 arrays keyed by metric"""
+    if search_radius is None:
+        raise ValueError("Accessibility metrics require a search radius.")
+    metrics = [str(metric).upper() for metric in metrics]
+    for metric in metrics:
+        accessibility_weights(np.empty(0), metric, search_radius)  # Validates the metric names
+    near_values = near_values or {}
+    near_trees = near_trees or {}
+    query_parameters = dict(search_radius=search_radius, metrics=metrics, distance_decay=distance_decay,
+                            bandwidth=bandwidth, minimum_distance=minimum_distance, max_pairs=max_pairs)
+    workers = near_worker_count(workers)
+    point_count = len(in_xy)
+    layer_results = {}
+    if workers == 1:
+        for layer_name, near_oids, near_xy in near_layers:
+            near_tree = near_trees[layer_name] if layer_name in near_trees else \
+                cKDTree(near_xy) if len(near_xy) else None
+            layer_results[layer_name] = accessibility_query(near_tree, near_xy, near_values.get(layer_name), in_xy,
+                                                            **query_parameters)
+        return layer_results
+    chunk_size = max(1, min(batch_size, int(np.ceil(point_count / float(workers)))))
+    temp_directory = tempfile.mkdtemp(prefix="accessibility_")
+    try:
+        in_xy_path = os.path.join(temp_directory, "in_xy.npy")
+        np.save(in_xy_path, np.ascontiguousarray(in_xy, dtype=np.float64))
+        tasks = []
+        layer_directories = []
+        for layer_index, (layer_name, near_oids, near_xy) in enumerate(near_layers):
+            layer_directory = os.path.join(temp_directory, "layer_{0}".format(layer_index))
+            os.mkdir(layer_directory)
+            for metric in metrics:
+                np.save(os.path.join(layer_directory, metric + ".npy"), np.zeros(point_count))
+            layer_directories.append((layer_name, layer_directory))
+            if not len(near_xy):
+                continue
+            np.save(os.path.join(layer_directory, "xy.npy"), np.asarray(near_xy, dtype=np.float64).reshape(-1, 2))
+            if near_values.get(layer_name) is not None:
+                np.save(os.path.join(layer_directory, "values.npy"),
+                        np.asarray(near_values[layer_name], dtype=np.float64))
+            with open(os.path.join(layer_directory, "tree.pickle"), "wb") as tree_file:
+                pickle.dump(near_trees[layer_name] if layer_name in near_trees else cKDTree(near_xy), tree_file,
+                            pickle.HIGHEST_PROTOCOL)
+            tasks.extend((in_xy_path, layer_directory, start, min(start + chunk_size, point_count), query_parameters)
+                         for start in range(0, point_count, chunk_size))
+        arc_print("Querying {0} accessibility tasks with {1} worker processes...".format(len(tasks), workers))
+        pool = process_pool(workers)
+        try:
+            for _ in pool.imap_unordered(accessibility_worker, tasks):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+        for layer_name, layer_directory in layer_directories:
+            layer_results[layer_name] = dict((metric, np.load(os.path.join(layer_directory, metric + ".npy")))
+                                             for metric in metrics)
+        return layer_results
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+def lonlat_to_unit_vectors(lonlat):
+    """Converts longitude/latitude degrees to 3D unit vectors (ECEF coordinates on the unit sphere), whose chord
+    distances increase with the central angle between points, so a KD-tree on them finds spherical neighbors.
+    :param - lonlat - n x 2 array of longitude and latitude degrees
+    :returns - n x 3 array of unit vectors"""
+    lon, lat = np.radians(lonlat[:, 0]), np.radians(lonlat[:, 1])
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]).reshape(-1, 3)
+
+
+def central_angle_chord(central_angle):
+    """Returns the unit sphere chord length of a central angle in radians, capped at half a great circle.
+    :param - central_angle - float or numpy array of angles in radians
+    :returns - float or numpy array"""
+    return 2 * np.sin(np.minimum(central_angle, np.pi) / 2)
+
+
+def vincenty_inverse(lon1, lat1, lon2, lat2, ellipsoid=WGS84_ELLIPSOID, max_iterations=200, tolerance=1e-12):
+    """Vectorized solution of the inverse geodesic problem on an ellipsoid with Vincenty's formulae. Nearly antipodal
+    pairs where the iteration does not converge fall back to the great circle on a sphere of the ellipsoid's mean
+    radius, which never happens for pairs closer than a few thousand kilometers.
+    :param - lon1, lat1 - numpy arrays of the longitudes and latitudes in degrees of the first points
+    :param - lon2, lat2 - numpy arrays of the longitudes and latitudes in degrees of the second points
+    :param - ellipsoid - (semi-major axis in meters, flattening) tuple
+    :param - max_iterations - maximum number of iterations of the longitude on the auxiliary sphere
+    :param - tolerance - convergence tolerance of the longitude on the auxiliary sphere in radians
+    :returns - tuple of (distance in meters, forward azimuth at the first point in degrees, -180 to 180 with 0 north)"""
+    semi_major, flattening = ellipsoid
+    semi_minor = semi_major * (1 - flattening)
+    lon1, lat1, lon2, lat2 = [np.radians(np.asarray(values, dtype=np.float64)) for values in [lon1, lat1, lon2, lat2]]
+    longitude_difference = (lon2 - lon1 + np.pi) % (2 * np.pi) - np.pi
+    reduced_lat1 = np.arctan((1 - flattening) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - flattening) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_u2, cos_u2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+    auxiliary_longitude = longitude_difference.copy()
+    converged = np.zeros(longitude_difference.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for iteration in range(max_iterations):
+            sin_lambda, cos_lambda = np.sin(auxiliary_longitude), np.cos(auxiliary_longitude)
+            sin_sigma = np.hypot(cos_u2 * sin_lambda, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma > 0, cos_u1 * cos_u2 * sin_lambda / sin_sigma, 0.0)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos_sq_alpha > 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha, 0.0)
+            c = flattening / 16 * cos_sq_alpha * (4 + flattening * (4 - 3 * cos_sq_alpha))
+            next_longitude = longitude_difference + (1 - c) * flattening * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(next_longitude - auxiliary_longitude) <= tolerance
+            auxiliary_longitude = np.where(converged, auxiliary_longitude, next_longitude)
+            if converged.all():
+                break
+        sin_lambda, cos_lambda = np.sin(auxiliary_longitude), np.cos(auxiliary_longitude)
+        sin_sigma = np.hypot(cos_u2 * sin_lambda, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.where(sin_sigma > 0, cos_u1 * cos_u2 * sin_lambda / sin_sigma, 0.0)
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = np.where(cos_sq_alpha > 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha, 0.0)
+        u_sq = cos_sq_alpha * (semi_major ** 2 - semi_minor ** 2) / semi_minor ** 2
+        a_coefficient = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        b_coefficient = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = b_coefficient * sin_sigma * (cos_2sigma_m + b_coefficient / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - b_coefficient / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+            (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = semi_minor * a_coefficient * (sigma - delta_sigma)
+        azimuth = np.degrees(np.arctan2(cos_u2 * sin_lambda, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda))
+    if not converged.all():
+        mean_radius = semi_major * (1 - flattening / 3)
+        sphere_sigma = np.arctan2(np.hypot(np.cos(lat2) * np.sin(longitude_difference),
+                                           np.cos(lat1) * np.sin(lat2) -
+                                           np.sin(lat1) * np.cos(lat2) * np.cos(longitude_difference)),
+                                  np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) *
+                                  np.cos(longitude_difference))
+        sphere_azimuth = np.degrees(np.arctan2(np.cos(lat2) * np.sin(longitude_difference),
+                                               np.cos(lat1) * np.sin(lat2) -
+                                               np.sin(lat1) * np.cos(lat2) * np.cos(longitude_difference)))
+        distance = np.where(converged, distance, mean_radius * sphere_sigma)
+        azimuth = np.where(converged, azimuth, sphere_azimuth)
+    same_point = (longitude_difference == 0) & (lat1 == lat2)
+    return np.where(same_point, 0.0, distance), np.where(same_point, 0.0, azimuth)
+
+
+def geodesic_near_query(near_tree, near_oids, near_xy, near_lonlat, in_lonlat, search_radius=None,
+                        ellipsoid=WGS84_ELLIPSOID, candidates=8):
+    """Queries a KD-tree of near features on the unit sphere with an array of input points and returns the values
+    Near_analysis (GEODESIC) would compute for each point. Candidates found by chord distance are refined with
+    ellipsoidal distances. Along any path the ellipsoid is between the meridian radius of curvature at the equator
+    and the polar radius of curvature times the central angle of the sphere through the geodetic coordinates, so
+    candidates are added until no feature outside them can be closer than the nearest one found.
+    :param - near_tree - scipy.spatial.cKDTree built on the unit vectors of near_lonlat, or None if there are none
+    :param - near_oids - object ids of the near features
+    :param - near_xy - n x 2 coordinates of the near features in the units of the input features
+    :param - near_lonlat - n x 2 longitude/latitude degrees of the near features
+    :param - in_lonlat - m x 2 longitude/latitude degrees of the input points
+    :param - search_radius - search radius in meters, None searches all features
+    :param - ellipsoid - (semi-major axis in meters, flattening) tuple
+    :param - candidates - number of candidates first refined for every point
+    :returns - dictionary of numpy arrays keyed by "DIST" (meters), "X", "Y", "ANGLE", "FID" """
+    point_count = len(in_lonlat)
+    results = near_kdtree_query(None, near_oids, near_xy, np.empty((point_count, 2)))
+    if near_tree is None or point_count == 0:
+        return results
+    semi_major, flattening = ellipsoid
+    eccentricity_sq = flattening * (2 - flattening)
+    smallest_radius = semi_major * (1 - eccentricity_sq)
+    in_vectors = lonlat_to_unit_vectors(in_lonlat)
+    near_count = len(near_oids)
+    pending = np.arange(point_count)
+    candidate_count = min(candidates, near_count)
+    while len(pending):
+        upper_bound = np.inf if search_radius is None else np.nextafter(
+            central_angle_chord(search_radius / smallest_radius), np.inf)
+        chords, indices = near_tree.query(in_vectors[pending], k=candidate_count, distance_upper_bound=upper_bound)
+        chords, indices = chords.reshape(len(pending), -1), indices.reshape(len(pending), -1)
+        found = np.isfinite(chords)
+        point_index = np.repeat(pending, candidate_count).reshape(len(pending), -1)[found]
+        distances = np.full(chords.shape, np.inf)
+        azimuths = np.zeros(chords.shape)
+        distances[found], azimuths[found] = vincenty_inverse(in_lonlat[point_index, 0], in_lonlat[point_index, 1],
+                                                             near_lonlat[indices[found], 0],
+                                                             near_lonlat[indices[found], 1], ellipsoid)
+        if search_radius is not None:
+            distances[distances > search_radius] = np.inf
+        best = np.argmin(distances, axis=1)
+        rows = np.arange(len(pending))
+        best_distances = distances[rows, best]
+        # A feature closer than the best candidate is within this chord, so the candidates must reach past it
+        bound_chords = central_angle_chord(best_distances / smallest_radius) * (1 + 1e-9)
+        if search_radius is not None:
+            bound_chords = np.minimum(bound_chords, central_angle_chord(search_radius / smallest_radius))
+        complete = (candidate_count >= near_count) | ~found[:, -1] | (chords[:, -1] > bound_chords)
+        matched = complete & np.isfinite(best_distances)
+        matched_points = pending[matched]
+        near_index = indices[rows, best][matched]
+        results["DIST"][matched_points] = best_distances[matched]
+        results["X"][matched_points] = near_xy[near_index, 0]
+        results["Y"][matched_points] = near_xy[near_index, 1]
+        results["ANGLE"][matched_points] = azimuths[rows, best][matched]
+        results["FID"][matched_points] = near_oids[near_index]
+        pending = pending[~complete]
+        candidate_count = min(candidate_count * 4, near_count)
+    return results
+
+
+def geodesic_chained_near_arrays(in_lonlat, near_layers, search_radius=None, ellipsoid=WGS84_ELLIPSOID,
+                                 batch_size=250000, near_trees=None):
+    """GEODESIC version of chained_near_arrays. A KD-tree of unit vectors is built once for every near layer and all
+    input points are queried against every index in batches, see geodesic_near_query.
+    :param - in_lonlat - m x 2 longitude/latitude degrees of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array in the units of the
+    input features, near n x 2 longitude/latitude array) tuples
+    :param - search_radius - search radius in meters, None searches all features
+    :param - ellipsoid - (semi-major axis in meters, flattening) tuple
+    :param - batch_size - number of input points queried against the indexes at a time
+    :param - near_trees - optional dictionary of prebuilt unit vector KD-trees keyed by layer name
+    :returns - dictionary keyed by layer name of the result dictionaries returned by geodesic_near_query"""
+    near_trees = near_trees or {}
+    point_count = len(in_lonlat)
+    layer_results = {}
+    for layer_name, near_oids, near_xy, near_lonlat in near_layers:
+        near_tree = near_trees[layer_name] if layer_name in near_trees else \
+            cKDTree(lonlat_to_unit_vectors(near_lonlat)) if len(near_lonlat) else None
+        layer_results[layer_name] = near_kdtree_query(None, near_oids, near_xy, np.empty((point_count, 2)))
+        for start in range(0, point_count, batch_size):
+            batch_results = geodesic_near_query(near_tree, near_oids, near_xy, near_lonlat,
+                                                in_lonlat[start:start + batch_size], search_radius, ellipsoid)
+            for key, values in batch_results.items():
+                layer_results[layer_name][key][start:start + batch_size] = values
+    return layer_results
+
+
+def engine_options(options, defaults, options_name):
+    """Merges a dictionary of engine specific options with their defaults, so a tool can group the options of one
+    engine in a single parameter.
+    :param - options - dictionary of option values, or None
+    :param - defaults - ordered dictionary of the option names and their default values
+    :param - options_name - name of the tool parameter, reported for unknown options
+    :returns - OrderedDict of option values"""
+    options = dict(options or {})
+    unknown_options = sorted(set(options) - set(defaults))
+    if unknown_options:
+        raise ValueError("Unknown {0} {1}. The options are {2}.".format(options_name, ", ".join(unknown_options),
+                                                                      ", ".join(defaults)))
+    return OrderedDict((name, options.get(name, default)) for name, default in defaults.items())
+
+
+def warn_geodesic_options(tile_features=None, workers=1, incremental_state=None):
+    """Warns about chained near options the GEODESIC KD-tree engine ignores. It runs in memory in a single process,
+    so out of core tiles, a process pool, and incremental runs are PLANAR only.
+    :returns - list of the ignored option names"""
+    ignored_options = [option for option, requested in [("tile_features", tile_features),
+                                                        ("workers", near_worker_count(workers) > 1),
+                                                        ("incremental_state", incremental_state)] if requested]
+    if ignored_options:
+        arc_warning("The GEODESIC method runs in memory in a single process and ignores {0}.".format(
+            ", ".join(ignored_options)))
+    return ignored_options
+
+
+def linear_unit_to_meters(search_radius, spatial_reference=None):
+    """Converts a search radius passed to a near tool into meters for the GEODESIC method. A unitless number is
+    assumed to be in the linear unit of a projected input, and in meters for a geographic input.
+    :param - search_radius - None, a number, or a linear unit such as "1000 Meters" or an arcpy LinearUnit
+    :param - spatial_reference - spatial reference of the input features
+    :returns - float radius in meters or None if there is no search radius"""
+    if search_radius is None:
+        return None
+    radius_parts = str(search_radius).strip().split()
+    if not radius_parts or radius_parts[0] in ["#", "None"]:
+        return None
+    radius = float(radius_parts[0])
+    unit_name = "".join(radius_parts[1:]).upper().replace("_", "")
+    if unit_name in LINEAR_UNIT_METERS:
+        return radius * LINEAR_UNIT_METERS[unit_name]
+    meters_per_dataset_unit = getattr(spatial_reference, "metersPerUnit", None)
+    if str(getattr(spatial_reference, "type", "")) == "Projected" and meters_per_dataset_unit:
+        return radius * float(meters_per_dataset_unit)
+    return radius
+
+
+def meters_to_dataset_units(layer_results, spatial_reference=None):
+    """Converts the GEODESIC distances of near results from meters into the linear unit of a projected input, the
+    unit Near_analysis reports them in. Distances of geographic inputs stay in meters.
+    :param - layer_results - dictionary of near result dictionaries keyed by layer name, updated in place
+    :param - spatial_reference - spatial reference of the input features
+    :returns - layer_results"""
+    meters_per_dataset_unit = getattr(spatial_reference, "metersPerUnit", None)
+    if str(getattr(spatial_reference, "type", "")) != "Projected" or not meters_per_dataset_unit:
+        return layer_results
+    for results in layer_results.values():
+        found = results["DIST"] != NEAR_NO_MATCH
+        results["DIST"][found] = results["DIST"][found] / float(meters_per_dataset_unit)
+    return layer_results
+
+
+def align_lonlat(oids, lonlat_oids, lonlat):
+    """Orders longitude/latitude coordinates read in a second pass like the object ids of the first pass.
+    :param - oids - object ids of the coordinates in the units of the input features
+    :param - lonlat_oids - object ids of the longitude/latitude coordinates
+    :param - lonlat - n x 2 longitude/latitude coordinates
+    :returns - len(oids) x 2 longitude/latitude coordinates"""
+    if len(oids) == len(lonlat_oids) and np.array_equal(oids, lonlat_oids):
+        return lonlat
+    return lonlat[pd.Index(lonlat_oids).get_indexer(oids)]
+
+
+def strtree_near_query(near_tree, near_oids, near_geometries, in_geometries, search_radius=None):
+    """Queries a shapely STRtree of near features of any geometry type with an array of input geometries and returns
+    the same values Near_analysis (PLANAR) would compute, in one bulk query_nearest call. X and Y are the nearest
+    point on the near feature and the angle is the direction from the nearest point on the input feature to it, both
+    taken from the shortest lines between the matched pairs. Inputs without a near feature within the search radius
+    receive -1 for every value except the angle, which is 0.
+    :param - near_tree - shapely.STRtree built on near_geometries, or None if there are no near features
+    :param - near_oids - object ids of the near features
+    :param - near_geometries - array of shapely geometries of the near features
+    :param - in_geometries - array of shapely geometries of the input features
+    :param - search_radius - search radius in dataset units, None searches all features
+    :returns - dictionary of numpy arrays keyed by "DIST", "X", "Y", "ANGLE", "FID" """
+    results = near_kdtree_query(None, near_oids, None, np.empty((len(in_geometries), 2)))
+    if near_tree is None or len(in_geometries) == 0:
+        return results
+    radius_argument = {} if search_radius is None else {"max_distance": max(search_radius, np.finfo(float).tiny)}
+    (in_index, near_index), distances = near_tree.query_nearest(in_geometries, return_distance=True,
+                                                                all_matches=False, **radius_argument)
+    line_points = shapely.get_coordinates(shapely.shortest_line(in_geometries[in_index],
+                                                                near_geometries[near_index])).reshape(-1, 2, 2)
+    delta = line_points[:, 1] - line_points[:, 0]
+    results["DIST"][in_index] = distances
+    results["X"][in_index] = line_points[:, 1, 0]
+    results["Y"][in_index] = line_points[:, 1, 1]
+    results["ANGLE"][in_index] = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+    results["FID"][in_index] = near_oids[near_index]
+    return results
+
+
+def strtree_chained_near_arrays(in_geometries, near_layers, search_radius=None, batch_size=250000):
+    """Chained near engine for line, polygon, and multipoint features. A shapely STRtree is built once for every
+    near layer and the input geometries are queried against every tree in bulk batches.
+    :param - in_geometries - array of shapely geometries of the input features
+    :param - near_layers - list of (layer name, near object id array, near geometry array) tuples
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - batch_size - number of input geometries queried against the trees at a time
+    :returns - dictionary keyed by layer name of the result dictionaries returned by strtree_near_query"""
+    feature_count = len(in_geometries)
+    layer_results = {}
+    for layer_name, near_oids, near_geometries in near_layers:
+        near_tree = shapely.STRtree(near_geometries) if len(near_geometries) else None
+        layer_results[layer_name] = near_kdtree_query(None, near_oids, None, np.empty((feature_count, 2)))
+        for start in range(0, feature_count, batch_size):
+            batch_results = strtree_near_query(near_tree, near_oids, near_geometries,
+                                               in_geometries[start:start + batch_size], search_radius)
+            for key, values in batch_results.items():
+                layer_results[layer_name][key][start:start + batch_size] = values
+    return layer_results
+
+
+def select_near_engine(in_fc, near_features, method="PLANAR", engine="AUTO", backend=None):
+    """Picks the engine a chained near tool runs with. The in process KD-tree engine reproduces PLANAR and GEODESIC
+    Near results between point datasets, so AUTO uses it for points. For other geometries AUTO uses the STRtree
+    engine only when Near_analysis is unavailable (backends other than ARCPY), and ARCPY runs keep Near_analysis
+    unless the STRtree engine is requested.
+    :param - in_fc - input features of the near tool
+    :param - near_features - list of near feature classes or layers
+    :param - method - near method, PLANAR or GEODESIC
+    :param - engine - "AUTO" picks the fastest engine that reproduces Near on the backend, "KDTREE" or "STRTREE"
+    request an engine, and "NEAR" uses Near_analysis
+    :param - backend - I/O backend used to describe the datasets, see get_backend
+    :returns - "KDTREE", "STRTREE", or "NEAR" """
+    engine = str(engine or "AUTO").upper()
+    if engine == "NEAR":
+        return "NEAR"
+    backend = get_backend(in_fc, backend)
+    method = str(method or "PLANAR").upper()
+    shape_types = [backend.shape_type(feature) for feature in [in_fc] + list(near_features)]
+    kdtree_supported = cKDTree is not None and method in ["PLANAR", "GEODESIC"] and \
+                       all(shape_type == "Point" for shape_type in shape_types)
+    strtree_supported = shapely is not None and hasattr(shapely, "shortest_line") and method == "PLANAR"
+    if engine in ["AUTO", "KDTREE"] and kdtree_supported:
+        return "KDTREE"
+    if strtree_supported and (engine == "STRTREE" or (engine == "AUTO" and backend.name != "ARCPY")):
+        return "STRTREE"
+    if engine != "AUTO":
+        arc_print("The KD-tree near engine requires scipy and point features, and the STRtree near engine requires "
+                  "shapely 2 and the PLANAR method. Using Near Analysis instead.")
+    return "NEAR"
+
+
+def private_temp_directory(name):
+    """Returns a directory of the temporary directory that only the current user can use, for the default caches.
+    It is created with mode 0700, and a directory owned by another user (or a symbolic link) is refused, so other
+    users of a shared machine can not plant or read cache entries.
+    :param - name - directory name, the user name is appended
+    :returns - directory path"""
+    try:
+        user_name = getpass.getuser()
+    except Exception:  # No user name in the environment or password database
+        user_name = str(os.getuid()) if hasattr(os, "getuid") else "user"
+    directory = os.path.join(tempfile.gettempdir(), "{0}_{1}".format(name, re.sub(r"[^\w.-]", "_", user_name)))
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError:  # The directory exists
+        pass
+    if hasattr(os, "getuid"):
+        directory_stat = os.lstat(directory)
+        if not stat.S_ISDIR(directory_stat.st_mode) or directory_stat.st_uid != os.getuid():
+            raise ValueError("The cache directory {0} is not a directory owned by the current user. Pass a cache "
+                             "directory instead.".format(directory))
+        if stat.S_IMODE(directory_stat.st_mode) & 0o077:
+            os.chmod(directory, 0o700)
+    return directory
+
+
+class NearIndexCache(object):
+    """Size bounded on disk cache of near feature spatial indexes. Every entry is a directory holding the packed
+    object id and coordinate arrays of one or more near layers as .npy files, which are memory mapped when loaded,
+    and the KD-trees are rebuilt from the mapped arrays, so the cache holds no pickles. Entries are keyed by a hash
+    of the dataset, filter, spatial reference, and a content fingerprint of the source data, so they are invalidated
+    when the data changes, and the least recently used entries are evicted once the cache grows past max_bytes."""
+
+    def __init__(self, cache_directory=None, max_bytes=2 * 1024 ** 3, memory_entries=0):
+        self.cache_directory = cache_directory or private_temp_directory("proximity_index_cache")
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries  # Number of loaded entries kept in memory for long running processes
+        self.loaded_entries = OrderedDict()
+        if not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory)
+
+    def key(self, *parts):
+        """Returns the hash of the parts identifying a cache entry."""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def entry_directory(self, key):
+        return os.path.join(self.cache_directory, key)
+
+    def load(self, key, build_tree):
+        """Loads a cache entry. The arrays are memory mapped read only, the KD-trees are built from them, and the
+        entry is marked as recently used.
+        :param - key - cache key, see key
+        :param - build_tree - function returning the KD-tree of a layer tuple
+        :returns - tuple of (list of (layer name, array...) tuples, dictionary of KD-trees keyed by layer name), or
+        None if the entry does not exist or can not be read"""
+        if key in self.loaded_entries:
+            self.loaded_entries[key] = self.loaded_entries.pop(key)
+            return self.loaded_entries[key]
+        entry_directory = self.entry_directory(key)
+        meta_path = os.path.join(entry_directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            layers = []
+            trees = {}
+            for layer_index, layer_name in enumerate(meta["layers"]):
+                layers.append((layer_name,) + tuple(
+                    np.load(os.path.join(entry_directory, "{0}_{1}.npy".format(layer_index, array_name)),
+                            mmap_mode="r") for array_name in meta["arrays"]))
+                if len(layers[-1][1]):
+                    trees[layer_name] = build_tree(layers[-1])
+            os.utime(meta_path, None)
+            self.keep_loaded(key, layers, trees)
+            return layers, trees
+        except Exception as e:
+            arc_print("Could not read spatial index cache entry {0}: {1}".format(key, e))
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            return None
+
+    def store(self, key, layers, trees, array_names):
+        """Writes the arrays of a cache entry to a temporary directory that is renamed into place, then evicts old
+        entries. The KD-trees are only kept in memory.
+        :param - key - cache key, see key
+        :param - layers - list of (layer name, array...) tuples
+        :param - trees - dictionary of KD-trees keyed by layer name
+        :param - array_names - names of the arrays following the layer name in each layer tuple"""
+        temporary_directory = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_directory)
+        try:
+            for layer_index, layer in enumerate(layers):
+                for array_name, array in zip(array_names, layer[1:]):
+                    np.save(os.path.join(temporary_directory, "{0}_{1}.npy".format(layer_index, array_name)),
+                            np.asarray(array))
+            with open(os.path.join(temporary_directory, "meta.json"), "w") as meta_file:
+                json.dump({"layers": [str(layer[0]) for layer in layers], "arrays": list(array_names)}, meta_file)
+            entry_directory = self.entry_directory(key)
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            os.rename(temporary_directory, entry_directory)
+        except OSError as e:  # Another process stored the entry first, or the disk is full
+            arc_print("Could not write spatial index cache entry {0}: {1}".format(key, e))
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+        self.keep_loaded(key, layers, trees)
+        self.evict()
+
+    def keep_loaded(self, key, layers, trees):
+        """Keeps an entry in memory, so later runs in the same process skip loading it, evicting the least recently
+        used loaded entries past memory_entries."""
+        if not self.memory_entries:
+            return
+        self.loaded_entries[key] = (layers, trees)
+        while len(self.loaded_entries) > self.memory_entries:
+            self.loaded_entries.popitem(last=False)
+
+    def entry_size(self, entry_directory):
+        return sum(os.path.getsize(os.path.join(entry_directory, file_name))
+                   for file_name in os.listdir(entry_directory))
+
+    def evict(self):
+        """Removes the least recently used entries until the cache holds at most max_bytes."""
+        entries = []
+        for entry_name in os.listdir(self.cache_directory):
+            meta_path = os.path.join(self.cache_directory, entry_name, "meta.json")
+            if entry_name.startswith(".tmp_") or not os.path.exists(meta_path):
+                continue
+            entry_directory = self.entry_directory(entry_name)
+            entries.append((os.path.getmtime(meta_path), self.entry_size(entry_directory), entry_directory))
+        cache_size = sum(entry[1] for entry in entries)
+        for last_used, entry_size, entry_directory in sorted(entries):
+            if cache_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            cache_size -= entry_size
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        self.loaded_entries.clear()
+        for entry_name in os.listdir(self.cache_directory):
+            shutil.rmtree(self.entry_directory(entry_name), ignore_errors=True)
+
+
+def get_near_index_cache(index_cache=None):
+    """Returns the spatial index cache used by the near engines.
+    :param - index_cache - NearIndexCache object, a cache directory path, True to use the default cache directory,
+    or None/False to disable caching
+    :returns - NearIndexCache or None"""
+    if index_cache is None or index_cache is False:
+        return None
+    if isinstance(index_cache, NearIndexCache):
+        return index_cache
+    return NearIndexCache(None if index_cache is True else str(index_cache))
+
+
+def spatial_reference_key(spatial_reference):
+    """Returns a string identifying a spatial reference (arcpy or DatasetSpatialReference) in a cache key."""
+    if spatial_reference is None:
+        return None
+    if hasattr(spatial_reference, "exportToString"):
+        return spatial_reference.exportToString()
+    return json.dumps(spatial_reference.crs, sort_keys=True, default=str)
+
+
+def file_fingerprint(path, ignore_extensions=(".lock",)):
+    """Fingerprints a file based dataset by the relative path, size, and modification time of its files. Directories
+    (file geodatabases) are walked, and the sidecar files sharing the stem of a file (shapefiles) are included. Lock
+    files are ignored since reading a dataset can create them.
+    :param - path - file or directory path
+    :param - ignore_extensions - file extensions left out of the fingerprint
+    :returns - hex digest string, or None if the path does not exist"""
+    if os.path.isdir(path):
+        file_paths = [os.path.join(directory, file_name) for directory, directory_names, file_names in os.walk(path)
+                      for file_name in file_names]
+        root = path
+    elif os.path.isfile(path):
+        root, file_name = os.path.split(path)
+        stem = os.path.splitext(file_name)[0]
+        file_paths = [os.path.join(root, sibling) for sibling in os.listdir(root or ".")
+                      if sibling == file_name or sibling.startswith(stem + ".")]
+    else:
+        return None
+    digest = hashlib.sha1()
+    for file_path in sorted(file_paths):
+        if file_path.lower().endswith(tuple(ignore_extensions)):
+            continue
+        file_stat = os.stat(file_path)
+        digest.update("{0}|{1}|{2}\n".format(os.path.relpath(file_path, root), file_stat.st_size,
+                                             getattr(file_stat, "st_mtime_ns", file_stat.st_mtime)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def cached_near_index(index_cache, key_parts, array_names, read_layers, build_tree, backend, dataset):
+    """Loads near layers from the spatial index cache and builds their KD-trees from the mapped arrays, or reads the
+    layers, builds the trees, and stores the layers. Datasets without a fingerprint (layers, enterprise data) are
+    never cached.
+    :param - index_cache - NearIndexCache or None
+    :param - key_parts - tuple of the values identifying the layers besides the dataset fingerprint
+    :param - array_names - names of the arrays following the layer name in each layer tuple
+    :param - read_layers - function returning a list of (layer name, array...) tuples
+    :param - build_tree - function returning the KD-tree of a layer tuple
+    :param - backend - I/O backend used to fingerprint the dataset
+    :param - dataset - near feature class the layers are read from
+    :returns - tuple of (list of layer tuples, dictionary of KD-trees keyed by layer name)"""
+    fingerprint = backend.dataset_fingerprint(dataset) if index_cache is not None else None
+    if fingerprint is not None:
+        key = index_cache.key(fingerprint, *key_parts)
+        with stage_timer("index cache load"):
+            cached_entry = index_cache.load(key, build_tree)
+        if cached_entry is not None:
+            arc_print("Loaded spatial index of {0} from the cache.".format(backend.dataset_name(dataset)))
+            return cached_entry
+    with stage_timer("read near") as stage:
+        layers = read_layers()
+        stage.rows = sum(len(layer[1]) for layer in layers)
+    with stage_timer("index build", stage.rows):
+        trees = dict((layer[0], build_tree(layer)) for layer in layers if len(layer[1]))
+    if fingerprint is not None:
+        with stage_timer("index cache store"):
+            index_cache.store(key, layers, trees, array_names)
+    return layers, trees
+
+
+def build_network_graph(line_geometries, node_tolerance=0.0):
+    """Builds a compact undirected graph of a line network for network distances. Lines are split into their
+    segments, and lines connect where they share a vertex, with vertex coordinates rounded to node_tolerance, so
+    crossing lines without a shared vertex are not connected.
+    :param - line_geometries - numpy array of shapely (multi) line strings
+    :param - node_tolerance - vertices are merged into one node when their coordinates round to the same multiple of
+    this distance, 0 only merges identical coordinates
+    :returns - NetworkGraph namedtuple"""
+    line_geometries = line_geometries[~(shapely.is_missing(line_geometries) | shapely.is_empty(line_geometries))]
+    parts = shapely.get_parts(line_geometries)
+    parts = parts[np.isin(shapely.get_type_id(parts), [1, 2])]  # LineString and LinearRing parts
+    coordinates, part_index = shapely.get_coordinates(parts, return_index=True)
+    node_keys = np.round(coordinates / float(node_tolerance)) if node_tolerance else coordinates
+    node_keys, vertex_nodes = np.unique(node_keys, axis=0, return_inverse=True)
+    vertex_nodes = vertex_nodes.ravel()
+    node_xy = np.empty((len(node_keys), 2))
+    node_xy[vertex_nodes] = coordinates
+    same_part = part_index[1:] == part_index[:-1]
+    segment_nodes = np.column_stack([vertex_nodes[:-1][same_part], vertex_nodes[1:][same_part]])
+    segment_xy = np.stack([coordinates[:-1][same_part], coordinates[1:][same_part]], axis=1)
+    is_edge = segment_nodes[:, 0] != segment_nodes[:, 1]
+    segment_nodes, segment_xy = segment_nodes[is_edge], segment_xy[is_edge]
+    segment_lengths = np.hypot(*(segment_xy[:, 1] - segment_xy[:, 0]).T)
+    segments = shapely.linestrings(segment_xy)
+    arc_print("Built a network graph of {0} nodes and {1} edges.".format(len(node_xy), len(segments)))
+    return NetworkGraph(node_xy, segment_nodes, segment_lengths, segments, shapely.STRtree(segments))
+
+
+def snap_to_network(network, xy, snap_tolerance=None):
+    """Snaps points to the closest location on the segments of a network.
+    :param - network - NetworkGraph namedtuple
+    :param - xy - n x 2 coordinates of the points
+    :param - snap_tolerance - points farther than this from the network are not snapped, None snaps every point
+    :returns - tuple of (segment index array with -1 for points that are not snapped, distance along the segment
+    array, snap distance array)"""
+    segment_index = np.full(len(xy), -1, dtype=np.int64)
+    along = np.zeros(len(xy))
+    snap_distance = np.full(len(xy), np.inf)
+    if not len(xy) or not len(network.segments):
+        return segment_index, along, snap_distance
+    points = shapely.points(xy)
+    (point_index, nearest_segment), distances = network.segment_tree.query_nearest(
+        points, max_distance=snap_tolerance, return_distance=True, all_matches=False)
+    segment_index[point_index] = nearest_segment
+    along[point_index] = shapely.line_locate_point(network.segments[nearest_segment], points[point_index])
+    snap_distance[point_index] = distances
+    return segment_index, along, snap_distance
+
+
+def network_edge_matrix(network, extra_from=None, extra_to=None, extra_lengths=None, node_count=None):
+    """Builds the sparse adjacency matrix of a network, with both directions of every segment and optional extra
+    directed edges. Parallel edges between two nodes keep the shortest length.
+    :returns - scipy.sparse.csr_matrix"""
+    edge_from = np.concatenate([network.segment_nodes[:, 0], network.segment_nodes[:, 1]] +
+                               ([extra_from] if extra_from is not None else []))
+    edge_to = np.concatenate([network.segment_nodes[:, 1], network.segment_nodes[:, 0]] +
+                             ([extra_to] if extra_to is not None else []))
+    lengths = np.concatenate([network.segment_lengths, network.segment_lengths] +
+                             ([extra_lengths] if extra_lengths is not None else []))
+    order = np.lexsort((lengths, edge_to, edge_from))
+    edge_from, edge_to, lengths = edge_from[order], edge_to[order], lengths[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (edge_from[1:] != edge_from[:-1]) | (edge_to[1:] != edge_to[:-1])
+    node_count = len(network.node_xy) if node_count is None else node_count
+    return sparse.csr_matrix((lengths[first], (edge_from[first], edge_to[first])), shape=(node_count, node_count))
+
+
+def network_near_query(network, in_xy, in_snap, near_oids, near_xy, near_snap, search_radius=None):
+    """Finds the near feature with the shortest network distance of every input point with one multi-source
+    Dijkstra run. Every near feature becomes a source node joined to the two ends of its segment, so the run labels
+    every network node with its closest near feature and the distance to it, bounded by the search radius. Inputs and
+    near features on the same segment are also compared along the segment. Distances run between the snapped
+    locations and do not include the snap distances. X and Y are the near feature coordinates and ANGLE is the
+    straight line angle from the input point to the near feature, like near_kdtree_query.
+    :param - network - NetworkGraph namedtuple
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - in_snap - snap_to_network result of the input points
+    :param - near_oids - object ids of the near features
+    :param - near_xy - n x 2 coordinates of the near features
+    :param - near_snap - snap_to_network result of the near features
+    :param - search_radius - network search radius in dataset units, None searches the whole network
+    :returns - dictionary of arrays keyed by "DIST", "X", "Y", "ANGLE", "FID", with NEAR_NO_MATCH values for inputs
+    without a near feature within the search radius"""
+    point_count = len(in_xy)
+    results = dict((key, np.full(point_count, no_match, dtype=dtype)) for key, dtype, no_match in NEAR_RESULT_DTYPES)
+    in_segment, in_along, in_snap_distance = in_snap
+    near_segment, near_along, near_snap_distance = near_snap
+    near_index = np.flatnonzero(near_segment >= 0)
+    if not len(near_index) or not point_count:
+        return results
+    node_count = len(network.node_xy)
+    source_nodes = node_count + np.arange(len(near_index))
+    segments = near_segment[near_index]
+    graph = network_edge_matrix(network, np.repeat(source_nodes, 2), network.segment_nodes[segments].ravel(),
+                                np.column_stack([near_along[near_index],
+                                                 network.segment_lengths[segments] - near_along[near_index]]).ravel(),
+                                node_count + len(near_index))
+    limit = np.inf if search_radius is None else search_radius
+    node_distances, predecessors, node_sources = csgraph.dijkstra(graph, indices=source_nodes, min_only=True,
+                                                                 return_predecessors=True, limit=limit)
+    snapped = np.flatnonzero(in_segment >= 0)
+    segment_nodes = network.segment_nodes[in_segment[snapped]]
+    end_distances = node_distances[segment_nodes] + np.column_stack([in_along[snapped],
+                                                                      network.segment_lengths[in_segment[snapped]] -
+                                                                      in_along[snapped]])
+    closest_end = np.argmin(end_distances, axis=1)
+    distances = end_distances[np.arange(len(snapped)), closest_end]
+    sources = node_sources[segment_nodes[np.arange(len(snapped)), closest_end]] - node_count
+    # Inputs and near features on the same segment may be closer along the segment than through its ends
+    segment_order = np.argsort(segments, kind="mergesort")
+    sorted_segments = segments[segment_order]
+    range_start = np.searchsorted(sorted_segments, in_segment[snapped], "left")
+    range_count = np.searchsorted(sorted_segments, in_segment[snapped], "right") - range_start
+    pair_inputs = np.repeat(np.arange(len(snapped)), range_count)
+    pair_sources = segment_order[np.repeat(range_start - np.cumsum(range_count) + range_count, range_count) +
+                                 np.arange(range_count.sum())]
+    pair_distances = np.abs(near_along[near_index[pair_sources]] - in_along[snapped][pair_inputs])
+    pair_order = np.lexsort((pair_distances, pair_inputs))[::-1]  # The shortest pair of every input is set last
+    pair_inputs, pair_sources, pair_distances = pair_inputs[pair_order], pair_sources[pair_order], \
+                                                pair_distances[pair_order]
+    shorter = pair_distances < distances[pair_inputs]
+    distances[pair_inputs[shorter]] = pair_distances[shorter]
+    sources[pair_inputs[shorter]] = pair_sources[shorter]
+    found = np.isfinite(distances) & (distances <= limit) & (sources >= 0)
+    rows, near_features = snapped[found], near_index[sources[found]]
+    delta = near_xy[near_features] - in_xy[rows]
+    results["DIST"][rows] = distances[found]
+    results["X"][rows] = near_xy[near_features, 0]
+    results["Y"][rows] = near_xy[near_features, 1]
+    results["ANGLE"][rows] = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+    results["FID"][rows] = near_oids[near_features]
+    return results
+
+
+def network_chained_near_arrays(in_xy, near_layers, network, search_radius=None, snap_tolerance=None):
+    """Network distance version of chained_near_arrays. The network graph is built once and the input points are
+    snapped to it once, then every near layer is snapped and queried with one multi-source Dijkstra run, see
+    network_near_query.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - network - NetworkGraph namedtuple, see build_network_graph
+    :param - search_radius - network search radius in dataset units, None searches the whole network
+    :param - snap_tolerance - points farther than this from the network get no match, None snaps every point
+    :returns - dictionary keyed by layer name of the result dictionaries returned by network_near_query"""
+    in_snap = snap_to_network(network, in_xy, snap_tolerance)
+    layer_results = {}
+    for layer_name, near_oids, near_xy in near_layers:
+        near_snap = snap_to_network(network, near_xy, snap_tolerance)
+        layer_results[layer_name] = network_near_query(network, in_xy, in_snap, near_oids, near_xy, near_snap,
+                                                       search_radius)
+    return layer_results
+
+
+def read_near_layers(near_features, spatial_reference, geographic_reference=None, index_cache=None, backend=None):
+    """Reads the near layers of the KD-tree engines and their spatial indexes, through the spatial index cache if
+    one is given. With a geographic reference the layers include longitude/latitude coordinates and the trees index
+    unit vectors for the GEODESIC method.
+    :param - near_features - list of near feature classes or layers
+    :param - spatial_reference - spatial reference the near coordinates are read in
+    :param - geographic_reference - geographic coordinate system of the GEODESIC method, or None for PLANAR
+    :param - index_cache - spatial index cache, see get_near_index_cache
+    :param - backend - I/O backend, see get_backend
+    :returns - tuple of (list of near layer tuples, dictionary of KD-trees keyed by layer name)"""
+    index_cache = get_near_index_cache(index_cache)
+    near_layers = []
+    near_trees = {}
+    for feature in near_features:
+        feature = feature.strip("'")
+        feature_name = backend.dataset_name(feature)
+
+        def read_layers(feature=feature, feature_name=feature_name):
+            arc_print("Reading near feature coordinates for {0}.".format(feature_name))
+            near_oids, near_xy = backend.read_points(feature, spatial_reference=spatial_reference)
+            if geographic_reference is None:
+                return [(feature_name, near_oids, near_xy)]
+            lonlat_oids, near_lonlat = backend.read_points(feature, spatial_reference=geographic_reference)
+            return [(feature_name, near_oids, near_xy, align_lonlat(near_oids, lonlat_oids, near_lonlat))]
+
+        layers, trees = cached_near_index(
+            index_cache, ("points", str(feature), feature_name, spatial_reference_key(spatial_reference),
+                          spatial_reference_key(geographic_reference)),
+            ["oids", "xy"] if geographic_reference is None else ["oids", "xy", "lonlat"], read_layers,
+            near_tree_builder(geographic_reference), backend, feature)
+        near_layers.extend(layers)
+        near_trees.update(trees)
+    return near_layers, near_trees
+
+
+def read_near_category_layers(near_feature, category_field, spatial_reference, geographic_reference=None,
+                              index_cache=None, backend=None):
+    """Reads a near feature class partitioned by the unique values of a field into one near layer per value (named
+    F_{value}) and builds their spatial indexes, through the spatial index cache if one is given.
+    :param - near_feature - near feature class or layer
+    :param - category_field - field whose unique values partition the near features
+    :param - spatial_reference - spatial reference the near coordinates are read in
+    :param - geographic_reference - geographic coordinate system of the GEODESIC method, or None for PLANAR
+    :param - index_cache - spatial index cache, see get_near_index_cache
+    :param - backend - I/O backend, see get_backend
+    :returns - tuple of (list of near layer tuples, dictionary of KD-trees keyed by layer name)"""
+    index_cache = get_near_index_cache(index_cache)
+
+    def read_layers():
+        near_oids, near_xy, near_categories = backend.read_point_categories(near_feature, category_field,
+                                                                            spatial_reference=spatial_reference)
+        if geographic_reference is None:
+            return [("F_" + str(value), oids, xy) for value, oids, xy in
+                    partition_near_layers(near_oids, near_xy, near_categories)]
+        lonlat_oids, near_lonlat = backend.read_points(near_feature, spatial_reference=geographic_reference)
+        near_lonlat = align_lonlat(near_oids, lonlat_oids, near_lonlat)
+        return [("F_" + str(value), near_oids[positions], near_xy[positions], near_lonlat[positions])
+                for value, positions, xy in partition_near_layers(np.arange(len(near_oids)), near_xy, near_categories)]
+
+    return cached_near_index(
+        index_cache, ("categories", str(near_feature), str(category_field), spatial_reference_key(spatial_reference),
+                      spatial_reference_key(geographic_reference)),
+        ["oids", "xy"] if geographic_reference is None else ["oids", "xy", "lonlat"], read_layers,
+        near_tree_builder(geographic_reference), backend, near_feature)
+
+
+def near_tree_builder(geographic_reference=None):
+    """Returns the function building the KD-tree of a near layer tuple: on the coordinates for the PLANAR method,
+    or on the unit vectors of the longitude/latitude coordinates for the GEODESIC method."""
+    if geographic_reference is None:
+        return lambda layer: cKDTree(layer[2])
+    return lambda layer: cKDTree(lonlat_to_unit_vectors(layer[3]))
+
+
+def read_table_columns(in_table, fields, query=""):
+    """Reads fields of a table into numpy arrays with one arcpy.da.TableToNumPyArray call.
+    :param - in_table - input table or feature class
+    :param - fields - list of field names to read
+    :param - query - sql query to filter the rows read
+    :returns - tuple of (object id array, dictionary of numpy arrays keyed by field name)"""
+    table_array = arcpy.da.TableToNumPyArray(in_table, ["OID@"] + list(fields), query)
+    return table_array["OID@"].astype(np.int64), dict((field, table_array[field]) for field in fields)
+
+
+def columns_to_structured_array(oids, columns, join_field="JOIN_OID"):
+    """Collects a set of equal length columns and the object ids they belong to into one structured numpy array.
+    :param - oids - object ids that key every row of the columns
+    :param - columns - list of (field name, numpy array) tuples
+    :param - join_field - name of the object id field in the structured array
+    :returns - numpy structured array"""
+    oids = np.asarray(oids)
+    dtypes = [(str(join_field), oids.dtype)] + [(str(field), np.asarray(values).dtype) for field, values in columns]
+    structured_array = np.empty(len(oids), dtype=dtypes)
+    structured_array[join_field] = oids
+    for field, values in columns:
+        structured_array[field] = values
+    return structured_array
+
+
+def write_columns(in_table, oids, columns, fill_values=None, use_extend_table=False, bbox=None):
+    """Writes a set of new columns to an existing table in a single pass instead of one CalculateField per field.
+    The columns are collected into a structured array and either written with one arcpy.da.UpdateCursor pass or
+    joined on the object id with arcpy.da.ExtendTable. The fields must already exist (see add_new_field).
+    :param - in_table - table or feature class to write to
+    :param - oids - object ids that key every row of the columns
+    :param - columns - list of (field name, numpy array) tuples
+    :param - fill_values - optional list of values written to the columns of rows whose object id is not in oids,
+    rows are left untouched if None. Ignored by ExtendTable.
+    :param - use_extend_table - if true, use arcpy.da.ExtendTable instead of an update cursor
+    :param - bbox - optional (xmin, ymin, xmax, ymax) tuple that contains every feature in oids, so the update cursor
+    only visits the features inside it (ArcGIS Pro 3.2 or later). Rows outside it are not filled.
+    :returns - number of rows written"""
+    columns = list(columns)
+    if not columns:
+        return 0
+    join_field = "JOIN_OID"
+    structured_array = columns_to_structured_array(oids, columns, join_field)
+    field_names = [field for field, values in columns]
+    if use_extend_table:
+        oid_field_name = arcpy.Describe(in_table).OIDFieldName
+        arcpy.da.ExtendTable(in_table, oid_field_name, structured_array, join_field, append_only=False)
+        return len(structured_array)
+    result_rows = structured_array[field_names].tolist()
+    row_lookup = dict(zip(structured_array[join_field].tolist(), range(len(structured_array))))
+    rows_written = 0
+    cursor_filter = extent_spatial_filter(in_table, bbox) if bbox is not None else {}
+    # Without a cursor spatial filter, rows are only filled if their point is inside the bounding box
+    check_bbox = bbox is not None and fill_values is not None and not cursor_filter
+    with arcpy.da.UpdateCursor(in_table, ["OID@"] + field_names + (["SHAPE@XY"] if check_bbox else []),
+                               **cursor_filter) as cursor:
+        for row in cursor:
+            row_index = row_lookup.get(row[0])
+            if row_index is not None:
+                cursor.updateRow((row[0],) + result_rows[row_index] + tuple(row[-1:] if check_bbox else ()))
+                rows_written += 1
+            elif fill_values is not None:
+                if check_bbox and (row[-1][0] is None or not (bbox[0] <= row[-1][0] <= bbox[2] and
+                                                               bbox[1] <= row[-1][1] <= bbox[3])):
+                    continue
+                cursor.updateRow([row[0]] + list(fill_values) + list(row[-1:] if check_bbox else []))
+    return rows_written
+
+
+def read_point_categories(in_fc, category_field, query="", spatial_reference=None, bbox=None):
+    """Reads the object IDs, x/y coordinates, and the values of a category field of a point feature class in one
+    cursor pass. Features with null geometries are skipped.
+    :param - in_fc - input point feature class or layer
+    :param - category_field - field whose values partition the features
+    :param - query - sql query to filter the features read
+    :param - spatial_reference - optional spatial reference to project the coordinates into
+    :param - bbox - optional (xmin, ymin, xmax, ymax) tuple in the output spatial reference, only the features inside
+    it are read
+    :returns - tuple of (object id array, n x 2 coordinate array, object array of category values)"""
+    cursor_filter = extent_spatial_filter(in_fc, bbox, spatial_reference) if bbox is not None else {}
+    rows = [row for row in arcpy.da.SearchCursor(in_fc, ["OID@", "SHAPE@X", "SHAPE@Y", category_field], query,
+                                                 spatial_reference, **cursor_filter) if row[1] is not None]
+    oids = np.array([row[0] for row in rows], dtype=np.int64)
+    xy = np.array([(row[1], row[2]) for row in rows], dtype=np.float64).reshape(-1, 2)
+    categories = np.empty(len(rows), dtype=object)
+    categories[:] = [row[3] for row in rows]
+    inside = bbox_mask(xy, bbox)
+    return oids[inside], xy[inside], categories[inside]
+
+
+def read_geometries(in_fc, query="", spatial_reference=None, category_field=None):
+    """Reads the object IDs and geometries of a feature class into a numpy array of shapely geometries in one
+    cursor pass over the SHAPE@WKB token. Features with null geometries are skipped.
+    :param - in_fc - input feature class or layer
+    :param - query - sql query to filter the features read
+    :param - spatial_reference - optional spatial reference to project the geometries into
+    :param - category_field - optional field whose values are also read
+    :returns - tuple of (object id array, geometry array) or (object id array, geometry array, object array of
+    category values) if a category field is given"""
+    fields = ["OID@", "SHAPE@WKB"] + ([category_field] if category_field else [])
+    rows = [row for row in arcpy.da.SearchCursor(in_fc, fields, query, spatial_reference) if row[1] is not None]
+    oids = np.array([row[0] for row in rows], dtype=np.int64)
+    geometries = shapely.from_wkb(np.array([bytes(row[1]) for row in rows], dtype=object))
+    if not category_field:
+        return oids, geometries
+    categories = np.empty(len(rows), dtype=object)
+    categories[:] = [row[2] for row in rows]
+    return oids, geometries, categories
+
+
+def partition_near_layers(oids, xy, categories, filter_falsy=True):
+    """Partitions a near feature set into one near layer per unique category value, in the sorted order
+    arc_unique_values returns them.
+    :param - oids - object ids of the near features
+    :param - xy - n x 2 coordinates or array of geometries of the near features
+    :param - categories - category value of every near feature
+    :param - filter_falsy - if true, null/falsy category values do not get a layer
+    :returns - list of (category value, object id array, n x 2 coordinate array or geometry array) tuples"""
+    category_values = sorted({value for value in categories if value or not filter_falsy})
+    category_codes = dict((value, code) for code, value in enumerate(category_values))
+    codes = np.array([category_codes.get(value, -1) for value in categories], dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    splits = np.searchsorted(codes[order], np.arange(len(category_values) + 1))
+    return [(value, oids[order[splits[code]:splits[code + 1]]], xy[order[splits[code]:splits[code + 1]]])
+            for code, value in enumerate(category_values)]
+
+
+def add_near_result_fields(in_fc, layer_results, layer_names, location=False, angle=False, fid=False, backend=None):
+    """Adds the chained near fields (DIST_, X_, Y_, ANGLE_, FID_ + layer name) for the results of the in process
+    near engine and pairs every new field with its column of values.
+    :param - in_fc - input feature class receiving the new fields
+    :param - layer_results - dictionary of near result dictionaries keyed by layer name
+    :param - layer_names - layer names in the order their fields are added
+    :param - location - boolean, add the X_ and Y_ fields
+    :param - angle - boolean, add the ANGLE_ fields
+    :param - fid - boolean, add the FID_ fields
+    :param - backend - I/O backend used to add the fields, see get_backend
+    :returns - tuple of (list of (field name, numpy array) columns, list of values written when there is no match)"""
+    near_fields, no_match_values = add_near_fields(in_fc, layer_names, location, angle, fid, backend)
+    return near_result_columns(near_fields, layer_results), no_match_values
+
+
+def add_near_fields(in_fc, layer_names, location=False, angle=False, fid=False, backend=None, k=1):
+    """Adds the chained near fields (DIST_, X_, Y_, ANGLE_, FID_ + layer name) of a set of near layers. With k
+    nearest features, the fields of every rank are numbered (DIST1_, DIST2_, ... + layer name).
+    :param - in_fc - input feature class receiving the new fields
+    :param - layer_names - layer names in the order their fields are added
+    :param - location - boolean, add the X_ and Y_ fields
+    :param - angle - boolean, add the ANGLE_ fields
+    :param - fid - boolean, add the FID_ fields
+    :param - backend - I/O backend used to add the fields, see get_backend
+    :param - k - number of nearest features with fields, see chained_near_arrays_k
+    :returns - tuple of (list of (field name, layer name, result key) tuples, list of values written when there is no
+    match), where the layer name is a (layer name, rank) tuple when k is greater than 1"""
+    result_keys = ["DIST"] + (["X", "Y"] if location else []) + (["ANGLE"] if angle else []) + \
+                  (["FID"] if fid else [])
+    near_fields = []
+    with SchemaManager(in_fc, backend) as schema:
+        for layer_name in layer_names:
+            arc_print("Adding Near Feature specific fields for {0}.".format(layer_name))
+            for rank in range(1, k + 1):
+                for key in result_keys:
+                    if k > 1:
+                        new_field_name, result_layer = "{0}{1}_{2}".format(key, rank, layer_name), (layer_name, rank)
+                    else:
+                        new_field_name, result_layer = "{0}_{1}".format(key, layer_name), layer_name
+                    valid_field_name = schema.validate_field_name(new_field_name)
+                    schema.add_field(valid_field_name, "DOUBLE", field_alias=new_field_name)
+                    near_fields.append((valid_field_name, result_layer, key))
+    no_match_values = [NEAR_NO_MATCH if key != "ANGLE" else 0 for key in result_keys] * len(layer_names) * k
+    return near_fields, no_match_values
+
+
+def near_result_columns(near_fields, layer_results):
+    """Pairs the fields returned by add_near_fields with their columns of near results.
+    :param - near_fields - list of (field name, layer name, result key) tuples
+    :param - layer_results - dictionary of near result dictionaries keyed by layer name
+    :returns - list of (field name, numpy array) columns"""
+    return [(field_name, layer_results[layer_name][key].astype(np.float64)) for field_name, layer_name, key in
+            near_fields]
+
+
+def expand_bbox(bbox, distance):
+    """Returns a bounding box grown by a distance on every side.
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple
+    :param - distance - distance added to every side
+    :returns - (xmin, ymin, xmax, ymax) tuple"""
+    return bbox[0] - distance, bbox[1] - distance, bbox[2] + distance, bbox[3] + distance
+
+
+def bbox_contains(bbox, other_bbox):
+    """Returns true if a bounding box contains another one.
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple
+    :param - other_bbox - (xmin, ymin, xmax, ymax) tuple
+    :returns - boolean"""
+    return bbox[0] <= other_bbox[0] and bbox[1] <= other_bbox[1] and bbox[2] >= other_bbox[2] and \
+           bbox[3] >= other_bbox[3]
+
+
+def union_bbox(bboxes):
+    """Returns the bounding box of a list of bounding boxes.
+    :param - bboxes - list of (xmin, ymin, xmax, ymax) tuples
+    :returns - (xmin, ymin, xmax, ymax) tuple or None if the list is empty"""
+    bboxes = list(bboxes)
+    if not bboxes:
+        return None
+    return (min(bbox[0] for bbox in bboxes), min(bbox[1] for bbox in bboxes), max(bbox[2] for bbox in bboxes),
+            max(bbox[3] for bbox in bboxes))
+
+
+def feature_spacing(extent, feature_count):
+    """Returns the average spacing of features spread evenly over an extent, used as the starting halo of tiles
+    when there is no search radius.
+    :param - extent - (xmin, ymin, xmax, ymax) tuple
+    :param - feature_count - number of features
+    :returns - float spacing in the units of the extent"""
+    width, height = extent[2] - extent[0], extent[3] - extent[1]
+    area = width * height if width > 0 and height > 0 else max(width, height) ** 2
+    return float(np.sqrt(area / float(max(feature_count, 1))))
+
+
+def tile_grid(extent, feature_count, tile_features=1000000):
+    """Splits an extent into a grid of tiles holding about tile_features features each, assuming the features are
+    spread evenly. Tiles are as square as the extent allows.
+    :param - extent - (xmin, ymin, xmax, ymax) tuple of the input features
+    :param - feature_count - number of input features
+    :param - tile_features - target number of features per tile
+    :returns - TileGrid namedtuple"""
+    xmin, ymin, xmax, ymax = [float(value) for value in extent]
+    width, height = max(xmax - xmin, 0.0), max(ymax - ymin, 0.0)
+    tile_count = max(1, int(np.ceil(feature_count / float(max(1, int(tile_features))))))
+    if width > 0 and height > 0:
+        columns = min(tile_count, max(1, int(round(np.sqrt(tile_count * width / height)))))
+    else:
+        columns = tile_count if width > 0 else 1
+    rows = max(1, int(np.ceil(tile_count / float(columns))))
+    return TileGrid((xmin, ymin, xmax, ymax), columns, rows, width / columns, height / rows)
+
+
+def tile_bounds(grid, tile_id):
+    """Returns the bounding box of a tile. Tiles on the edge of the grid are extended outward by the size of the
+    grid, so features on or just outside the extent still belong to a tile.
+    :param - grid - TileGrid namedtuple
+    :param - tile_id - tile number, column + row * columns
+    :returns - (xmin, ymin, xmax, ymax) tuple"""
+    column, row = tile_id % grid.columns, tile_id // grid.columns
+    xmin, ymin, xmax, ymax = grid.extent
+    margin = max(xmax - xmin, ymax - ymin, 1.0)
+    return (xmin + column * grid.width if column > 0 else xmin - margin,
+            ymin + row * grid.height if row > 0 else ymin - margin,
+            xmin + (column + 1) * grid.width if column < grid.columns - 1 else xmax + margin,
+            ymin + (row + 1) * grid.height if row < grid.rows - 1 else ymax + margin)
+
+
+def tile_index(grid, xy):
+    """Returns the tile every coordinate belongs to. Tiles own their lower edges, so a feature on the border of two
+    tiles is processed once.
+    :param - grid - TileGrid namedtuple
+    :param - xy - n x 2 coordinate array
+    :returns - integer array of tile numbers"""
+    xmin, ymin, xmax, ymax = grid.extent
+    columns = np.floor((xy[:, 0] - xmin) / grid.width) if grid.width > 0 else np.zeros(len(xy))
+    rows = np.floor((xy[:, 1] - ymin) / grid.height) if grid.height > 0 else np.zeros(len(xy))
+    columns = np.clip(np.nan_to_num(columns), 0, grid.columns - 1).astype(np.int64)
+    rows = np.clip(np.nan_to_num(rows), 0, grid.rows - 1).astype(np.int64)
+    return columns + rows * grid.columns
+
+
+def read_point_tiles(in_fc, grid, query="", backend=None):
+    """Generator that reads the input points one tile at a time with bounding box filtered reads. Points read by two
+    neighboring tiles are only yielded by the tile that owns them.
+    :param - in_fc - input point features
+    :param - grid - TileGrid namedtuple over the extent of in_fc
+    :param - query - sql query to filter the features read
+    :param - backend - I/O backend used to read the points, see get_backend
+    :returns - generator of (tile bounding box, object id array, n x 2 coordinate array) tuples"""
+    backend = get_backend(in_fc, backend)
+    edge_tolerance = 1e-9 * max(grid.width, grid.height, 1.0)
+    for tile_id in range(grid.columns * grid.rows):
+        bounds = expand_bbox(tile_bounds(grid, tile_id), edge_tolerance)
+        oids, xy = backend.read_points(in_fc, query, bbox=bounds)
+        in_tile = tile_index(grid, xy) == tile_id
+        if in_tile.any():
+            yield bounds, oids[in_tile], xy[in_tile]
+
+
+def tiled_near_query(tile_bbox, tile_xy, load_near_layers, layer_names, search_radius=None, near_extent=None,
+                     initial_halo=None, workers=1):
+    """Computes the near results of the points of one tile while only loading the near features around the tile.
+    With a search radius the near features within the tile grown by the radius are loaded, which holds every near
+    feature in range of the tile. Without one, the halo starts at initial_halo and doubles for the points whose
+    nearest loaded feature is farther away than the edge of the loaded area, until every result is exact or the
+    loaded area covers the near extent.
+    :param - tile_bbox - (xmin, ymin, xmax, ymax) tuple containing the tile points
+    :param - tile_xy - n x 2 coordinates of the tile points
+    :param - load_near_layers - function of (bounding box, layer names) returning the near layers inside the box as
+    a list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - layer_names - names of every near layer
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - near_extent - (xmin, ymin, xmax, ymax) tuple containing every near feature
+    :param - initial_halo - starting halo when there is no search radius
+    :param - workers - number of processes used to query the near layers, see chained_near_arrays
+    :returns - dictionary keyed by layer name of the result dictionaries returned by near_kdtree_query"""
+    point_count = len(tile_xy)
+    layer_results = dict((layer_name, near_kdtree_query(None, None, None, np.empty((point_count, 2))))
+                         for layer_name in layer_names)
+    pending = dict((layer_name, np.arange(point_count)) for layer_name in layer_names)
+    halo = search_radius if search_radius is not None else initial_halo
+    if not halo or halo <= 0:
+        halo = max(tile_bbox[2] - tile_bbox[0], tile_bbox[3] - tile_bbox[1], 1.0)
+    halo_tolerance = 1e-9 * max(abs(value) for value in tile_bbox)
+    while any(len(pending_points) for pending_points in pending.values()):
+        region = expand_bbox(tile_bbox, halo)
+        loads_every_feature = search_radius is not None or near_extent is None or bbox_contains(region, near_extent)
+        pending_names = [layer_name for layer_name in layer_names if len(pending[layer_name])]
+        query_index = np.unique(np.concatenate([pending[layer_name] for layer_name in pending_names]))
+        query_xy = tile_xy[query_index]
+        with stage_timer("read near"):
+            loaded_layers = dict((layer_name, (near_oids, near_xy)) for layer_name, near_oids, near_xy in
+                                 load_near_layers(expand_bbox(region, halo_tolerance), pending_names))
+        near_layers = [(layer_name,) + loaded_layers.get(layer_name, (np.empty(0, dtype=np.int64), np.empty((0, 2))))
+                       for layer_name in pending_names]
+        with stage_timer("query", len(query_xy)):
+            round_results = chained_near_arrays(query_xy, near_layers, search_radius, workers=workers)
+        edge_distance = np.minimum.reduce([query_xy[:, 0] - region[0], query_xy[:, 1] - region[1],
+                                           region[2] - query_xy[:, 0], region[3] - query_xy[:, 1]])
+        for layer_name in pending_names:
+            positions = np.searchsorted(query_index, pending[layer_name])
+            distances = round_results[layer_name]["DIST"][positions]
+            resolved = np.ones(len(positions), dtype=bool) if loads_every_feature else \
+                (distances != NEAR_NO_MATCH) & (distances <= edge_distance[positions])
+            for key, values in round_results[layer_name].items():
+                layer_results[layer_name][key][pending[layer_name][resolved]] = values[positions[resolved]]
+            pending[layer_name] = pending[layer_name][~resolved]
+        halo *= 2
+    return layer_results
+
+
+def tiled_chained_near(in_fc, load_near_layers, layer_names, search_radius=None, near_extent=None,
+                       initial_halo=None, tile_features=1000000, backend=None, workers=1):
+    """Out of core engine for chained near analysis. The input points are split into a grid of tiles, and the tiles
+    are read, queried against the near features around them (see tiled_near_query), and yielded one at a time, so
+    memory is bounded by the size of a tile and its halo rather than by the size of the datasets.
+    :param - in_fc - input point features
+    :param - load_near_layers - function of (bounding box, layer names) returning the near layers inside the box
+    :param - layer_names - names of every near layer
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - near_extent - (xmin, ymin, xmax, ymax) tuple containing every near feature
+    :param - initial_halo - starting halo when there is no search radius
+    :param - tile_features - target number of input features per tile
+    :param - backend - I/O backend used to read the input points, see get_backend
+    :param - workers - number of processes used to query the near layers, see chained_near_arrays
+    :returns - generator of (tile bounding box, object id array, layer results dictionary) tuples"""
+    backend = get_backend(in_fc, backend)
+    grid = tile_grid(backend.extent(in_fc), backend.feature_count(in_fc), tile_features)
+    arc_print("Processing input features in a grid of {0} x {1} tiles...".format(grid.columns, grid.rows), True)
+    for tile_bbox, tile_oids, tile_xy in read_point_tiles(in_fc, grid, backend=backend):
+        yield tile_bbox, tile_oids, tiled_near_query(tile_bbox, tile_xy, load_near_layers, layer_names,
+                                                     search_radius, near_extent, initial_halo, workers)
+
+
+def write_near_tiles(in_fc, near_tiles, near_fields, no_match_values, backend=None):
+    """Writes the results of tiled_chained_near as the tiles are produced. Every row first receives the no match
+    values, which is what rows without a geometry keep, then each tile updates only its own rows. Formats the
+    backend can not update in place are written once after the last tile.
+    :param - in_fc - input feature class receiving the results
+    :param - near_tiles - iterable of (tile bounding box, object id array, layer results dictionary) tuples
+    :param - near_fields - list of (field name, layer name, result key) tuples returned by add_near_fields
+    :param - no_match_values - values written to the rows without results
+    :param - backend - I/O backend used to write the fields, see get_backend
+    :returns - number of rows written"""
+    backend = get_backend(in_fc, backend)
+    rows_written = 0
+    if backend.supports_incremental_writes(in_fc):
+        backend.write_columns(in_fc, np.empty(0, dtype=np.int64),
+                              [(field_name, np.empty(0)) for field_name, layer_name, key in near_fields],
+                              no_match_values)
+        for tile_number, (tile_bbox, tile_oids, layer_results) in enumerate(near_tiles):
+            with stage_timer("write", len(tile_oids)):
+                rows_written += backend.write_columns(in_fc, tile_oids, near_result_columns(near_fields,
+                                                                                            layer_results),
+                                                      bbox=tile_bbox)
+            arc_print("Wrote tile {0}, {1} features written.".format(tile_number + 1, rows_written))
+        return rows_written
+    oid_chunks, column_chunks = [], []
+    for tile_bbox, tile_oids, layer_results in near_tiles:
+        oid_chunks.append(tile_oids)
+        column_chunks.append([values for field_name, values in near_result_columns(near_fields, layer_results)])
+    oids = np.concatenate(oid_chunks) if oid_chunks else np.empty(0, dtype=np.int64)
+    columns = [(field_name, np.concatenate([chunk[field_index] for chunk in column_chunks]) if column_chunks else
+               np.empty(0)) for field_index, (field_name, layer_name, key) in enumerate(near_fields)]
+    with stage_timer("write", len(oids)):
+        return backend.write_columns(in_fc, oids, columns, no_match_values)
+
+
+def near_state_directory(state_directory, *key_parts):
+    """Returns the directory holding the incremental state of a chained near run.
+    :param - state_directory - directory of the incremental states, or True for the default directory
+    :param - key_parts - values identifying the run (input features, near features, search radius)
+    :returns - path of the state directory of the run"""
+    if state_directory is True:
+        state_directory = private_temp_directory("proximity_near_state")
+    state_key = hashlib.sha1(json.dumps(key_parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return os.path.join(str(state_directory), state_key)
+
+
+def read_near_state(state_path):
+    """Reads the incremental state written by write_near_state.
+    :param - state_path - state directory returned by near_state_directory
+    :returns - dictionary with the input "oids" and "xy" arrays and the "layers" ordered dictionary of
+    (fingerprint, near oids, near xy, near results) tuples keyed by layer name, or None if there is no state"""
+    meta_path = os.path.join(state_path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+
+    def load(array_name):
+        return np.load(os.path.join(state_path, array_name + ".npy"))
+
+    layers = OrderedDict()
+    for layer_index, (layer_name, fingerprint) in enumerate(zip(meta["layers"], meta["fingerprints"])):
+        results = load("{0}_results".format(layer_index))
+        layers[layer_name] = (fingerprint, load("{0}_oids".format(layer_index)), load("{0}_xy".format(layer_index)),
+                              dict((key, results[key]) for key in results.dtype.names))
+    return {"oids": load("oids"), "xy": load("xy"), "layers": layers}
+
+
+def write_near_state(state_path, in_oids, in_xy, layer_states):
+    """Writes the incremental state of a chained near run: the input coordinates, and for every near layer its
+    fingerprint, a snapshot of its coordinates, and the current results of every input point. The state is written
+    to a temporary directory that replaces the previous state.
+    :param - state_path - state directory returned by near_state_directory
+    :param - in_oids - object ids of the input points
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - layer_states - ordered dictionary of (fingerprint, near oids, near xy, near results) tuples keyed by
+    layer name"""
+    parent_directory = os.path.dirname(state_path)
+    if not os.path.isdir(parent_directory):
+        os.makedirs(parent_directory)
+    temporary_directory = tempfile.mkdtemp(prefix=".tmp_", dir=parent_directory)
+    np.save(os.path.join(temporary_directory, "oids.npy"), np.asarray(in_oids))
+    np.save(os.path.join(temporary_directory, "xy.npy"), np.asarray(in_xy, dtype=np.float64).reshape(-1, 2))
+    for layer_index, (fingerprint, near_oids, near_xy, results) in enumerate(layer_states.values()):
+        np.save(os.path.join(temporary_directory, "{0}_oids.npy".format(layer_index)), np.asarray(near_oids))
+        np.save(os.path.join(temporary_directory, "{0}_xy.npy".format(layer_index)),
+                np.asarray(near_xy, dtype=np.float64).reshape(-1, 2))
+        result_array = np.empty(len(in_oids), dtype=[(key, dtype) for key, dtype, no_match in NEAR_RESULT_DTYPES])
+        for key, dtype, no_match in NEAR_RESULT_DTYPES:
+            result_array[key] = results[key]
+        np.save(os.path.join(temporary_directory, "{0}_results.npy".format(layer_index)), result_array)
+    with open(os.path.join(temporary_directory, "meta.json"), "w") as meta_file:
+        json.dump({"layers": list(layer_states.keys()),
+                   "fingerprints": [layer_state[0] for layer_state in layer_states.values()]}, meta_file)
+    shutil.rmtree(state_path, ignore_errors=True)
+    os.rename(temporary_directory, state_path)
+
+
+def point_changes(old_oids, old_xy, oids, xy):
+    """Compares two snapshots of a point dataset by object id.
+    :param - old_oids - object ids of the previous snapshot
+    :param - old_xy - coordinates of the previous snapshot
+    :param - oids - current object ids
+    :param - xy - current coordinates
+    :returns - tuple of (positions of the current points in the previous snapshot, -1 for inserted points, boolean
+    array marking the current points that were inserted or moved, object ids of the previous points that were deleted
+    or moved)"""
+    old_positions = pd.Index(np.asarray(old_oids)).get_indexer(np.asarray(oids))
+    unchanged = old_positions >= 0
+    unchanged[unchanged] = np.all(np.asarray(old_xy)[old_positions[unchanged]] == xy[unchanged], axis=1)
+    kept = np.zeros(len(old_oids), dtype=bool)
+    kept[old_positions[unchanged]] = True
+    return old_positions, ~unchanged, np.asarray(old_oids)[~kept]
+
+
+def carry_near_results(results, old_positions):
+    """Carries near results over to the current input points, giving inserted points the no match values.
+    :param - results - near result dictionary of the previous input snapshot
+    :param - old_positions - positions of the current input points in the previous snapshot, see point_changes
+    :returns - near result dictionary of the current input points"""
+    carried = {}
+    found = old_positions >= 0
+    for key, dtype, no_match in NEAR_RESULT_DTYPES:
+        carried[key] = np.full(len(old_positions), no_match, dtype=dtype)
+        carried[key][found] = np.asarray(results[key])[old_positions[found]]
+    return carried
+
+
+def rows_affected_by_near_changes(in_xy, results, removed_oids, inserted_oids, inserted_xy, search_radius=None):
+    """Finds the input points whose near result can change after a near layer was edited: points whose nearest
+    feature was deleted or moved, and points that an inserted (or moved) feature is closer to than their current
+    nearest feature, within the search radius.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - results - current near result dictionary of the input points
+    :param - removed_oids - object ids of the near features that were deleted or moved
+    :param - inserted_oids - object ids of the near features that were inserted or moved
+    :param - inserted_xy - current coordinates of the inserted or moved near features
+    :param - search_radius - search radius in dataset units, None searches all features
+    :returns - boolean array marking the input points to recompute"""
+    affected = np.isin(results["FID"], removed_oids)
+    if len(inserted_oids):
+        inserted_results = near_kdtree_query(cKDTree(inserted_xy), inserted_oids, inserted_xy, in_xy, search_radius)
+        found = inserted_results["FID"] != NEAR_NO_MATCH
+        affected |= found & ((results["FID"] == NEAR_NO_MATCH) | (inserted_results["DIST"] < results["DIST"]))
+    return affected
+
+
+def read_numeric_block(in_table, fields, query=""):
+    """Reads a set of numeric fields into one 2D float64 numpy block in a single cursor pass. Null values are
+    returned as NaN so they can be handled explicitly by vectorized code.
+    :param - in_table - input table or feature class
+    :param - fields - list of numeric field names, one block column per field
+    :param - query - sql query to filter the rows read
+    :returns - tuple of (object id array, n x len(fields) float64 array)"""
+    with arcpy.da.SearchCursor(in_table, ["OID@"] + list(fields), query) as cursor:
+        block = np.array([row for row in cursor], dtype=np.float64).reshape(-1, len(fields) + 1)
+    return block[:, 0].astype(np.int64), block[:, 1:]
+
+
+def expand_field_parameter(parameter, fields):
+    """Returns one parameter value per field from a single value shared by all fields, a list or tuple aligned with
+    the fields, or a dictionary keyed by field name.
+    :param - parameter - scalar, sequence, or dictionary parameter
+    :param - fields - list of field names
+    :returns - list with one value per field"""
+    if isinstance(parameter, dict):
+        return [parameter[field] for field in fields]
+    if isinstance(parameter, (list, tuple)):
+        if len(parameter) != len(fields):
+            raise ValueError("Expected {0} per field values, but {1} were passed.".format(len(fields),
+                                                                                       len(parameter)))
+        return list(parameter)
+    return [parameter] * len(fields)
+
+
+def score_array(values, score_bands, if_outside_score=0, null_score=None):
+    """Vectorized version of threshold scoring for a whole column of values. Every band is a (lower, upper, score)
+    tuple that includes both bounds, and the first band a value falls within assigns its score, so a list of bands is a
+    piecewise score table. A lower or upper bound of None leaves that side of the band open.
+    :param - values - float numpy array, NaN marks null values
+    :param - score_bands - list of (lower, upper, score) tuples
+    :param - if_outside_score - score for values that are in none of the bands
+    :param - null_score - score for null values, NaN (written as null) if None
+    :returns - float64 numpy array of scores"""
+    values = np.asarray(values, dtype=np.float64)
+    scores = np.full(len(values), if_outside_score, dtype=np.float64)
+    scored = np.zeros(len(values), dtype=bool)
+    for lower, upper, score in score_bands:
+        in_band = ~scored & ~np.isnan(values)
+        if lower is not None:
+            in_band &= values >= lower
+        if upper is not None:
+            in_band &= values <= upper
+        scores[in_band] = score
+        scored |= in_band
+    scores[np.isnan(values)] = np.nan if null_score is None else null_score
+    return scores
+
+
+def score_near_results(layer_results, layer_bands, if_outside_scores, keep_distances=False):
+    """Scores the distances of chained near results in memory, so the distances never have to be written to fields
+    and read back to be scored. Distances of inputs without a near feature are NEAR_NO_MATCH and are scored like
+    ChainedScoring scores them.
+    :param - layer_results - dictionary of near result dictionaries keyed by layer name, see chained_near_arrays
+    :param - layer_bands - dictionary of (lower, upper, score) band lists keyed by layer name, see score_array
+    :param - if_outside_scores - dictionary of the scores of distances outside every band keyed by layer name
+    :param - keep_distances - if true, the DIST results are kept next to the scores
+    :returns - dictionary keyed by layer name of result dictionaries holding a SCORE array and optionally DIST"""
+    layer_scores = {}
+    for layer_name, results in layer_results.items():
+        layer_scores[layer_name] = {"SCORE": score_array(results["DIST"], layer_bands[layer_name],
+                                                         if_outside_scores[layer_name])}
+        if keep_distances:
+            layer_scores[layer_name]["DIST"] = results["DIST"]
+    return layer_scores
+
+
+def near_score_arrays(in_xy, near_layers, layer_bands, if_outside_scores, search_radius=None, keep_distances=False,
+                      chunk_size=1000000, workers=1, near_trees=None):
+    """Fused near and scoring engine. The input points are queried against every near layer chunk by chunk, and every
+    chunk is scored as soon as it is queried, so only the scores (and optionally the distances) of the whole input
+    are held, instead of every near result field.
+    :param - in_xy - m x 2 coordinates of the input points
+    :param - near_layers - list of (layer name, near object id array, near n x 2 coordinate array) tuples
+    :param - layer_bands - dictionary of (lower, upper, score) band lists keyed by layer name, see score_array
+    :param - if_outside_scores - dictionary of the scores of distances outside every band keyed by layer name
+    :param - search_radius - search radius in dataset units, None searches all features
+    :param - keep_distances - if true, the distances are returned next to the scores
+    :param - chunk_size - number of input points queried and scored at a time
+    :param - workers - number of processes, see chained_near_arrays
+    :param - near_trees - optional dictionary of prebuilt KD-trees keyed by layer name, see NearIndexCache
+    :returns - dictionary keyed by layer name of result dictionaries holding a SCORE array and optionally DIST"""
+    near_trees = dict(near_trees or {})
+    for layer_name, near_oids, near_xy in near_layers:
+        if layer_name not in near_trees and len(near_xy):
+            near_trees[layer_name] = cKDTree(near_xy)
+    point_count = len(in_xy)
+    result_keys = ["SCORE", "DIST"] if keep_distances else ["SCORE"]
+    layer_scores = dict((layer[0], dict((key, np.empty(point_count)) for key in result_keys)) for layer in
+                        near_layers)
+    for start in range(0, point_count, chunk_size):
+        chunk_results = chained_near_arrays(in_xy[start:start + chunk_size], near_layers, search_radius,
+                                            workers=workers, near_trees=near_trees)
+        chunk_scores = score_near_results(chunk_results, layer_bands, if_outside_scores, keep_distances)
+        for layer_name, results in chunk_scores.items():
+            for key, values in results.items():
+                layer_scores[layer_name][key][start:start + chunk_size] = values
+    return layer_scores
+
+
+def read_swm(spatial_weights_matrix):
+    """Reads a binary spatial weights matrix (.swm) file into compressed sparse row (CSR) numpy arrays. The file is
+    memory-mapped and viewed as 4 byte words, since every row record is a whole number of words. One pass over the
+    neighbor counts finds where each row starts, and the ids, neighbor indices, and weights of all rows are then
+    gathered with fancy indexing. Row i of the CSR arrays holds the neighbors of ids[i] in
+    indices[indptr[i]:indptr[i + 1]] with matching weights.
+    :param - spatial_weights_matrix - path to the .swm file
+    :returns - SpatialWeights namedtuple of (unique_id_field, ids, indptr, indices, weights, row_standardized,
+    header), where ids and indices are values of the unique id field and header is a dictionary of the swm header"""
+    with open(spatial_weights_matrix, "rb") as swm_file:
+        swm_buffer = mmap.mmap(swm_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header_end = swm_buffer.find(b"\n")
+        header_text = swm_buffer[:header_end].decode("utf-8").strip()
+        if header_text.startswith("VERSION@"):
+            header = dict(item.split("@", 1) for item in header_text.split(";") if "@" in item)
+        else:  # Pre 10.1 files only store the unique id field name in the header
+            header = {"UNIQUEID": header_text}
+        fixed_weights = header.get("FIXEDWEIGHTS", "False").upper() == "TRUE"
+        offset = header_end + 1
+        observation_count, row_standardized = struct.unpack_from("<ii", swm_buffer, offset)
+        offset += 8
+        words = np.frombuffer(swm_buffer, "<i4", (len(swm_buffer) - offset) // 4, offset)
+        # A row is its id and neighbor count, then the neighbor ids, the weights (one if fixed), and the weight sum
+        row_starts = []
+        position = 0
+        for row in range(observation_count):
+            row_starts.append(position)
+            neighbor_count = words.item(position + 1)
+            if neighbor_count:
+                position += 4 + neighbor_count + 2 * (1 if fixed_weights else neighbor_count)
+            else:
+                position += 2
+        row_starts = np.array(row_starts, dtype=np.int64)
+        ids = words[row_starts].astype(np.int64)
+        neighbor_counts = words[row_starts + 1].astype(np.int64)
+        indptr = np.zeros(observation_count + 1, dtype=np.int64)
+        np.cumsum(neighbor_counts, out=indptr[1:])
+        edge_rows = np.repeat(np.arange(observation_count), neighbor_counts)
+        edge_ranks = np.arange(indptr[-1]) - indptr[edge_rows]
+        index_words = row_starts[edge_rows] + 2
+        indices = words[index_words + edge_ranks].astype(np.int64)
+        weight_words = index_words + neighbor_counts[edge_rows] + (0 if fixed_weights else 2 * edge_ranks)
+        # Weights are 8 byte values that may start on any word, so they are read from an aligned and a shifted view
+        weights = np.empty(indptr[-1], dtype=np.float64)
+        for shift in [0, 1]:
+            weight_view = np.frombuffer(swm_buffer, "<f8", (len(swm_buffer) - offset - 4 * shift) // 8,
+                                        offset + 4 * shift)
+            shifted = weight_words % 2 == shift
+            weights[shifted] = weight_view[weight_words[shifted] // 2]
+            del weight_view
+        del words
+    finally:
+        swm_buffer.close()
+    return SpatialWeights(header["UNIQUEID"], ids, indptr, indices, weights, bool(row_standardized), header)
+
+
+def write_swm(spatial_weights_matrix, spatial_weights):
+    """Writes spatial weights in CSR form to a binary spatial weights matrix (.swm) file in the format read by
+    read_swm and the ArcGIS spatial statistics tools. Every row stores its id, neighbor count, neighbor ids, weights,
+    and the sum of its weights, and runs of rows with the same neighbor count are packed as one structured array.
+    Rows store a single weight (FIXEDWEIGHTS) when every row has equal weights. The row sums of row standardized
+    weights are written as 1, since read_swm does not keep the sums of the unstandardized weights.
+    :param - spatial_weights_matrix - path of the .swm file to write
+    :param - spatial_weights - SpatialWeights namedtuple, the header entries override the default header, and
+    UNIQUEID and FIXEDWEIGHTS are set from the namedtuple"""
+    ids = np.asarray(spatial_weights.ids, dtype=np.int64)
+    indptr = np.asarray(spatial_weights.indptr, dtype=np.int64)
+    indices = np.asarray(spatial_weights.indices)
+    weights = np.asarray(spatial_weights.weights, dtype=np.float64)
+    neighbor_counts = np.diff(indptr)
+    fixed_weights = bool(len(weights)) and bool(np.all(weights == np.repeat(
+        weights[indptr[:-1][neighbor_counts > 0]], neighbor_counts[neighbor_counts > 0])))
+    header = OrderedDict((key, "#") for key in SWM_HEADER_KEYS)
+    header.update(spatial_weights.header or {})
+    header.update([("VERSION", "10.1"), ("UNIQUEID", spatial_weights.unique_id_field),
+                   ("FIXEDWEIGHTS", str(fixed_weights))])
+    run_starts = np.flatnonzero(np.r_[True, neighbor_counts[1:] != neighbor_counts[:-1]])
+    run_ends = np.r_[run_starts[1:], len(ids)]
+    with open(spatial_weights_matrix, "wb") as swm_file:
+        swm_file.write((";".join("{0}@{1}".format(key, value) for key, value in header.items()) + "\n").encode(
+            "utf-8"))
+        swm_file.write(struct.pack("<ii", len(ids), int(bool(spatial_weights.row_standardized))))
+        for run_start, run_end in zip(run_starts, run_ends):
+            neighbor_count = int(neighbor_counts[run_start])
+            if neighbor_count:
+                weight_count = 1 if fixed_weights else neighbor_count
+                rows = np.empty(run_end - run_start, dtype=[("id", "<i4"), ("count", "<i4"),
+                                                            ("indices", "<i4", (neighbor_count,)),
+                                                            ("weights", "<f8", (weight_count,)), ("sum", "<f8")])
+                edges = slice(indptr[run_start], indptr[run_end])
+                row_weights = weights[edges].reshape(-1, neighbor_count)
+                rows["indices"] = indices[edges].reshape(-1, neighbor_count)
+                rows["weights"] = row_weights[:, :weight_count]
+                rows["sum"] = row_weights.sum(axis=1)
+            else:
+                rows = np.empty(run_end - run_start, dtype=[("id", "<i4"), ("count", "<i4")])
+            rows["id"] = ids[run_start:run_end]
+            rows["count"] = neighbor_count
+            swm_file.write(rows.tobytes())
+
+
+def spatial_weights_from_pairs(ids, rows, columns, weights=None, row_standardization=True, unique_id_field="UID",
+                               header=None):
+    """Packs (feature, neighbor) pairs into the CSR spatial weights read from and written to .swm files.
+    :param - ids - unique ids of the features, the values of the unique id field
+    :param - rows - positions of the features in ids
+    :param - columns - positions of their neighbors in ids
+    :param - weights - weight of every pair, None weighs every pair by 1
+    :param - row_standardization - divide the weights of every feature by their sum
+    :param - unique_id_field - name of the unique id field
+    :param - header - dictionary of swm header entries
+    :returns - SpatialWeights namedtuple"""
+    ids = np.asarray(ids, dtype=np.int64)
+    weights = np.ones(len(rows)) if weights is None else np.asarray(weights, dtype=np.float64)
+    order = np.lexsort((columns, rows))
+    rows, columns, weights = np.asarray(rows)[order], np.asarray(columns)[order], weights[order]
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+    if row_standardization and len(weights):
+        row_sums = np.bincount(rows, weights, len(ids))
+        weights = weights / row_sums[rows]
+    return SpatialWeights(unique_id_field, ids, indptr, ids[columns], weights, bool(row_standardization),
+                          dict(header or {}))
+
+
+def distance_weights(xy, distance_threshold=None, number_of_neighbors=None, inverse_distance=False, exponent=1.0,
+                     minimum_distance=1e-9):
+    """Finds the neighbor pairs and weights of distance based spatial weights with a KD-tree. Neighbors are the
+    features within the distance threshold (distance band) and the number_of_neighbors nearest features, so like
+    Generate Spatial Weights Matrix the number of neighbors is the minimum number of neighbors of a distance band and
+    the only limit of k nearest neighbors. Pairs weigh 1, or 1 / distance ^ exponent with inverse distance weights,
+    where distances below minimum_distance are raised to it so coincident features stay finite.
+    :param - xy - n x 2 coordinates of the features (points or centroids)
+    :param - distance_threshold - distance band in dataset units
+    :param - number_of_neighbors - number of nearest neighbors
+    :param - inverse_distance - weigh the pairs by inverse distance
+    :param - exponent - exponent of the inverse distance weights
+    :param - minimum_distance - smallest distance of the inverse distance weights
+    :returns - tuple of (row position array, neighbor position array, weight array)"""
+    if distance_threshold is None and not number_of_neighbors:
+        raise ValueError("Distance based spatial weights require a distance threshold or a number of neighbors.")
+    tree = cKDTree(xy)
+    rows, columns = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if distance_threshold is not None:
+        pairs = tree.query_pairs(distance_threshold, output_type="ndarray").astype(np.int64)
+        rows, columns = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+    neighbor_count = min(int(number_of_neighbors or 0), len(xy) - 1)
+    if neighbor_count > 0:
+        distances, nearest = tree.query(xy, k=neighbor_count + 1)
+        nearest_rows = np.repeat(np.arange(len(xy)), neighbor_count + 1).reshape(nearest.shape)
+        neighbors = nearest != nearest_rows
+        neighbors[:, -1] &= neighbors.sum(axis=1) <= neighbor_count  # Coincident features may push self last
+        pair_keys = np.unique(np.concatenate([rows * len(xy) + columns,
+                                              nearest_rows[neighbors] * len(xy) + nearest[neighbors]]))
+        rows, columns = pair_keys // len(xy), pair_keys % len(xy)
+    distances = np.hypot(*(xy[rows] - xy[columns]).T)
+    weights = np.maximum(distances, minimum_distance) ** -float(exponent) if inverse_distance else \
+        np.ones(len(rows))
+    return rows, columns, weights
+
+
+def contiguity_weights(geometries, contiguity="QUEEN", tolerance=0.0):
+    """Finds the neighbor pairs of polygon contiguity spatial weights by hashing the polygon vertices. Queen
+    neighbors share at least one vertex and rook neighbors share at least one edge (two consecutive vertices), so
+    shared boundaries must be digitized with the same vertices, as in topologically clean polygon layers.
+    :param - geometries - numpy array of shapely (multi) polygons
+    :param - contiguity - "QUEEN" (edges and corners) or "ROOK" (edges only)
+    :param - tolerance - vertices are the same when their coordinates round to the same multiple of this distance, 0
+    only matches identical coordinates
+    :returns - tuple of (row position array, neighbor position array, weight array of ones)"""
+    parts, part_geometries = shapely.get_parts(geometries, return_index=True)
+    rings, ring_parts = shapely.get_rings(parts, return_index=True)
+    coordinates, vertex_rings = shapely.get_coordinates(rings, return_index=True)
+    vertex_keys = np.round(coordinates / float(tolerance)) if tolerance else coordinates
+    vertex_keys = np.unique(vertex_keys, axis=0, return_inverse=True)[1].ravel()
+    vertex_geometries = part_geometries[ring_parts[vertex_rings]]
+    if str(contiguity).upper() == "ROOK":
+        same_ring = vertex_rings[1:] == vertex_rings[:-1]
+        edges = np.sort(np.column_stack([vertex_keys[:-1][same_ring], vertex_keys[1:][same_ring]]), axis=1)
+        is_edge = edges[:, 0] != edges[:, 1]
+        item_keys = np.unique(edges[is_edge], axis=0, return_inverse=True)[1].ravel()
+        item_geometries = vertex_geometries[:-1][same_ring][is_edge]
+    else:
+        item_keys, item_geometries = vertex_keys, vertex_geometries
+    incidence = sparse.csr_matrix((np.ones(len(item_keys)), (item_geometries, item_keys)),
+                                  shape=(len(geometries), int(item_keys.max()) + 1 if len(item_keys) else 0))
+    adjacency = incidence.dot(incidence.T).tocoo()
+    neighbors = adjacency.row != adjacency.col
+    return adjacency.row[neighbors], adjacency.col[neighbors], np.ones(int(neighbors.sum()))
+
+
+def build_spatial_weights(in_fc, unique_id_field, conceptualization="CONTIGUITY_EDGES_CORNERS",
+                          distance_threshold=None, number_of_neighbors=None, exponent=1.0, row_standardization=True,
+                          tolerance=0.0, backend=None):
+    """Builds spatial weights of a feature class in memory, in the CSR form read_swm returns, so the neighborhood
+    statistics can run without a .swm file and write_swm can save them. The conceptualizations follow Generate
+    Spatial Weights Matrix: FIXED_DISTANCE (distance band), INVERSE_DISTANCE (inverse distance within the distance
+    band), K_NEAREST_NEIGHBORS, CONTIGUITY_EDGES_ONLY (rook), and CONTIGUITY_EDGES_CORNERS (queen). Distances are
+    planar between feature centroids.
+    :param - in_fc - input feature class or layer
+    :param - unique_id_field - integer field identifying the features in the weights
+    :param - conceptualization - conceptualization of the spatial relationships, see above
+    :param - distance_threshold - distance band of FIXED_DISTANCE and INVERSE_DISTANCE, in dataset units unless it
+    carries a unit
+    :param - number_of_neighbors - number of neighbors of K_NEAREST_NEIGHBORS, and the minimum number of neighbors
+    of FIXED_DISTANCE and INVERSE_DISTANCE
+    :param - exponent - exponent of the INVERSE_DISTANCE weights
+    :param - row_standardization - divide the weights of every feature by their sum
+    :param - tolerance - vertex tolerance of the contiguity conceptualizations, see contiguity_weights
+    :param - backend - I/O backend, see get_backend
+    :returns - SpatialWeights namedtuple"""
+    backend = get_backend(in_fc, backend)
+    conceptualization = str(conceptualization).upper()
+    if conceptualization not in SWM_WEIGHT_TYPES:
+        raise ValueError("Unknown conceptualization {0}, use one of {1}.".format(
+            conceptualization, ", ".join(sorted(SWM_WEIGHT_TYPES))))
+    spatial_reference = backend.spatial_reference(in_fc)
+    threshold = linear_unit_to_dataset_units(distance_threshold, spatial_reference)
+    fields = dict((field.upper(), field) for field in backend.list_fields(in_fc))
+    if str(unique_id_field).upper() not in fields:
+        raise ValueError("The unique id field {0} does not exist in {1}.".format(unique_id_field, in_fc))
+    id_field = fields[str(unique_id_field).upper()]
+    id_table = backend.read_table(in_fc, [id_field])
+    if conceptualization.startswith("CONTIGUITY"):
+        oids, geometries = backend.read_geometries(in_fc)
+        rows, columns, weights = contiguity_weights(geometries, "ROOK" if conceptualization ==
+                                                    "CONTIGUITY_EDGES_ONLY" else "QUEEN",
+                                                    linear_unit_to_dataset_units(tolerance, spatial_reference))
+    else:
+        if conceptualization == "K_NEAREST_NEIGHBORS":
+            if not number_of_neighbors:
+                raise ValueError("K_NEAREST_NEIGHBORS requires a number of neighbors.")
+            threshold = None
+        elif threshold is None:
+            raise ValueError("{0} requires a distance threshold.".format(conceptualization))
+        oids, xy = backend.read_points(in_fc)
+        rows, columns, weights = distance_weights(xy, threshold, number_of_neighbors,
+                                                  conceptualization == "INVERSE_DISTANCE", exponent)
+    ids = id_table[id_field].reindex(oids).to_numpy()
+    if pd.isnull(ids).any() or len(np.unique(ids)) != len(ids):
+        raise ValueError("The unique id field {0} must hold a unique integer for every feature.".format(
+            unique_id_field))
+    header = {"SPATIALREFNAME": spatial_reference.name, "INPUTFC": str(in_fc),
+              "WTYPE": str(SWM_WEIGHT_TYPES[conceptualization]), "DISTANCEMETHOD": "EUCLIDEAN",
+              "EXPONENT": str(exponent) if conceptualization == "INVERSE_DISTANCE" else "#",
+              "THRESHOLD": "{0:f}".format(threshold) if threshold is not None else "#",
+              "NUMNEIGHS": str(int(number_of_neighbors or 0))}
+    arc_print("Built {0} spatial weights with {1} neighbor pairs for {2} features.".format(
+        conceptualization, len(rows), len(ids)))
+    return spatial_weights_from_pairs(ids.astype(np.int64), rows, columns, weights, row_standardization, id_field,
+                                      header)
+
+
+def swm_to_dataframe(spatial_weights):
+    """Converts spatial weights read with read_swm into the long edge list produced by the Convert Spatial Weights
+    Matrix to Table tool, with one row per (unique id, neighbor id, weight).
+    :param - spatial_weights - SpatialWeights namedtuple
+    :returns - pandas.DataFrame with the unique id field, NID, and WEIGHT columns"""
+    return pd.DataFrame({str(spatial_weights.unique_id_field).upper():
+                             np.repeat(spatial_weights.ids, np.diff(spatial_weights.indptr)),
+                         "NID": spatial_weights.indices, "WEIGHT": spatial_weights.weights})
+
+
+def spatial_weights_to_sparse(spatial_weights, row_ids):
+    """Builds a scipy.sparse CSR matrix W from spatial weights, with rows and columns in the order of the passed
+    unique ids. W has one extra column that collects edges to neighbors missing from row_ids, so multiplying it with
+    a value block whose last row is null keeps the weights of those neighbors in the row sums.
+    :param - spatial_weights - SpatialWeights namedtuple returned by read_swm
+    :param - row_ids - unique id values in the row order of the value block
+    :returns - scipy.sparse.csr_matrix of shape (len(row_ids), len(row_ids) + 1)"""
+    row_count = len(row_ids)
+    id_index = pd.Index(row_ids)
+    edge_rows = np.repeat(id_index.get_indexer(spatial_weights.ids), np.diff(spatial_weights.indptr))
+    edge_columns = id_index.get_indexer(spatial_weights.indices)
+    edge_columns[edge_columns < 0] = row_count
+    known_rows = edge_rows >= 0
+    return sparse.csr_matrix((spatial_weights.weights[known_rows], (edge_rows[known_rows], edge_columns[known_rows])),
+                             shape=(row_count, row_count + 1))
+
+
+def sparse_row_reduce(weights_matrix, edge_values, reduce_function, chunk_edges=10000000):
+    """Reduces the values of every edge of a CSR matrix to one value per row (for example np.fmin or np.fmax),
+    processing blocks of rows with at most chunk_edges edges at a time. Rows without edges are NaN.
+    :param - weights_matrix - scipy.sparse.csr_matrix
+    :param - edge_values - function returning the edge values for a slice of the matrix indices and data
+    :param - reduce_function - numpy ufunc with a reduceat method
+    :param - chunk_edges - maximum number of edges reduced at a time
+    :returns - float64 numpy array with one value per row"""
+    indptr = weights_matrix.indptr
+    row_count = len(indptr) - 1
+    reduced = np.full(row_count, np.nan)
+    start_row = 0
+    while start_row < row_count:
+        end_row = max(int(np.searchsorted(indptr, indptr[start_row] + chunk_edges, side="right")) - 1,
+                      start_row + 1)
+        end_row = min(end_row, row_count)
+        start_edge, end_edge = indptr[start_row], indptr[end_row]
+        row_starts = indptr[start_row:end_row] - start_edge
+        rows_with_edges = np.flatnonzero(np.diff(indptr[start_row:end_row + 1]))
+        if len(rows_with_edges):
+            block_values = edge_values(weights_matrix.indices[start_edge:end_edge],
+                                       weights_matrix.data[start_edge:end_edge])
+            reduced[start_row + rows_with_edges] = reduce_function.reduceat(block_values, row_starts[rows_with_edges])
+        start_row = end_row
+    return reduced
+
+
+def sparse_product_powers(weights_matrix, block, max_order=1):
+    """Yields W^order . block for orders 1 through max_order, carrying each product forward so that every order
+    costs one sparse product and higher order weights are never materialized. The block holds the extra null row of
+    spatial_weights_to_sparse, and later products pad it with zeros, so neighbors missing from the rows only count
+    in the first step.
+    :param - weights_matrix - scipy.sparse.csr_matrix returned by spatial_weights_to_sparse
+    :param - block - (rows + 1) x columns float array
+    :param - max_order - highest order yielded
+    :returns - generator of rows x columns float arrays"""
+    result = weights_matrix.dot(block)
+    yield result
+    for order in range(2, max_order + 1):
+        result = weights_matrix.dot(np.vstack([result, np.zeros((1, result.shape[1]))]))
+        yield result
+
+
+def sparse_neighborhood_stats(spatial_weights, row_ids, value_block, fields, statistics_to_compute=("sum", "mean",
+                                                                                                    "std"),
+                              use_weights=True, weight_field="WEIGHT", lag_order=1):
+    """Computes neighborhood statistics as sparse products of the spatial weights matrix W with the field values,
+    so memory scales with the number of edges plus rows x fields. Weighted statistics use W (sum = W.X,
+    mean = W.X / W.1, std from W.X^2), and non-weighted statistics use the binary neighbor matrix and match pandas
+    (sum, mean, and the sample standard deviation of the non-null neighbor values). Weighted results also summarize
+    the weights themselves under the weight field name, like the pandas engine. Supported statistics are "sum",
+    "mean", "std", "count", "min", "max", and "lag", the spatial lag with row standardized weights. Higher orders
+    use the order-th power of the weights (W^2 for second order lags), where count is the number of neighbor paths,
+    and min, max, and the weight summaries are only computed for the first order. The weights are converted once
+    and every order is one more sparse product of the previous order's blocks.
+    :param - spatial_weights - SpatialWeights namedtuple returned by read_swm
+    :param - row_ids - unique id values of the features, one per value block row
+    :param - value_block - rows x fields float array of field values, NaN marks nulls
+    :param - fields - field names of the value block columns
+    :param - statistics_to_compute - list of statistics to compute
+    :param - use_weights - boolean indicating if weights are used in SWM
+    :param - weight_field - name used for the statistics of the weights
+    :param - lag_order - statistics are computed for neighborhood orders 1 through lag_order
+    :returns - list of pandas.DataFrames, one per order, indexed by unique id with columns named "w_<stat>_<field>"
+    if weighted or "<field>_<stat>" otherwise, for the features that have neighbors"""
+    weights_matrix = spatial_weights_to_sparse(spatial_weights, row_ids)
+    binary_matrix = weights_matrix.copy()
+    binary_matrix.data = np.ones_like(binary_matrix.data)
+    stat_matrix = weights_matrix if use_weights else binary_matrix
+    values = np.vstack([np.asarray(value_block, dtype=np.float64).reshape(len(row_ids), len(fields)),
+                        np.full((1, len(fields)), np.nan)])  # Null row for neighbors missing from row_ids
+    not_null = ~np.isnan(values)
+    filled_values = np.where(not_null, values, 0.0)
+    ones = np.ones((len(row_ids) + 1, 1))
+    first_order_edge_counts = np.diff(weights_matrix.indptr).astype(np.float64)
+    skipped_statistics = [i for i in statistics_to_compute if i in ["min", "max"]] if lag_order > 1 else []
+    if skipped_statistics:
+        arc_print("The {0} statistics are only computed for first order neighbors.".format(
+            ", ".join(skipped_statistics)))
+    # Every product sequence carries its previous order forward, W^(o-1).X, W^(o-1).X^2, and W^(o-1).1
+    products = OrderedDict([("weight_sums", sparse_product_powers(weights_matrix, ones, lag_order)),
+                            ("counts", sparse_product_powers(binary_matrix, not_null.astype(np.float64),
+                                                             lag_order)),
+                            ("sums", sparse_product_powers(stat_matrix, filled_values, lag_order))])
+    if lag_order > 1:
+        products["edge_counts"] = sparse_product_powers(binary_matrix, ones, lag_order)
+    if "std" in statistics_to_compute:
+        products["squares"] = sparse_product_powers(stat_matrix, filled_values ** 2, lag_order)
+    if "lag" in statistics_to_compute and not use_weights:
+        products["lags"] = sparse_product_powers(weights_matrix, filled_values, lag_order)
+    order_frames = []
+    for order in range(1, lag_order + 1):
+        blocks = dict((name, next(product_powers)) for name, product_powers in products.items())
+        weight_sums = blocks["weight_sums"].ravel()
+        edge_counts = first_order_edge_counts if order == 1 else blocks["edge_counts"].ravel()
+        order_statistics = [i for i in statistics_to_compute if order == 1 or i not in skipped_statistics]
+        stats = OrderedDict()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            counts, sums = blocks["counts"], blocks["sums"]
+            denominators = weight_sums[:, None] if use_weights else counts
+            means = sums / denominators
+            stats["count"] = counts
+            stats["sum"] = sums
+            stats["mean"] = means
+            if "std" in order_statistics:
+                squares = blocks["squares"]
+                if use_weights:
+                    stats["std"] = np.sqrt(np.clip(squares / denominators - means ** 2, 0, None))
+                else:
+                    variance = (squares - counts * means ** 2) / (counts - 1)
+                    stats["std"] = np.where(counts > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+            if "lag" in order_statistics:
+                stats["lag"] = (sums if use_weights else blocks["lags"]) / weight_sums[:, None]
+            for statistic, reduce_function in [("min", np.fmin), ("max", np.fmax)]:
+                if statistic in order_statistics:
+                    stats[statistic] = np.column_stack(
+                        [sparse_row_reduce(weights_matrix, lambda indices, data: values[indices, column],
+                                           reduce_function)
+                         for column in range(len(fields))]).reshape(len(row_ids), len(fields))
+            if use_weights and order == 1:  # Summarize the weights as if they were another neighbor field
+                weight_power_sums = [np.bincount(np.repeat(np.arange(len(row_ids)), edge_counts.astype(np.int64)),
+                                                 weights_matrix.data ** power, len(row_ids)) for power in [2, 3]]
+                weight_stats = {"count": edge_counts, "sum": weight_power_sums[0],
+                                "mean": weight_power_sums[0] / weight_sums, "lag": weight_power_sums[0] / weight_sums,
+                                "std": np.sqrt(np.clip(weight_power_sums[1] / weight_sums -
+                                                       (weight_power_sums[0] / weight_sums) ** 2, 0, None)),
+                                "min": sparse_row_reduce(weights_matrix, lambda indices, data: data, np.fmin),
+                                "max": sparse_row_reduce(weights_matrix, lambda indices, data: data, np.fmax)}
+        has_neighbors = edge_counts > 0
+        stats_df = pd.DataFrame(index=pd.Index(row_ids)[has_neighbors])
+        if use_weights:
+            for statistic in order_statistics:
+                for column, field in enumerate(fields):
+                    stats_df["w_{0}_{1}".format(statistic, field)] = stats[statistic][has_neighbors, column]
+                if order == 1:
+                    stats_df["w_{0}_{1}".format(statistic, weight_field)] = weight_stats[statistic][has_neighbors]
+        else:
+            for column, field in enumerate(fields):
+                for statistic in order_statistics:
+                    stats_df["{0}_{1}".format(field, statistic)] = stats[statistic][has_neighbors, column]
+        order_frames.append(stats_df)
+    return order_frames
+
+
+def split_dataset_path(dataset):
+    """Splits a dataset path into the path of the file or workspace and the layer name, so that
+    "folder/data.gpkg/layer" and "folder/data.gdb/layer" follow the ArcGIS workspace/name convention.
+    :param - dataset - dataset path
+    :returns - tuple of (path, layer name or None)"""
+    dataset = str(dataset)
+    parent, base_name = os.path.split(dataset)
+    if os.path.splitext(parent)[1].lower() in [".gpkg", ".gdb"]:
+        return parent, base_name
+    return dataset, None
+
+
+def dataset_format(dataset):
+    """Returns the open source format of a dataset path: an OGR driver name, "Parquet", or None if unknown.
+    :param - dataset - dataset path
+    :returns - string or None"""
+    path, layer = split_dataset_path(dataset)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return "Parquet"
+    return OGR_DATASET_DRIVERS.get(extension)
+
+
+def crs_to_spatial_reference(crs):
+    """Describes a coordinate reference system (authority string, WKT, or PROJJSON dictionary) with the attributes the
+    tools read from an arcpy spatial reference. Linear units are only known if pyproj is installed.
+    :param - crs - coordinate reference system definition or None
+    :returns - DatasetSpatialReference namedtuple"""
+    if crs is None:
+        return DatasetSpatialReference("Unknown", None, None, "Unknown")
+    if pyproj is None:
+        return DatasetSpatialReference(str(crs), crs, None, "Unknown")
+    projection = pyproj.CRS.from_user_input(crs)
+    if projection.is_geographic:
+        return DatasetSpatialReference(projection.name, crs, None, "Geographic")
+    return DatasetSpatialReference(projection.name, crs, projection.axis_info[0].unit_conversion_factor, "Projected")
+
+
+def project_xy(xy, from_spatial_reference, to_spatial_reference):
+    """Projects coordinates between two dataset spatial references with pyproj. Coordinates are returned unchanged if
+    the spatial references are equal or unknown.
+    :param - xy - n x 2 coordinate array
+    :param - from_spatial_reference - DatasetSpatialReference of the coordinates
+    :param - to_spatial_reference - DatasetSpatialReference to project into
+    :returns - n x 2 coordinate array"""
+    if to_spatial_reference is None or from_spatial_reference.crs is None or to_spatial_reference.crs is None or \
+            from_spatial_reference.crs == to_spatial_reference.crs:
+        return xy
+    if pyproj is None:
+        raise ValueError("Projecting from {0} to {1} requires pyproj.".format(from_spatial_reference.name,
+                                                                             to_spatial_reference.name))
+    transformer = pyproj.Transformer.from_crs(from_spatial_reference.crs, to_spatial_reference.crs, always_xy=True)
+    x, y = transformer.transform(xy[:, 0], xy[:, 1])
+    return np.column_stack([x, y])
+
+
+def project_geometries(geometries, from_spatial_reference, to_spatial_reference):
+    """Projects an array of shapely geometries between two dataset spatial references with pyproj, the way
+    project_xy projects coordinates.
+    :param - geometries - numpy array of shapely geometries
+    :param - from_spatial_reference - DatasetSpatialReference of the geometries
+    :param - to_spatial_reference - DatasetSpatialReference to project into
+    :returns - numpy array of shapely geometries"""
+    if to_spatial_reference is None or from_spatial_reference.crs is None or to_spatial_reference.crs is None or \
+            from_spatial_reference.crs == to_spatial_reference.crs:
+        return geometries
+    return shapely.transform(geometries, lambda coordinates: project_xy(coordinates, from_spatial_reference,
+                                                                        to_spatial_reference))
+
+
+def transform_bbox(bbox, from_spatial_reference, to_spatial_reference):
+    """Returns the bounding box, in another spatial reference, of a bounding box whose edges are densified before they
+    are projected, so it contains every coordinate of the original box.
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple
+    :param - from_spatial_reference - DatasetSpatialReference of the bounding box
+    :param - to_spatial_reference - DatasetSpatialReference to project into
+    :returns - (xmin, ymin, xmax, ymax) tuple"""
+    if to_spatial_reference is None or from_spatial_reference.crs is None or to_spatial_reference.crs is None or \
+            from_spatial_reference.crs == to_spatial_reference.crs:
+        return tuple(bbox)
+    if pyproj is None:
+        raise ValueError("Projecting from {0} to {1} requires pyproj.".format(from_spatial_reference.name,
+                                                                             to_spatial_reference.name))
+    transformer = pyproj.Transformer.from_crs(from_spatial_reference.crs, to_spatial_reference.crs, always_xy=True)
+    return tuple(transformer.transform_bounds(*bbox, densify_pts=21))
+
+
+def geometries_to_xy(geometries):
+    """Returns the x/y coordinates of an array of shapely geometries, using the centroid of non-point geometries
+    the way the SHAPE@X and SHAPE@Y cursor tokens do.
+    :param - geometries - numpy array of shapely geometries without nulls
+    :returns - n x 2 coordinate array"""
+    points = np.where(shapely.get_type_id(geometries) == 0, geometries, shapely.centroid(geometries))
+    return np.column_stack([shapely.get_x(points), shapely.get_y(points)]).astype(np.float64).reshape(-1, 2)
+
+
+def read_open_dataset(dataset, columns=None, query="", read_geometry=True, bbox=None):
+    """Reads an open source dataset (GeoPackage, shapefile, file geodatabase, or GeoParquet) into numpy arrays.
+    Object ids are OGR feature ids, or row numbers for GeoParquet.
+    :param - dataset - dataset path, with "file.gpkg/layer" selecting a layer
+    :param - columns - list of fields to read, None reads all fields
+    :param - query - sql where clause, not supported for GeoParquet
+    :param - read_geometry - if true, read the geometries as shapely objects
+    :param - bbox - optional (xmin, ymin, xmax, ymax) tuple in the dataset crs, only features intersecting it are read.
+    GeoParquet files are streamed one record batch at a time and filtered on the geometry bounds.
+    :returns - tuple of (object id array, geometry array or None, ordered dictionary of field arrays, crs)"""
+    path, layer = split_dataset_path(dataset)
+    if dataset_format(dataset) == "Parquet":
+        if query:
+            raise ValueError("Queries are not supported for GeoParquet datasets.")
+        geo_metadata = parquet_geo_metadata(path)
+        geometry_column = geo_metadata["primary_column"]
+        field_names = [name for name in pq.read_schema(path).names if name != geometry_column] \
+            if columns is None else list(columns)
+        crs = geo_metadata["columns"][geometry_column].get("crs", "OGC:CRS84")
+        if bbox is not None:
+            return read_parquet_bbox(path, field_names, geometry_column, bbox, read_geometry) + (crs,)
+        table = pq.read_table(path, columns=field_names + ([geometry_column] if read_geometry else []))
+        fields = OrderedDict((name, table.column(name).to_numpy(zero_copy_only=False)) for name in field_names)
+        geometries = shapely.from_wkb(table.column(geometry_column).to_numpy(zero_copy_only=False)) \
+            if read_geometry else None
+        return np.arange(table.num_rows, dtype=np.int64), geometries, fields, crs
+    meta, fids, geometries, field_data = pyogrio.raw.read(path, layer=layer, columns=columns, where=query or None,
+                                                          read_geometry=read_geometry, return_fids=True,
+                                                          bbox=tuple(bbox) if bbox is not None else None)
+    fields = OrderedDict(zip(meta["fields"], field_data))
+    geometries = shapely.from_wkb(geometries) if read_geometry else None
+    return np.asarray(fids, dtype=np.int64), geometries, fields, meta["crs"]
+
+
+def read_parquet_bbox(path, field_names, geometry_column, bbox, read_geometry=True, batch_size=65536):
+    """Streams a GeoParquet file one record batch at a time and keeps the rows whose geometry bounds intersect a
+    bounding box, so memory is bounded by the batch size plus the rows kept.
+    :param - path - parquet file path
+    :param - field_names - fields to read
+    :param - geometry_column - name of the WKB geometry column
+    :param - bbox - (xmin, ymin, xmax, ymax) tuple in the crs of the file
+    :param - read_geometry - if true, return the geometries of the rows kept
+    :param - batch_size - number of rows decoded at a time
+    :returns - tuple of (row number array, geometry array or None, ordered dictionary of field arrays)"""
+    oid_chunks, geometry_chunks = [], []
+    field_chunks = OrderedDict((name, []) for name in field_names)
+    row_offset = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=field_names + [geometry_column]):
+        geometries = shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False))
+        bounds = shapely.bounds(geometries)
+        inside = (bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) & (bounds[:, 1] <= bbox[3]) & \
+                 (bounds[:, 3] >= bbox[1])
+        oid_chunks.append(np.flatnonzero(inside) + row_offset)
+        geometry_chunks.append(geometries[inside])
+        for name in field_names:
+            field_chunks[name].append(batch.column(name).to_numpy(zero_copy_only=False)[inside])
+        row_offset += batch.num_rows
+    oids = np.concatenate(oid_chunks).astype(np.int64) if oid_chunks else np.empty(0, dtype=np.int64)
+    geometries = (np.concatenate(geometry_chunks) if geometry_chunks else np.empty(0, dtype=object)) \
+        if read_geometry else None
+    fields = OrderedDict((name, np.concatenate(chunks) if chunks else np.empty(0)) for name, chunks in
+                         field_chunks.items())
+    return oids, geometries, fields
+
+
+def write_open_dataset(dataset, geometries, fields, crs, geometry_type):
+    """Writes numpy field arrays and shapely geometries to an open source dataset, replacing the dataset or layer.
+    :param - dataset - output dataset path, with "file.gpkg/layer" selecting a layer
+    :param - geometries - numpy array of shapely geometries
+    :param - fields - ordered dictionary of field arrays
+    :param - crs - coordinate reference system of the geometries
+    :param - geometry_type - geometry type name such as "Point" or "MultiPolygon" """
+    path, layer = split_dataset_path(dataset)
+    output_format = dataset_format(dataset)
+    if output_format == "Parquet":
+        arrays = [pyarrow.array(values) for values in fields.values()] + [pyarrow.array(shapely.to_wkb(geometries))]
+        table = pyarrow.Table.from_arrays(arrays, names=list(fields.keys()) + ["geometry"])
+        geo_metadata = {"version": "1.0.0", "primary_column": "geometry",
+                        "columns": {"geometry": {"encoding": "WKB", "geometry_types": [geometry_type],
+                                                 "crs": pyproj.CRS.from_user_input(crs).to_json_dict()
+                                                 if pyproj is not None and crs is not None else None}}}
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, geo=json.dumps(geo_metadata)))
+        pq.write_table(table, path)
+        return
+    if output_format is None:
+        raise ValueError("Can not write {0}, the open source backend writes GeoPackage, shapefile, and GeoParquet "
+                         "datasets.".format(dataset))
+    pyogrio.raw.write(path, shapely.to_wkb(geometries), list(fields.values()), list(fields.keys()), layer=layer,
+                      driver=output_format, crs=crs, geometry_type=geometry_type)
+
+
+def parquet_geo_metadata(path):
+    """Returns the GeoParquet "geo" metadata dictionary of a parquet file.
+    :param - path - parquet file path
+    :returns - dictionary"""
+    metadata = pq.read_schema(path).metadata or {}
+    if b"geo" not in metadata:
+        raise ValueError("{0} is not a GeoParquet file.".format(path))
+    return json.loads(metadata[b"geo"].decode("utf-8"))
+
+
+def geopackage_blob_bounds(blob):
+    """Returns the (minx, miny, maxx, maxy) bounds of a GeoPackage geometry blob, or None if it is empty."""
+    if blob is None or bytearray(blob[3:4])[0] & 0x10:
+        return None
+    envelope_size = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[(bytearray(blob[3:4])[0] >> 1) & 0x07]
+    return shapely.bounds(shapely.from_wkb(bytes(blob[8 + envelope_size:]))).tolist()
+
+
+def register_geopackage_functions(connection):
+    """Registers the spatial SQL functions GeoPackage rtree triggers reference, so a plain sqlite3 connection can
+    update attribute columns of a GeoPackage layer.
+    :param - connection - sqlite3 connection to a GeoPackage"""
+    connection.create_function("ST_IsEmpty", 1, lambda blob: int(geopackage_blob_bounds(blob) is None))
+    for function_name, bound_index in [("ST_MinX", 0), ("ST_MinY", 1), ("ST_MaxX", 2), ("ST_MaxY", 3)]:
+        connection.create_function(function_name, 1, lambda blob, bound_index=bound_index:
+                                   (geopackage_blob_bounds(blob) or [None] * 4)[bound_index])
+
+
+def touch_geopackage_contents(connection, layer):
+    """Sets the gpkg_contents last_change time of a GeoPackage layer that was edited with SQL."""
+    connection.execute("UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') "
+                       "WHERE table_name = ?", (layer,))
+
+
+class ArcpyBackend(object):
+    """I/O backend for ArcGIS feature classes, tables, and layers through arcpy.da and geoprocessing tools."""
+    name = "ARCPY"
+
+    def dataset_name(self, dataset):
+        return str(arcpy.Describe(dataset).name)
+
+    def shape_type(self, dataset):
+        return str(arcpy.Describe(dataset).shapeType)
+
+    def spatial_reference(self, dataset):
+        return arcpy.Describe(dataset).spatialReference
+
+    def extent(self, dataset, spatial_reference=None):
+        extent = arcpy.Describe(dataset).extent
+        if spatial_reference is not None:
+            extent = extent.projectAs(spatial_reference)
+        return extent.XMin, extent.YMin, extent.XMax, extent.YMax
+
+    def feature_count(self, dataset):
+        return int(arcpy.GetCount_management(dataset).getOutput(0))
+
+    def dataset_fingerprint(self, dataset):
+        """Fingerprints the shapefile or file geodatabase holding a feature class. Layers, which can carry
+        selections and definition queries, and enterprise geodatabases return None and are not cached."""
+        desc = arcpy.Describe(dataset)
+        if str(desc.dataType) in ["FeatureLayer", "Layer"]:
+            return None
+        path = str(desc.catalogPath)
+        if os.path.isfile(path):
+            return file_fingerprint(path)
+        while path and os.path.dirname(path) != path:
+            if path.lower().endswith(".gdb") and os.path.isdir(path):
+                return file_fingerprint(path)
+            path = os.path.dirname(path)
+        return None
+
+    def unique_values(self, dataset, field, filter_falsy=False):
+        return arc_unique_values(dataset, field, filter_falsy)
+
+    def geographic_coordinate_system(self, spatial_reference):
+        geographic_reference = spatial_reference.GCS
+        if geographic_reference is None or not geographic_reference.semiMajorAxis:
+            raise ValueError("The GEODESIC method requires a known coordinate system.")
+        return geographic_reference, (geographic_reference.semiMajorAxis, geographic_reference.flattening)
+
+    def read_points(self, dataset, query="", spatial_reference=None, bbox=None):
+        return read_point_coordinates(dataset, query, spatial_reference, bbox)
+
+    def read_point_categories(self, dataset, category_field, query="", spatial_reference=None, bbox=None):
+        return read_point_categories(dataset, category_field, query, spatial_reference, bbox)
+
+    def read_geometries(self, dataset, query="", spatial_reference=None):
+        return read_geometries(dataset, query, spatial_reference)
+
+    def read_geometry_categories(self, dataset, category_field, query="", spatial_reference=None):
+        return read_geometries(dataset, query, spatial_reference, category_field)
+
+    def read_numeric_block(self, dataset, fields, query=""):
+        return read_numeric_block(dataset, fields, query)
+
+    def read_table(self, dataset, fields=None, query=""):
+        return arcgis_table_to_df(dataset, fields, query)
+
+    def list_fields(self, dataset):
+        return [str(field.name) for field in arcpy.ListFields(dataset)]
+
+    def field_exist(self, dataset, field_name):
+        return field_exist(dataset, field_name)
+
+    def validate_field_name(self, field_name, dataset):
+        return arcpy.ValidateFieldName(field_name, os.path.dirname(arcpy.Describe(dataset).catalogPath))
+
+    def add_field(self, dataset, field_name, field_type="DOUBLE", field_alias="#"):
+        add_new_field(dataset, field_name, field_type, field_alias=field_alias)
+
+    def add_fields(self, dataset, field_descriptions):
+        add_new_fields(dataset, field_descriptions)
+
+    def supports_incremental_writes(self, dataset):
+        return True
+
+    def write_columns(self, dataset, oids, columns, fill_values=None, bbox=None):
+        return write_columns(dataset, oids, columns, fill_values, bbox=bbox)
+
+    def copy_dataset(self, dataset, output_dataset):
+        arcpy.CopyFeatures_management(dataset, output_dataset)
+
+
+class OpenSourceBackend(object):
+    """I/O backend for GeoPackage, shapefile, and GeoParquet datasets that does not require arcpy. Geometries and
+    attributes are read with pyogrio, shapely, and pyarrow, and file geodatabases can be read through GDAL.
+    GeoPackage fields are added and updated in place with SQL. Fields added to shapefiles and GeoParquet files are
+    created when columns are written to them, since those formats are rewritten as a whole."""
+    name = "OPEN"
+
+    def __init__(self):
+        if pyogrio is None or shapely is None:
+            raise ImportError("The open source backend requires pyogrio and shapely.")
+        self.pending_fields = {}
+
+    def dataset_name(self, dataset):
+        path, layer = split_dataset_path(dataset)
+        return layer or os.path.splitext(os.path.basename(path))[0]
+
+    def shape_type(self, dataset):
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            geometry_types = parquet_geo_metadata(path)["columns"][parquet_geo_metadata(path)["primary_column"]]. \
+                get("geometry_types") or ["Unknown"]
+            geometry_type = geometry_types[0]
+        else:
+            geometry_type = pyogrio.read_info(path, layer=layer)["geometry_type"]
+        geometry_type = str(geometry_type).replace(" Z", "").replace(" M", "")
+        return {"Point": "Point", "MultiPoint": "Multipoint", "LineString": "Polyline",
+                "MultiLineString": "Polyline", "Polygon": "Polygon", "MultiPolygon": "Polygon"}.get(geometry_type,
+                                                                                                 geometry_type)
+
+    def spatial_reference(self, dataset):
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            geo_metadata = parquet_geo_metadata(path)
+            return crs_to_spatial_reference(geo_metadata["columns"][geo_metadata["primary_column"]].get(
+                "crs", "OGC:CRS84"))
+        return crs_to_spatial_reference(pyogrio.read_info(path, layer=layer)["crs"])
+
+    def extent(self, dataset, spatial_reference=None):
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            geo_metadata = parquet_geo_metadata(path)
+            bbox = geo_metadata["columns"][geo_metadata["primary_column"]].get("bbox")
+            if bbox is None:
+                oids, geometries, fields, crs = read_open_dataset(dataset, [])
+                bbox = shapely.total_bounds(geometries)
+        else:
+            bbox = pyogrio.read_info(path, layer=layer, force_total_bounds=True)["total_bounds"]
+        return transform_bbox([float(value) for value in bbox][:4], self.spatial_reference(dataset),
+                              spatial_reference)
+
+    def feature_count(self, dataset):
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            return pq.ParquetFile(path).metadata.num_rows
+        return int(pyogrio.read_info(path, layer=layer, force_feature_count=True)["features"])
+
+    def dataset_fingerprint(self, dataset):
+        """Fingerprints a dataset file. GeoPackage layers are fingerprinted on their own by the last_change time of
+        gpkg_contents, their row count, and a digest of their geometry column, so that writing to another layer of the
+        file does not invalidate them. The digest catches edits that do not update last_change, such as moving
+        features with SQL, but edits to attribute fields alone are only caught through last_change."""
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) != "GPKG" or not os.path.isfile(path):
+            return file_fingerprint(path)
+        layer = layer or pyogrio.list_layers(path)[0][0]
+        with sqlite3.connect(path) as connection:
+            last_change = connection.execute("SELECT last_change FROM gpkg_contents WHERE table_name = ?",
+                                             (layer,)).fetchone()
+            row_count, max_rowid = connection.execute('SELECT count(*), max(rowid) FROM "{0}"'.format(
+                layer)).fetchone()
+            geometry_column = connection.execute("SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",
+                                                 (layer,)).fetchone()
+            digest = hashlib.sha1()
+            if geometry_column:
+                cursor = connection.execute('SELECT rowid, "{0}" FROM "{1}" ORDER BY rowid'.format(
+                    geometry_column[0], layer))
+                rows = cursor.fetchmany(100000)
+                while rows:
+                    for rowid, geometry in rows:
+                        digest.update(str(rowid).encode("ascii"))
+                        digest.update(bytes(geometry or b""))
+                    rows = cursor.fetchmany(100000)
+        return "{0}|{1}|{2}|{3}|{4}".format(layer, last_change[0] if last_change else None, row_count, max_rowid,
+                                            digest.hexdigest())
+
+    def unique_values(self, dataset, field, filter_falsy=False):
+        oids, geometries, fields, crs = read_open_dataset(dataset, [field], read_geometry=False)
+        values = {None if value != value else value for value in fields[field].tolist()}
+        if filter_falsy:
+            return sorted(value for value in values if value)
+        return sorted(value for value in values if value is not None) + ([None] if None in values else [])
+
+    def geographic_coordinate_system(self, spatial_reference):
+        if spatial_reference is None or spatial_reference.crs is None or pyproj is None:
+            raise ValueError("The GEODESIC method requires a known coordinate system and pyproj.")
+        geographic_crs = pyproj.CRS.from_user_input(spatial_reference.crs).geodetic_crs
+        ellipsoid = geographic_crs.ellipsoid
+        flattening = 1 / ellipsoid.inverse_flattening if ellipsoid.inverse_flattening else 0.0
+        return crs_to_spatial_reference(geographic_crs.to_wkt()), (ellipsoid.semi_major_metre, flattening)
+
+    def read_dataset_points(self, dataset, fields, query="", spatial_reference=None, bbox=None):
+        """Reads the object ids, x/y coordinates in spatial_reference, and fields of the features with a geometry,
+        limited to the features inside bbox (in spatial_reference) if it is given."""
+        read_bbox = None
+        if bbox is not None:
+            dataset_spatial_reference = self.spatial_reference(dataset)
+            read_bbox = transform_bbox(bbox, spatial_reference or dataset_spatial_reference, dataset_spatial_reference)
+        oids, geometries, field_data, crs = read_open_dataset(dataset, fields, query, bbox=read_bbox)
+        has_geometry = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        xy = project_xy(geometries_to_xy(geometries[has_geometry]), crs_to_spatial_reference(crs), spatial_reference)
+        in_bbox = bbox_mask(xy, bbox)
+        inside = np.flatnonzero(has_geometry)[in_bbox]
+        return oids[inside], xy[in_bbox], dict((name, values[inside]) for name, values in field_data.items())
+
+    def read_points(self, dataset, query="", spatial_reference=None, bbox=None):
+        oids, xy, fields = self.read_dataset_points(dataset, [], query, spatial_reference, bbox)
+        return oids, xy
+
+    def read_point_categories(self, dataset, category_field, query="", spatial_reference=None, bbox=None):
+        oids, xy, fields = self.read_dataset_points(dataset, [category_field], query, spatial_reference, bbox)
+        categories = np.empty(len(oids), dtype=object)
+        categories[:] = [None if value != value else value for value in fields[category_field]]
+        return oids, xy, categories
+
+    def read_geometries(self, dataset, query="", spatial_reference=None, fields=None):
+        oids, geometries, field_data, crs = read_open_dataset(dataset, fields or [], query)
+        has_geometry = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        geometries = project_geometries(geometries[has_geometry], crs_to_spatial_reference(crs), spatial_reference)
+        if fields is None:
+            return oids[has_geometry], geometries
+        return oids[has_geometry], geometries, dict((name, values[has_geometry]) for name, values in
+                                                    field_data.items())
+
+    def read_geometry_categories(self, dataset, category_field, query="", spatial_reference=None):
+        oids, geometries, fields = self.read_geometries(dataset, query, spatial_reference, [category_field])
+        categories = np.empty(len(oids), dtype=object)
+        categories[:] = [None if value != value else value for value in fields[category_field]]
+        return oids, geometries, categories
+
+    def read_numeric_block(self, dataset, fields, query=""):
+        oids, geometries, field_data, crs = read_open_dataset(dataset, list(fields), query, read_geometry=False)
+        block = np.column_stack([np.asarray(field_data[field], dtype=np.float64) for field in fields]) \
+            if fields else np.empty((len(oids), 0))
+        return oids, block.reshape(len(oids), len(fields))
+
+    def read_table(self, dataset, fields=None, query=""):
+        oids, geometries, field_data, crs = read_open_dataset(dataset, fields, query, read_geometry=False)
+        table_df = pd.DataFrame(field_data, columns=list(field_data.keys()), index=pd.Index(oids, name="OID"))
+        return table_df
+
+    def list_fields(self, dataset):
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            field_names = [name for name in pq.read_schema(path).names
+                           if name != parquet_geo_metadata(path)["primary_column"]]
+        else:
+            field_names = [str(name) for name in pyogrio.read_info(path, layer=layer)["fields"]]
+        return field_names + [name for name in self.pending_fields.get(str(dataset), {}) if name not in field_names]
+
+    def field_exist(self, dataset, field_name):
+        return field_name.strip().upper() in [name.upper() for name in self.list_fields(dataset)]
+
+    def validate_field_name(self, field_name, dataset):
+        valid_name = re.sub(r"[^0-9A-Za-z_]", "_", str(field_name))
+        if valid_name[:1].isdigit():
+            valid_name = "F" + valid_name
+        return valid_name[:10] if dataset_format(dataset) == "ESRI Shapefile" else valid_name
+
+    def add_field(self, dataset, field_name, field_type="DOUBLE", field_alias="#"):
+        if self.field_exist(dataset, field_name):
+            arc_print(field_name + " Exists")
+            return
+        arc_print("Adding " + field_name)
+        self.add_fields(dataset, [(field_name, field_type, field_alias)])
+
+    def add_fields(self, dataset, field_descriptions):
+        """Adds fields that do not exist yet, GeoPackage fields in one transaction."""
+        if dataset_format(dataset) == "GPKG":
+            path, layer = split_dataset_path(dataset)
+            layer = layer or pyogrio.list_layers(path)[0][0]
+            with sqlite3.connect(path) as connection:
+                register_geopackage_functions(connection)
+                for field_name, field_type, field_alias in field_descriptions:
+                    connection.execute('ALTER TABLE "{0}" ADD COLUMN "{1}" {2}'.format(
+                        layer, field_name, SQLITE_FIELD_TYPES.get(str(field_type).upper(), "REAL")))
+                touch_geopackage_contents(connection, layer)
+        else:
+            for field_name, field_type, field_alias in field_descriptions:
+                self.pending_fields.setdefault(str(dataset), OrderedDict())[field_name] = str(field_type).upper()
+
+    def supports_incremental_writes(self, dataset):
+        return dataset_format(dataset) == "GPKG"
+
+    def write_columns(self, dataset, oids, columns, fill_values=None, bbox=None):
+        columns = list(columns)
+        if not columns:
+            return 0
+        if dataset_format(dataset) == "GPKG":
+            return self.update_geopackage(dataset, oids, columns, fill_values)
+        pending_fields = self.pending_fields.pop(str(dataset), OrderedDict())
+        all_oids, geometries, fields, crs = read_open_dataset(dataset)
+        row_positions = pd.Index(all_oids).get_indexer(np.asarray(oids))
+        matched = row_positions >= 0
+        for column_index, (field_name, values) in enumerate(columns):
+            field_type = pending_fields.get(field_name, "DOUBLE")
+            values = np.asarray(values)
+            if values.dtype == object and field_type not in ["TEXT", "DATE"] and \
+                    (field_name not in fields or fields[field_name].dtype.kind in "fiu"):
+                values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            if field_name not in fields:
+                column = np.empty(len(all_oids), dtype=NUMPY_FIELD_TYPES.get(field_type, values.dtype))
+                column[:] = None if column.dtype == object else np.nan if column.dtype.kind == "f" else 0
+                fields[field_name] = column
+            elif fields[field_name].dtype.kind != values.dtype.kind and fields[field_name].dtype != object:
+                fields[field_name] = fields[field_name].astype(np.result_type(fields[field_name], values))
+            if fill_values is not None:
+                fields[field_name][:] = fill_values[column_index]
+            fields[field_name][row_positions[matched]] = values[matched]
+        for field_name, field_type in pending_fields.items():  # Added fields that were never written
+            if field_name not in fields:
+                fields[field_name] = np.full(len(all_oids), np.nan)
+        write_open_dataset(dataset, geometries, fields, crs, self.geometry_type_name(dataset, geometries))
+        return int(matched.sum())
+
+    def update_geopackage(self, dataset, oids, columns, fill_values=None):
+        """Updates GeoPackage columns in place with one executemany UPDATE statement keyed on the feature id."""
+        path, layer = split_dataset_path(dataset)
+        layer_info = pyogrio.read_info(path, layer=layer)
+        layer = layer or layer_info["layer_name"]
+        fid_column = layer_info["fid_column"] or "fid"
+        field_names = [field_name for field_name, values in columns]
+        assignments = ", ".join('"{0}" = ?'.format(field_name) for field_name in field_names)
+        rows = [tuple(None if value != value else value for value in row) + (oid,) for oid, row in
+                zip(np.asarray(oids).tolist(), columns_to_structured_array(oids, columns)[field_names].tolist())]
+        with sqlite3.connect(path) as connection:
+            register_geopackage_functions(connection)
+            if fill_values is not None:
+                connection.execute('UPDATE "{0}" SET {1}'.format(layer, assignments), list(fill_values))
+            connection.executemany('UPDATE "{0}" SET {1} WHERE "{2}" = ?'.format(layer, assignments, fid_column),
+                                   rows)
+            touch_geopackage_contents(connection, layer)
+        return len(rows)
+
+    def geometry_type_name(self, dataset, geometries):
+        """Returns the OGR geometry type name of a dataset, used to write it back in the same format."""
+        path, layer = split_dataset_path(dataset)
+        if dataset_format(dataset) == "Parquet":
+            geo_metadata = parquet_geo_metadata(path)
+            geometry_types = geo_metadata["columns"][geo_metadata["primary_column"]].get("geometry_types")
+            if geometry_types:
+                return geometry_types[0]
+            type_ids = shapely.get_type_id(geometries[~shapely.is_missing(geometries)])
+            return GEOMETRY_TYPE_NAMES[type_ids[0]] if len(type_ids) else "Unknown"
+        return pyogrio.read_info(path, layer=layer)["geometry_type"]
+
+    def copy_dataset(self, dataset, output_dataset):
+        if dataset_format(dataset) == "Parquet" and dataset_format(output_dataset) == "Parquet":
+            shutil.copyfile(split_dataset_path(dataset)[0], split_dataset_path(output_dataset)[0])
+            return
+        oids, geometries, fields, crs = read_open_dataset(dataset)
+        write_open_dataset(output_dataset, geometries, fields, crs, self.geometry_type_name(dataset, geometries))
+
+
+class SchemaManager(object):
+    """Batches the schema changes of a dataset. The field list is read once and cached, new fields are queued, and
+    commit adds all of them with one backend call (one AddFields call with arcpy), so adding n fields no longer
+    lists the fields n times. Used as a context manager, the fields are added when the block exits without an
+    error."""
+
+    def __init__(self, dataset, backend=None):
+        self.dataset = dataset
+        self.backend = get_backend(dataset, backend)
+        self.field_names = dict((field_name.upper(), field_name) for field_name in self.backend.list_fields(dataset))
+        self.pending_fields = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def field_exist(self, field_name):
+        field_name = str(field_name).strip().upper()
+        return field_name in self.field_names or field_name in [name.upper() for name in self.pending_fields]
+
+    def validate_field_name(self, field_name):
+        return self.backend.validate_field_name(field_name, self.dataset)
+
+    def add_field(self, field_name, field_type="DOUBLE", field_alias="#"):
+        """Queues a field unless it exists or is already queued."""
+        if self.field_exist(field_name):
+            arc_print(field_name + " Exists")
+            return
+        self.pending_fields[field_name] = (field_type, field_alias)
+
+    def commit(self):
+        """Adds every queued field in one batch.
+        :returns - number of fields added"""
+        if not self.pending_fields:
+            return 0
+        field_descriptions = [(field_name, field_type, field_alias) for field_name, (field_type, field_alias) in
+                              self.pending_fields.items()]
+        arc_print("Adding {0} fields: {1}".format(len(field_descriptions), ", ".join(self.pending_fields)))
+        self.backend.add_fields(self.dataset, field_descriptions)
+        self.field_names.update((field_name.upper(), field_name) for field_name in self.pending_fields)
+        self.pending_fields = OrderedDict()
+        return len(field_descriptions)
+
+
+class SidecarBackend(object):
+    """Backend wrapper that leaves the schema and rows of the datasets unchanged and writes the result columns to a
+    sidecar table instead, keyed by the object id of every row in an IN_FID column, so wide results (such as the
+    chained near fields) can be joined back on the object id. The sidecar is a Parquet or CSV file, a GeoPackage
+    table, or an ArcGIS table (see write_near_table), and is replaced by every write. Everything else is delegated
+    to the wrapped backend."""
+
+    def __init__(self, backend, sidecar_table):
+        self.backend = backend
+        self.sidecar_table = str(sidecar_table)
+
+    def __getattr__(self, attribute):
+        return getattr(self.backend, attribute)
+
+    def add_field(self, dataset, field_name, field_type="DOUBLE", field_alias="#"):
+        pass
+
+    def add_fields(self, dataset, field_descriptions):
+        pass
+
+    def supports_incremental_writes(self, dataset):
+        return False
+
+    def write_columns(self, dataset, oids, columns, fill_values=None, bbox=None):
+        """Writes the columns of the given object ids to the sidecar table. Rows that are not given, such as
+        features without a geometry, are not in the sidecar."""
+        sidecar_columns = OrderedDict([("IN_FID", np.asarray(oids, dtype=np.int64))])
+        sidecar_columns.update((field_name, np.asarray(values)) for field_name, values in columns)
+        arc_print("Writing {0} columns to sidecar table {1}...".format(len(sidecar_columns) - 1, self.sidecar_table))
+        return write_near_table(self.sidecar_table, [sidecar_columns], self.backend)
+
+
+def get_backend(dataset=None, backend=None):
+    """Returns the I/O backend used by the tools to read and write a dataset.
+    :param - dataset - dataset path the backend is chosen for
+    :param - backend - backend object, "ARCPY", "OPEN", or None to use arcpy when it is installed, except for
+    GeoParquet datasets which arcpy can not write
+    :returns - ArcpyBackend or OpenSourceBackend"""
+    if backend is not None and not isinstance(backend, str):
+        return backend
+    backend_name = str(backend or "").upper()
+    if not backend_name:
+        backend_name = "OPEN" if arcpy is None or dataset_format(dataset) == "Parquet" else "ARCPY"
+    if backend_name == "ARCPY":
+        if arcpy is None:
+            raise ImportError("The ARCPY backend requires arcpy.")
+        return ArcpyBackend()
+    if backend_name == "OPEN":
+        return OpenSourceBackend()
+    raise ValueError("Unknown backend {0}, use ARCPY or OPEN.".format(backend))
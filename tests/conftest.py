@@ -0,0 +1,85 @@
+# --------------------------------
+# Name: conftest.py
+# Purpose: Shared fixtures of the proximity tool tests. The tests run on the open source backend, so they run
+# without ArcGIS.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import os, sys
+from collections import OrderedDict
+import numpy as np
+import pytest
+REPOSITORY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, "Scripts"))
+import proximity_lib as pl
+
+for module_name in ["numpy", "scipy", "pandas", "shapely", "pyogrio"]:
+    pytest.importorskip(module_name)
+shapely = pl.shapely
+
+DATA_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, "Data")
+TEST_CRS = "EPSG:3857"
+TEST_EXTENT = (-13630000.0, 4540000.0, -13620000.0, 4550000.0)
+NEAR_FIELD_PREFIXES = ["DIST_", "X_", "Y_", "ANGLE_", "FID_"]
+
+
+# Function Definitions
+def write_points(dataset, xy, fields=None):
+    """Writes points and their fields to a GeoPackage layer, replacing it.
+    :returns - dataset path"""
+    all_fields = OrderedDict([("UID", np.arange(len(xy), dtype=np.int32))])
+    all_fields.update(fields or {})
+    pl.write_open_dataset(dataset, shapely.points(xy), all_fields, TEST_CRS, "Point")
+    return dataset
+
+
+def random_xy(count, seed):
+    """Returns uniform random coordinates in the test extent."""
+    random_state = np.random.RandomState(seed)
+    xmin, ymin, xmax, ymax = TEST_EXTENT
+    return np.column_stack([random_state.uniform(xmin, xmax, count), random_state.uniform(ymin, ymax, count)])
+
+
+def read_fields(dataset, fields):
+    """Reads fields of a dataset, ordered by object id.
+    :returns - ordered dictionary of field arrays"""
+    oids, geometries, field_data, crs = pl.read_open_dataset(dataset, fields, read_geometry=False)
+    order = np.argsort(oids)
+    return OrderedDict((field, np.asarray(field_data[field], dtype=np.float64)[order]) for field in fields)
+
+
+def near_field_names(layer_names):
+    """Returns the chained near field names of near layers."""
+    return [prefix + layer_name for layer_name in layer_names for prefix in NEAR_FIELD_PREFIXES]
+
+
+@pytest.fixture
+def near_data(tmp_path):
+    """Writes a GeoPackage of input points and two near point layers, and returns a function that copies the input
+    layer to a new GeoPackage, so every run starts from the same input."""
+    near_path = str(tmp_path / "near.gpkg")
+    write_points(near_path + "/schools", random_xy(300, 1))
+    write_points(near_path + "/parks", random_xy(150, 2))
+    in_xy = random_xy(2000, 0)
+
+    def input_copy(name):
+        return write_points(str(tmp_path / "{0}.gpkg".format(name)) + "/homes", in_xy)
+
+    return input_copy, [near_path + "/schools", near_path + "/parks"], ["schools", "parks"]
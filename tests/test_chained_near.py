@@ -0,0 +1,97 @@
+# --------------------------------
+# Name: test_chained_near.py
+# Purpose: Tests that the chained near engines, chained near scoring, and incremental runs agree with a full
+# in process KD-tree run.
+# Current Owner: David Wasserman
+# Last Modified: 10/18/2026
+# Copyright:   (c) David Wasserman
+# Python Version:   2.7/3.6
+# --------------------------------
+# Copyright 2016 David J. Wasserman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# --------------------------------
+# Import Modules
+import numpy as np
+import pytest
+from conftest import near_field_names, random_xy, read_fields, write_points
+import ChainedNearAnalysis
+import ChainedNearScoring
+import ChainedScoring
+
+SEARCH_RADIUS = 600
+
+
+def run_chained_near(in_fc, near_features, **parameters):
+    ChainedNearAnalysis.chained_near_analysis(in_fc, near_features, SEARCH_RADIUS, True, True, True, backend="OPEN",
+                                              **parameters)
+    return in_fc
+
+
+def incremental_run(in_fc, near_features, state_directory):
+    """Runs an incremental chained near analysis with every near field and returns the number of recomputed rows."""
+    return ChainedNearAnalysis.chained_near_analysis(in_fc, near_features, SEARCH_RADIUS, True, True, True,
+                                                     backend="OPEN", incremental_state=state_directory)
+
+
+@pytest.mark.parametrize("parameters", [{"tile_features": 300}, {"workers": 2}], ids=["tiled", "workers"])
+def test_kdtree_modes_match(near_data, parameters):
+    input_copy, near_features, layer_names = near_data
+    fields = near_field_names(layer_names)
+    expected = read_fields(run_chained_near(input_copy("kdtree"), near_features, engine="KDTREE"), fields)
+    assert (expected["DIST_schools"] == -1).any() and (expected["DIST_schools"] > 0).any()
+    results = read_fields(run_chained_near(input_copy("mode"), near_features, engine="KDTREE", **parameters), fields)
+    for field in fields:
+        np.testing.assert_array_equal(results[field], expected[field], err_msg=field)
+
+
+def test_chained_near_scoring_matches_near_and_scoring(near_data):
+    input_copy, near_features, layer_names = near_data
+    thresholds = {"upper": 400, "lower": 100, "within": 5, "outside": -2}
+    in_fc = run_chained_near(input_copy("two_steps"), near_features, engine="KDTREE")
+    ChainedScoring.chained_scoring_func(in_fc, ["DIST_" + layer_name for layer_name in layer_names],
+                                        thresholds["upper"], thresholds["lower"], thresholds["within"],
+                                        thresholds["outside"], backend="OPEN")
+    pipeline_fc = input_copy("pipeline")
+    ChainedNearScoring.chained_near_scoring(pipeline_fc, near_features, SEARCH_RADIUS, thresholds["upper"],
+                                            thresholds["lower"], thresholds["within"], thresholds["outside"],
+                                            keep_distances=True, backend="OPEN")
+    fields = ["SCORE_" + layer_name for layer_name in layer_names] + ["DIST_" + layer_name for layer_name in
+                                                                      layer_names]
+    expected, results = read_fields(in_fc, fields), read_fields(pipeline_fc, fields)
+    for field in fields:
+        np.testing.assert_array_equal(results[field], expected[field], err_msg=field)
+
+
+def test_incremental_runs_fill_new_fields_and_edits(near_data, tmp_path):
+    input_copy, near_features, layer_names = near_data
+    state_directory = str(tmp_path / "state")
+    in_fc = input_copy("incremental")
+    ChainedNearAnalysis.chained_near_analysis(in_fc, near_features, SEARCH_RADIUS, backend="OPEN",
+                                              incremental_state=state_directory)
+    # Requesting the location, angle, and FID fields fills them on every row
+    assert incremental_run(in_fc, near_features, state_directory) == 2000
+    fields = near_field_names(layer_names)
+    expected = read_fields(run_chained_near(input_copy("full"), near_features, engine="KDTREE"), fields)
+    results = read_fields(in_fc, fields)
+    for field in fields:
+        np.testing.assert_array_equal(results[field], expected[field], err_msg=field)
+    # Moving near features only recomputes the affected rows, which match a full run on the edited data
+    school_xy = random_xy(300, 1)
+    school_xy[:30] = random_xy(30, 3)
+    write_points(near_features[0], school_xy)
+    assert 0 < incremental_run(in_fc, near_features, state_directory) < 2000
+    expected = read_fields(run_chained_near(input_copy("full_edited"), near_features, engine="KDTREE"), fields)
+    results = read_fields(in_fc, fields)
+    for field in fields:
+        np.testing.assert_array_equal(results[field], expected[field], err_msg=field)